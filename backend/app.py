@@ -8,27 +8,44 @@ AI-powered security layer for mobile banking with real-time behavior analysis
 # import eventlet
 # eventlet.monkey_patch()
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, make_response, send_file, stream_with_context
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import numpy as np
-import pandas as pd
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler
-from sklearn.cluster import DBSCAN
 import joblib
 import json
 import os
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+import re
 import logging
 from datetime import datetime, timedelta
+from collections import defaultdict, deque, OrderedDict
 import uuid
 import hashlib
+import hmac
 import sqlite3
-from threading import Thread
+from threading import Thread, Lock, Event, Condition, BoundedSemaphore, get_ident, local, enumerate as enumerate_threads
+import atexit
+import copy
+import heapq
+import itertools
+import queue
+import random
+import struct
+import sys
 import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import msgpack
+except ImportError:  # compact binary ingest is optional
+    msgpack = None
+
+try:
+    import psycopg2
+except ImportError:  # only needed for PostgreSQL storage
+    psycopg2 = None
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -40,10 +57,146 @@ socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Default BBCA configuration, overridden per tenant/user by the config store
+DEFAULT_BBCA_CONFIG = {
+    'enabled': True,
+    'sensitivity': 'medium',
+    'monitoringInterval': 5000,
+    'reAuthThreshold': 0.7,
+    'riskThresholds': {
+        'critical': -0.5,
+        'high': -0.2,
+        'medium': 0.0
+    },
+    'contamination': 0.1,
+    'nEstimators': 100,
+    'adaptiveInterval': True,
+    'minMonitoringInterval': 1000,
+    'maxMonitoringInterval': 60000,
+    'targetConcurrency': 32,
+    'ensembleEarlyExit': True,
+    'zScoreNormal': 2.0,
+    'clusterDistanceFactor': 1.0,
+    'warmStartMaxFraction': 0.5,
+    'resultCacheTtl': 10,
+    'idempotencyKeyTtl': 3600,
+    'userRateLimit': 5,
+    'userRateBurst': 20,
+    'ipRateLimit': 50,
+    'ipRateBurst': 200,
+    'trainRateLimit': 0.05,
+    'trainRateBurst': 3,
+    'maxConcurrentTraining': 2,
+    'shedConcurrency': 64,
+    'similarityEnabled': True,
+    'similarityRadius': 0.25,
+    'similarityWindow': 3600,
+    'similarityMinUsers': 3,
+    'analyzeDeadlineMs': 500,
+    'persistencePolicy': 'full',
+    'lowRiskSampleSize': 10,
+    'persistenceSampleWindow': 3600,
+    'slowRequestMs': 1000,
+    'erasureBatchUsers': 100,
+    'erasureChunkRows': 500,
+    'erasurePauseMs': 50,
+    'modelArchiveIdleSeconds': 14 * 24 * 3600,
+    'sessionRiskEnabled': True,
+    'sessionRiskHalfLife': 20,
+    'sessionRiskHysteresis': 0.1,
+    'sessionRiskTtl': 1800
+}
+
+# 'full' stores every session; 'sampled' keeps anomalous and medium+ risk sessions
+# in full and a per-user reservoir of low-risk sessions
+PERSISTENCE_POLICIES = ('full', 'sampled')
+
+# Session risk levels by the smoothed score needed to enter them, highest first;
+# a session only drops out of a level once its score falls sessionRiskHysteresis
+# below that level's entry score
+SESSION_RISK_LEVELS = (('critical', 0.8), ('high', 0.55), ('medium', 0.3))
+
+# Risk score one snapshot contributes to its session, by the snapshot's risk level
+RISK_LEVEL_SCORES = {'low': 0.0, 'medium': 0.4, 'high': 0.7, 'critical': 1.0}
+
+# Analyze requests are shed once in-flight load passes this fraction of
+# shedConcurrency; high priority requests are never shed
+SHED_LOAD_FACTORS = {
+    'low': 0.5,
+    'normal': 1.0
+}
+
+# Decision score offsets applied to riskThresholds per sensitivity setting
+SENSITIVITY_OFFSETS = {
+    'low': -0.05,
+    'medium': 0.0,
+    'high': 0.05
+}
+
+# Feature vector layout produced by BBCAEngine.extract_features
+FEATURE_NAMES = [
+    'typingSpeed', 'keyboardPatternLength',
+    'tapPressureMean', 'tapPressureStd', 'tapPressureMax', 'tapPressureMin',
+    'swipeVelocityMean', 'swipeVelocityStd', 'swipeDistanceMean', 'swipeCount',
+    'orientationAlpha', 'orientationBeta', 'orientationGamma',
+    'scrollSpeed', 'scrollFrequency',
+    'clickPressure', 'clickDuration',
+    'sessionDuration', 'mouseMovements', 'loginDuration',
+    'screenTime', 'featuresUsedCount', 'transactionFrequency'
+]
+
+# Per-user rows covered by data purge and export jobs, as table -> exported
+# columns. Purges delete in this order, sessions first so a concurrent retrain
+# finds no training data; every step is idempotent, so a rerun finishes it.
+USER_DATA_TABLES = {
+    'behavior_sessions': ('session_id', 'behavior_data', 'risk_score', 'anomaly_detected', 'timestamp', 'sampled'),
+    'security_events': ('event_id', 'event_type', 'severity', 'description', 'timestamp'),
+    'user_session_counters': ('window_start', 'sessions', 'sampled', 'risk_score_sum'),
+    'session_risk': ('session_key', 'risk_level', 'score_sum', 'weight', 'updated_at'),
+    'behavior_models': ('model_data', 'confidence', 'last_updated', 'created_at')
+}
+
+# Tenant IDs become directory names, so keep them to a safe character set
+TENANT_ID_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+def is_finite_number(value):
+    """Whether value is an int or float (bools excluded) other than NaN and +-inf"""
+    if isinstance(value, bool) or not isinstance(value, (int, float)):
+        return False
+    try:
+        return bool(np.isfinite(float(value)))
+    except OverflowError:
+        # Integers too large for a float
+        return False
+
+def retire_file(path, still_stale):
+    """Delete path if still_stale(stat) holds for the file actually removed; returns whether it was
+
+    The file is renamed aside before it is checked, so a writer replacing path
+    concurrently (publish_file) either lands after the rename and is left alone,
+    or was the file moved aside and is linked back unless something newer took
+    its place.
+    """
+    aside = f'{path}.{os.getpid()}.{get_ident()}.retired'
+    try:
+        os.rename(path, aside)
+    except FileNotFoundError:
+        return False
+    try:
+        if still_stale(os.stat(aside)):
+            return True
+        try:
+            os.link(aside, path)
+        except FileExistsError:
+            pass
+        return False
+    finally:
+        os.remove(aside)
+
 # Database setup
-def init_db():
+def init_db(db_path='bbca_data.db'):
     """Initialize SQLite database for behavior data"""
-    conn = sqlite3.connect('bbca_data.db')
+    conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
     
     # User behavior models table
@@ -66,14 +219,22 @@ def init_db():
             risk_score REAL,
             anomaly_detected BOOLEAN,
             timestamp TIMESTAMP,
+            sampled INTEGER DEFAULT 0,
             FOREIGN KEY (user_id) REFERENCES behavior_models (user_id)
         )
     ''')
     
-    # Security events table
+    # Databases created before sampled persistence lack the sampled column
+    cursor.execute('PRAGMA table_info(behavior_sessions)')
+    if 'sampled' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE behavior_sessions ADD COLUMN sampled INTEGER DEFAULT 0')
+    
+    # Security events table; seq orders the SIEM feed and, being AUTOINCREMENT,
+    # is never reused after the newest events are purged
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS security_events (
-            event_id TEXT PRIMARY KEY,
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            event_id TEXT UNIQUE,
             user_id TEXT,
             event_type TEXT,
             severity TEXT,
@@ -82,386 +243,4130 @@ def init_db():
         )
     ''')
     
+    # Databases created before the feed sequence keyed events by event_id and
+    # ordered the feed by rowid; rebuild them keeping rowids as seq so feed
+    # cursors stay valid
+    cursor.execute('PRAGMA table_info(security_events)')
+    if 'seq' not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute('ALTER TABLE security_events RENAME TO security_events_old')
+        cursor.execute('''
+            CREATE TABLE security_events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                event_id TEXT UNIQUE,
+                user_id TEXT,
+                event_type TEXT,
+                severity TEXT,
+                description TEXT,
+                timestamp TIMESTAMP
+            )
+        ''')
+        cursor.execute('''
+            INSERT INTO security_events
+            (seq, event_id, user_id, event_type, severity, description, timestamp)
+            SELECT rowid, event_id, user_id, event_type, severity, description, timestamp
+            FROM security_events_old ORDER BY rowid
+        ''')
+        cursor.execute('DROP TABLE security_events_old')
+    
+    # Per-user session lookups (training windows, bulk retraining)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_behavior_sessions_user_time
+        ON behavior_sessions (user_id, timestamp)
+    ''')
+    
+    # Per-user event lookups (security events route, data erasure and export)
+    cursor.execute('''
+        CREATE INDEX IF NOT EXISTS idx_security_events_user_time
+        ON security_events (user_id, timestamp)
+    ''')
+    
+    # Hourly risk rollups maintained from the analyze/event write path
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS risk_rollups (
+            bucket_start TIMESTAMP,
+            cohort TEXT,
+            risk_level TEXT,
+            sessions INTEGER DEFAULT 0,
+            anomalies INTEGER DEFAULT 0,
+            events INTEGER DEFAULT 0,
+            risk_score_sum REAL DEFAULT 0,
+            PRIMARY KEY (bucket_start, cohort, risk_level)
+        )
+    ''')
+    
+    # Low-risk sessions seen per user and sample window under the sampled policy,
+    # including those that were folded into the counters instead of stored
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_session_counters (
+            user_id TEXT,
+            window_start TIMESTAMP,
+            sessions INTEGER DEFAULT 0,
+            sampled INTEGER DEFAULT 0,
+            risk_score_sum REAL DEFAULT 0,
+            PRIMARY KEY (user_id, window_start)
+        )
+    ''')
+    
+    # Smoothed per-session risk state, written when a session changes risk level
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS session_risk (
+            user_id TEXT,
+            session_key TEXT,
+            risk_level TEXT,
+            score_sum REAL,
+            weight REAL,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (user_id, session_key)
+        )
+    ''')
+    
+    # Versioned configuration overrides (scope: global, tenant:<id>, user:<id>)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS bbca_config (
+            scope TEXT PRIMARY KEY,
+            config TEXT,
+            version INTEGER,
+            updated_at TIMESTAMP
+        )
+    ''')
+    
     conn.commit()
     conn.close()
 
+def publish_file(path, write):
+    """Atomically replace path with what write(file) produces: temp file, fsync, rename
+
+    Readers opening path see either the previous complete file or the new one,
+    never a partial write.
+    """
+    directory = os.path.dirname(path) or '.'
+    tmp_path = f'{path}.{os.getpid()}.{get_ident()}.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            write(f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+# Compact model file layout: magic, 4-byte little-endian header length, JSON
+# header, then 8-byte aligned raw arrays at the offsets listed in the header
+COMPACT_MODEL_MAGIC = b'BBCACMP1'
+
+def average_path_length(n_samples):
+    """Expected isolation depth of an unsuccessful BST search among n_samples points"""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    lengths = np.zeros_like(n_samples)
+    lengths[n_samples == 2] = 1.0
+    many = n_samples > 2
+    lengths[many] = 2.0 * (np.log(n_samples[many] - 1.0) + np.euler_gamma) - 2.0 * (n_samples[many] - 1.0) / n_samples[many]
+    return lengths
+
+class CompactScaler:
+    """StandardScaler.transform over float32 parameters"""
+
+    __slots__ = ('mean', 'scale')
+
+    def __init__(self, mean, scale):
+        self.mean = mean
+        self.scale = scale
+
+    def transform(self, features):
+        return (np.asarray(features, dtype=np.float32) - self.mean) / self.scale
+
+class CompactForest:
+    """IsolationForest.decision_function over all trees flattened into shared node arrays"""
+
+    __slots__ = ('roots', 'left', 'right', 'feature', 'threshold', 'leaf_depth',
+                 'max_depth', 'denominator', 'offset')
+
+    def __init__(self, roots, left, right, feature, threshold, leaf_depth, max_depth, denominator, offset):
+        self.roots = roots
+        self.left = left
+        self.right = right
+        self.feature = feature
+        self.threshold = threshold
+        self.leaf_depth = leaf_depth
+        self.max_depth = max_depth
+        self.denominator = denominator
+        self.offset = offset
+
+    @classmethod
+    def from_isolation_forest(cls, isolation_forest):
+        roots, lefts, rights, features, thresholds, leaf_depths = [], [], [], [], [], []
+        node_offset = 0
+        max_depth = 0
+        for estimator, estimator_features in zip(isolation_forest.estimators_, isolation_forest.estimators_features_):
+            tree = estimator.tree_
+            internal = tree.children_left >= 0
+            
+            # Children always follow their parent in sklearn's node order
+            depth = np.zeros(tree.node_count, dtype=np.int64)
+            for node in np.flatnonzero(internal):
+                depth[tree.children_left[node]] = depth[tree.children_right[node]] = depth[node] + 1
+            
+            # sklearn compares float32 inputs against float64 thresholds; rounding
+            # thresholds down to float32 keeps every split decision identical
+            threshold = tree.threshold.astype(np.float32)
+            rounded_up = threshold > tree.threshold
+            threshold[rounded_up] = np.nextafter(threshold[rounded_up], np.float32(-np.inf))
+            
+            roots.append(node_offset)
+            lefts.append(np.where(internal, tree.children_left + node_offset, -1))
+            rights.append(np.where(internal, tree.children_right + node_offset, -1))
+            features.append(np.where(internal, np.asarray(estimator_features)[np.maximum(tree.feature, 0)], 0))
+            thresholds.append(threshold)
+            leaf_depths.append(depth + average_path_length(tree.n_node_samples))
+            node_offset += tree.node_count
+            max_depth = max(max_depth, int(depth.max()))
+        
+        return cls(
+            np.array(roots, dtype=np.int32),
+            np.concatenate(lefts).astype(np.int32),
+            np.concatenate(rights).astype(np.int32),
+            np.concatenate(features).astype(np.int32),
+            np.concatenate(thresholds),
+            np.concatenate(leaf_depths).astype(np.float32),
+            max_depth,
+            float(len(isolation_forest.estimators_) * average_path_length([isolation_forest.max_samples_])[0]),
+            float(isolation_forest.offset_)
+        )
+
+    def decision_function(self, features):
+        features = np.asarray(features, dtype=np.float32)
+        rows = np.arange(len(features))[:, np.newaxis]
+        # Walk every tree for every row at once, one level per step
+        nodes = np.repeat(self.roots[np.newaxis, :], len(features), axis=0)
+        for _ in range(self.max_depth):
+            left = self.left[nodes]
+            internal = left >= 0
+            if not internal.any():
+                break
+            go_left = features[rows, self.feature[nodes]] <= self.threshold[nodes]
+            nodes = np.where(internal, np.where(go_left, left, self.right[nodes]), nodes)
+        
+        if not self.denominator:
+            return np.full(len(features), -1.0 - self.offset, dtype=np.float32)
+        depths = self.leaf_depth[nodes].sum(axis=1)
+        return (-np.exp2(-depths / np.float32(self.denominator)) - np.float32(self.offset)).astype(np.float32)
+
+class CompactModel:
+    """Array-backed float32 scoring view of a trained model, readable in place from an mmap
+
+    Exposes the model_data keys score_model and the detectors read, so it can be
+    scored exactly like the pickled dict. Worker processes that map the same
+    file share its pages through the OS page cache.
+    """
+
+    __slots__ = ('version', 'scaler', 'isolation_forest', 'feature_means', 'feature_stds',
+                 'core_samples', 'cluster_eps', 'normal_score', 'source', 'nbytes', 'shared')
+
+    ARRAYS = {
+        'scaler_mean': lambda model: model.scaler.mean,
+        'scaler_scale': lambda model: model.scaler.scale,
+        'roots': lambda model: model.isolation_forest.roots,
+        'left': lambda model: model.isolation_forest.left,
+        'right': lambda model: model.isolation_forest.right,
+        'feature': lambda model: model.isolation_forest.feature,
+        'threshold': lambda model: model.isolation_forest.threshold,
+        'leaf_depth': lambda model: model.isolation_forest.leaf_depth,
+        'feature_means': lambda model: model.feature_means,
+        'feature_stds': lambda model: model.feature_stds,
+        'core_samples': lambda model: model.core_samples
+    }
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not None
+
+    def get(self, key, default=None):
+        value = getattr(self, key, None) if key in self.__slots__ else None
+        return default if value is None else value
+
+    @classmethod
+    def from_model_data(cls, model_data):
+        model = cls()
+        scaler = model_data['scaler']
+        model.version = model_data.get('version', 1)
+        model.scaler = CompactScaler(scaler.mean_.astype(np.float32), scaler.scale_.astype(np.float32))
+        model.isolation_forest = CompactForest.from_isolation_forest(model_data['isolation_forest'])
+        model.feature_means = np.asarray(model_data['feature_means'], dtype=np.float32)
+        model.feature_stds = np.asarray(model_data['feature_stds'], dtype=np.float32)
+        
+        core_samples = model_data.get('core_samples')
+        if core_samples is None:
+            core_samples = getattr(model_data['dbscan'], 'components_', None)
+        if core_samples is None:
+            core_samples = np.empty((0, len(model.feature_means)))
+        model.core_samples = np.asarray(core_samples, dtype=np.float32)
+        model.cluster_eps = float(model_data.get('cluster_eps') or model_data['dbscan'].eps)
+        model.normal_score = model_data.get('normal_score')
+        model.source = None
+        model.nbytes = sum(array(model).nbytes for array in cls.ARRAYS.values())
+        model.shared = False
+        return model
+
+    def save(self, path, source=None):
+        """Publish atomically so readers never map a half-written file
+
+        source identifies the pickle this was converted from, so a stale compact
+        file is detected after the pickle is replaced.
+        """
+        header = {
+            'version': self.version,
+            'source': list(source) if source else None,
+            'cluster_eps': self.cluster_eps,
+            'normal_score': self.normal_score,
+            'max_depth': self.isolation_forest.max_depth,
+            'denominator': self.isolation_forest.denominator,
+            'offset': self.isolation_forest.offset,
+            'arrays': {}
+        }
+        arrays = [(name, np.ascontiguousarray(array(self))) for name, array in self.ARRAYS.items()]
+        position = 0
+        for name, array in arrays:
+            header['arrays'][name] = [array.dtype.str, list(array.shape), position]
+            position += (array.nbytes + 7) // 8 * 8
+        
+        header_bytes = json.dumps(header).encode()
+        # Pad the header so the data section starts 8-byte aligned
+        header_bytes += b' ' * (-(len(COMPACT_MODEL_MAGIC) + 4 + len(header_bytes)) % 8)
+        
+        def write(f):
+            f.write(COMPACT_MODEL_MAGIC)
+            f.write(struct.pack('<I', len(header_bytes)))
+            f.write(header_bytes)
+            for _, array in arrays:
+                f.write(array.tobytes())
+                f.write(b'\0' * (-array.nbytes % 8))
+        publish_file(path, write)
+
+    @classmethod
+    def load(cls, path):
+        """Map a compact model file read-only; arrays are views into the shared mapping"""
+        with open(path, 'rb') as f:
+            if f.read(len(COMPACT_MODEL_MAGIC)) != COMPACT_MODEL_MAGIC:
+                raise ValueError(f"Not a compact model file: {path}")
+            header_length, = struct.unpack('<I', f.read(4))
+            header = json.loads(f.read(header_length))
+        data_start = len(COMPACT_MODEL_MAGIC) + 4 + header_length
+        
+        mapping = np.memmap(path, dtype=np.uint8, mode='r')
+        arrays = {}
+        for name, (dtype, shape, position) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            count = int(np.prod(shape))
+            arrays[name] = np.frombuffer(mapping, dtype=dtype, count=count,
+                                         offset=data_start + position).reshape(shape)
+        
+        model = cls()
+        model.version = header['version']
+        model.scaler = CompactScaler(arrays['scaler_mean'], arrays['scaler_scale'])
+        model.isolation_forest = CompactForest(
+            arrays['roots'], arrays['left'], arrays['right'], arrays['feature'], arrays['threshold'],
+            arrays['leaf_depth'], header['max_depth'], header['denominator'], header['offset']
+        )
+        model.feature_means = arrays['feature_means']
+        model.feature_stds = arrays['feature_stds']
+        model.core_samples = arrays['core_samples']
+        model.cluster_eps = header['cluster_eps']
+        model.normal_score = header['normal_score']
+        model.source = tuple(header['source']) if header.get('source') else None
+        model.nbytes = len(mapping)
+        model.shared = True
+        return model
+
+class ModelSnapshot:
+    """One published version of a loaded model; never mutated after publication"""
+
+    __slots__ = ('token', 'size', 'model_data')
+
+    def __init__(self, token, size, model_data):
+        self.token = token
+        self.size = size
+        self.model_data = model_data
+
+class ModelCache:
+    """Loaded user models bounded by an approximate memory budget, with lock-free reads
+
+    Readers fetch the current ModelSnapshot with a single dict lookup and never
+    take the lock. Publishing a new version replaces the dict entry in one step
+    (RCU-style), so in-flight scoring keeps using the snapshot it already holds
+    while new requests see the new one. The lock only serializes writers.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        # key -> ModelSnapshot
+        self.entries = {}
+        # key -> access tick; written by readers without the lock, read by eviction
+        self.last_used = {}
+        self.ticks = itertools.count()
+        self.bytes = 0
+        # Counters are bumped without the lock and may undercount slightly under contention
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, key, token):
+        """Return the published model for key if it matches the on-disk token"""
+        snapshot = self.entries.get(key)
+        if snapshot is None or snapshot.token != token:
+            return None
+        self.last_used[key] = next(self.ticks)
+        self.hits += 1
+        return snapshot.model_data
+
+    def get(self, key, token, loader, size):
+        """Return the model for key, loading and publishing it if missing or outdated"""
+        model_data = self.lookup(key, token)
+        if model_data is None:
+            self.misses += 1
+            model_data = loader()
+            if model_data is not None:
+                self.publish(key, token, model_data, size)
+        return model_data
+
+    def publish(self, key, token, model_data, size):
+        """Swap in a new model version; compact models know their mapped size"""
+        snapshot = ModelSnapshot(token, getattr(model_data, 'nbytes', size), model_data)
+        with self.lock:
+            previous = self.entries.get(key)
+            # A slow concurrent load must not replace a newer version
+            if previous is not None and previous.token[1] > token[1]:
+                return
+            self.entries[key] = snapshot
+            self.last_used[key] = next(self.ticks)
+            self.bytes += snapshot.size - (previous.size if previous is not None else 0)
+            if self.bytes > self.max_bytes:
+                self._evict_least_recent()
+
+    def _evict_least_recent(self):
+        """Evict down to 90% of the budget so eviction is not paid on every publish"""
+        target = self.max_bytes * 0.9
+        for key in sorted(self.entries, key=lambda key: self.last_used.get(key, 0)):
+            if self.bytes <= target or len(self.entries) <= 1:
+                break
+            self.bytes -= self.entries.pop(key).size
+            self.last_used.pop(key, None)
+
+    def evict(self, key):
+        with self.lock:
+            snapshot = self.entries.pop(key, None)
+            self.last_used.pop(key, None)
+            if snapshot is not None:
+                self.bytes -= snapshot.size
+
+    def peek(self, key):
+        """Return the published model without touching disk"""
+        snapshot = self.entries.get(key)
+        return snapshot.model_data if snapshot is not None else None
+
+    def stats(self, largest=5):
+        """Cache counters plus per-model memory; shared bytes are mmap-backed and host-wide"""
+        with self.lock:
+            sizes = [(snapshot.size, key, getattr(snapshot.model_data, 'shared', False))
+                     for key, snapshot in self.entries.items()]
+            return {
+                'models': len(self.entries),
+                'bytes': self.bytes,
+                'sharedBytes': sum(size for size, _, shared in sizes if shared),
+                'avgModelBytes': self.bytes // len(sizes) if sizes else 0,
+                'largestModels': [
+                    {'model': os.path.basename(key), 'bytes': size, 'shared': shared}
+                    for size, key, shared in sorted(sizes, reverse=True)[:largest]
+                ],
+                'maxBytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses
+            }
+
+class ModelTierStats:
+    """Which tier served each model lookup and how long promotions into memory took
+
+    hot is the in-memory cache, warm the model files in models/, cold the
+    compressed archive. Hit counters are bumped without the lock, like the
+    model cache's, so lookups never contend on it.
+    """
+
+    TIERS = ('hot', 'warm', 'cold', 'missing')
+
+    def __init__(self):
+        self.lock = Lock()
+        self.hits = dict.fromkeys(self.TIERS, 0)
+        # tier -> [promotions, total seconds, max seconds]
+        self.promotions = {'warm': [0, 0.0, 0.0], 'cold': [0, 0.0, 0.0]}
+
+    def record(self, tier, seconds=None):
+        self.hits[tier] += 1
+        if seconds is not None:
+            with self.lock:
+                promotion = self.promotions[tier]
+                promotion[0] += 1
+                promotion[1] += seconds
+                promotion[2] = max(promotion[2], seconds)
+
+    def stats(self):
+        hits = dict(self.hits)
+        total = sum(hits.values())
+        with self.lock:
+            promotions = {tier: list(values) for tier, values in self.promotions.items()}
+        return {
+            'hits': hits,
+            'hitRates': {tier: count / total if total else 0.0 for tier, count in hits.items()},
+            'promotionMs': {
+                tier: {
+                    'count': count,
+                    'avg': round(seconds / count * 1000, 3) if count else 0.0,
+                    'max': round(max_seconds * 1000, 3)
+                }
+                for tier, (count, seconds, max_seconds) in promotions.items()
+            }
+        }
+
+class ModelArchive:
+    """Cold tier: idle users' model files packed into one compressed zip per shard
+
+    An entry is only read when the user has no warm model file; promotion
+    extracts it back into models/. Entries superseded by a warm file are
+    dropped the next time their shard is rewritten. Shards are replaced
+    atomically, so readers in other processes always see a complete archive.
+    """
+
+    def __init__(self, directory, model_path, shards=64):
+        self.directory = directory
+        self.model_path = model_path
+        self.shards = shards
+        # Serializes shard rewrites and promotions within this process
+        self.lock = Lock()
+        # shard -> (mtime_ns, user IDs) as last read from disk
+        self.indexes = {}
+
+    def shard_for(self, user_id):
+        return zlib.crc32(user_id.encode()) % self.shards
+
+    def shard_path(self, shard):
+        return os.path.join(self.directory, f'shard-{shard:03d}.zip')
+
+    def names(self, shard):
+        """User IDs archived in a shard, re-read when the shard file changed on disk"""
+        path = self.shard_path(shard)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return frozenset()
+        index = self.indexes.get(shard)
+        if index is None or index[0] != mtime:
+            with zipfile.ZipFile(path) as archive:
+                index = self.indexes[shard] = (mtime, frozenset(archive.namelist()))
+        return index[1]
+
+    def __contains__(self, user_id):
+        return user_id in self.names(self.shard_for(user_id))
+
+    def promote(self, user_id):
+        """Restore an archived model file into the warm tier; False if none is archived"""
+        if user_id not in self:
+            return False
+        path = self.model_path(user_id)
+        with self.lock:
+            # A concurrent request may have promoted it while this one waited
+            if not os.path.exists(path):
+                with zipfile.ZipFile(self.shard_path(self.shard_for(user_id))) as archive:
+                    data = archive.read(user_id)
+                publish_file(path, lambda f: f.write(data))
+        return True
+
+    def rewrite(self, shard, added=None, dropped=()):
+        """Publish a new version of a shard with entries added and dropped; caller holds the lock"""
+        added = added or {}
+        path = self.shard_path(shard)
+        
+        def write(f):
+            with zipfile.ZipFile(f, 'w', zipfile.ZIP_DEFLATED, compresslevel=9) as new:
+                if os.path.exists(path):
+                    with zipfile.ZipFile(path) as old:
+                        for name in old.namelist():
+                            if name in added or name in dropped or os.path.exists(self.model_path(name)):
+                                continue
+                            new.writestr(old.getinfo(name), old.read(name))
+                for user_id, data in added.items():
+                    new.writestr(user_id, data)
+        
+        os.makedirs(self.directory, exist_ok=True)
+        publish_file(path, write)
+        self.indexes.pop(shard, None)
+
+    def pack(self, user_ids):
+        """Archive the users' warm model files and return (user_id, (inode, mtime_ns)) of the files packed"""
+        by_shard = defaultdict(list)
+        for user_id in user_ids:
+            by_shard[self.shard_for(user_id)].append(user_id)
+        
+        packed = []
+        with self.lock:
+            for shard, shard_users in by_shard.items():
+                added, identities = {}, {}
+                for user_id in shard_users:
+                    try:
+                        with open(self.model_path(user_id), 'rb') as f:
+                            stat = os.fstat(f.fileno())
+                            identities[user_id] = (stat.st_ino, stat.st_mtime_ns)
+                            added[user_id] = f.read()
+                    except FileNotFoundError:
+                        continue
+                if added:
+                    self.rewrite(shard, added)
+                    packed.extend(identities.items())
+        return packed
+
+    def discard(self, user_ids):
+        """Remove the users' archived models; returns how many entries were dropped"""
+        by_shard = defaultdict(set)
+        for user_id in user_ids:
+            by_shard[self.shard_for(user_id)].add(user_id)
+        
+        dropped = 0
+        with self.lock:
+            for shard, shard_users in by_shard.items():
+                archived = shard_users & self.names(shard)
+                if archived:
+                    self.rewrite(shard, dropped=archived)
+                    dropped += len(archived)
+        return dropped
+
+    def stats(self):
+        users, size = 0, 0
+        for shard in range(self.shards):
+            names = self.names(shard)
+            if names:
+                users += len(names)
+                size += os.path.getsize(self.shard_path(shard))
+        return {'shards': self.shards, 'archivedModels': users, 'bytes': size}
+
 class BBCAEngine:
     """AI-powered Behavior-Based Continuous Authentication Engine"""
     
-    def __init__(self):
-        self.scaler = StandardScaler()
-        self.isolation_forest = IsolationForest(
-            contamination=0.1,
-            random_state=42,
-            n_estimators=100
-        )
-        self.dbscan = DBSCAN(eps=0.5, min_samples=5)
-        self.models_dir = 'models'
+    def __init__(self, models_dir='models', model_cache=None, tier_stats=None):
+        self.models_dir = models_dir
         self.ensure_models_dir()
+        self.model_cache = model_cache or ModelCache(int(os.getenv('BBCA_MODEL_CACHE_MB', '512')) * 1024 * 1024)
+        # Hot: model_cache, warm: files in models_dir, cold: compressed shards in models_dir/archive
+        self.tier_stats = tier_stats or ModelTierStats()
+        self.archive = ModelArchive(os.path.join(models_dir, 'archive'), self.model_path,
+                                    int(os.getenv('BBCA_MODEL_ARCHIVE_SHARDS', '64')))
+        # Memory-optimized scoring: float32 features and mmap-shared compact models
+        self.compact = os.getenv('BBCA_COMPACT_MODELS', '').lower() in ('1', 'true', 'yes')
+        self.feature_dtype = np.float32 if self.compact else np.float64
+        # Cheap detectors run before the isolation forest, in order
+        self.detectors = [self.zscore_detector, self.cluster_detector]
         
     def ensure_models_dir(self):
         """Ensure models directory exists"""
         if not os.path.exists(self.models_dir):
             os.makedirs(self.models_dir)
     
-    def extract_features(self, behavior_data):
-        """Extract ML features from behavior data"""
-        try:
-            features = []
-            
-            # Typing behavior features
-            features.append(behavior_data.get('typingSpeed', 0))
-            features.append(len(behavior_data.get('keyboardPattern', '')))
-            
-            # Touch/tap features
-            tap_pressure = behavior_data.get('tapPressure', [])
-            if tap_pressure:
-                features.extend([
-                    np.mean(tap_pressure),
-                    np.std(tap_pressure),
-                    np.max(tap_pressure),
-                    np.min(tap_pressure)
-                ])
-            else:
-                features.extend([0, 0, 0, 0])
-            
-            # Swipe gesture features
-            swipe_gestures = behavior_data.get('swipeGestures', [])
-            if swipe_gestures:
-                velocities = [g.get('velocity', 0) for g in swipe_gestures]
-                distances = [g.get('distance', 0) for g in swipe_gestures]
-                features.extend([
-                    np.mean(velocities),
-                    np.std(velocities),
-                    np.mean(distances),
-                    len(swipe_gestures)
-                ])
-            else:
-                features.extend([0, 0, 0, 0])
-            
-            # Device orientation features
-            orientation = behavior_data.get('deviceOrientation', {})
-            features.extend([
-                orientation.get('alpha', 0),
-                orientation.get('beta', 0),
-                orientation.get('gamma', 0)
-            ])
-            
-            # Scroll pattern features
-            scroll_pattern = behavior_data.get('scrollPattern', {})
-            features.extend([
-                scroll_pattern.get('speed', 0),
-                scroll_pattern.get('frequency', 0)
-            ])
-            
-            # Click pattern features
-            click_pattern = behavior_data.get('clickPattern', {})
-            features.extend([
-                click_pattern.get('pressure', 0),
-                click_pattern.get('duration', 0)
-            ])
-            
-            # Session features
+    def summarize_behavior(self, behavior_data):
+        """Aggregate raw behavior data into named feature values"""
+        features = []
+        
+        # Typing behavior features
+        features.append(behavior_data.get('typingSpeed', 0))
+        features.append(len(behavior_data.get('keyboardPattern', '')))
+        
+        # Touch/tap features
+        tap_pressure = behavior_data.get('tapPressure', [])
+        if tap_pressure:
             features.extend([
-                behavior_data.get('sessionDuration', 0),
-                behavior_data.get('mouseMovements', 0),
-                behavior_data.get('loginDuration', 0)
+                np.mean(tap_pressure),
+                np.std(tap_pressure),
+                np.max(tap_pressure),
+                np.min(tap_pressure)
             ])
-            
-            # App usage features
-            app_usage = behavior_data.get('appUsagePattern', {})
+        else:
+            features.extend([0, 0, 0, 0])
+        
+        # Swipe gesture features
+        swipe_gestures = behavior_data.get('swipeGestures', [])
+        if swipe_gestures:
+            velocities = [g.get('velocity', 0) for g in swipe_gestures]
+            distances = [g.get('distance', 0) for g in swipe_gestures]
             features.extend([
-                app_usage.get('screenTime', 0),
-                len(app_usage.get('featuresUsed', [])),
-                app_usage.get('transactionFrequency', 0)
+                np.mean(velocities),
+                np.std(velocities),
+                np.mean(distances),
+                len(swipe_gestures)
             ])
-            
-            return np.array(features).reshape(1, -1)
+        else:
+            features.extend([0, 0, 0, 0])
+        
+        # Device orientation features
+        orientation = behavior_data.get('deviceOrientation', {})
+        features.extend([
+            orientation.get('alpha', 0),
+            orientation.get('beta', 0),
+            orientation.get('gamma', 0)
+        ])
+        
+        # Scroll pattern features
+        scroll_pattern = behavior_data.get('scrollPattern', {})
+        features.extend([
+            scroll_pattern.get('speed', 0),
+            scroll_pattern.get('frequency', 0)
+        ])
+        
+        # Click pattern features
+        click_pattern = behavior_data.get('clickPattern', {})
+        features.extend([
+            click_pattern.get('pressure', 0),
+            click_pattern.get('duration', 0)
+        ])
+        
+        # Session features
+        features.extend([
+            behavior_data.get('sessionDuration', 0),
+            behavior_data.get('mouseMovements', 0),
+            behavior_data.get('loginDuration', 0)
+        ])
+        
+        # App usage features
+        app_usage = behavior_data.get('appUsagePattern', {})
+        features.extend([
+            app_usage.get('screenTime', 0),
+            len(app_usage.get('featuresUsed', [])),
+            app_usage.get('transactionFrequency', 0)
+        ])
+        
+        return {name: float(value) for name, value in zip(FEATURE_NAMES, features)}
+    
+    def extract_features(self, behavior_data):
+        """Extract ML features from behavior data or a compact feature summary"""
+        try:
+            summary = behavior_data.get('featureSummary')
+            if summary is None:
+                summary = self.summarize_behavior(behavior_data)
+            return np.array([float(summary.get(name, 0)) for name in FEATURE_NAMES],
+                            dtype=self.feature_dtype).reshape(1, -1)
             
         except Exception as e:
             logger.error(f"Feature extraction error: {e}")
             # Return default feature vector
-            return np.zeros((1, 25))
+            return np.zeros((1, len(FEATURE_NAMES)), dtype=self.feature_dtype)
+    
+    def risk_thresholds(self, config):
+        """Resolve decision score thresholds for the configured sensitivity"""
+        offset = SENSITIVITY_OFFSETS.get(config.get('sensitivity'), 0.0)
+        thresholds = config.get('riskThresholds', DEFAULT_BBCA_CONFIG['riskThresholds'])
+        return {level: value + offset for level, value in thresholds.items()}
     
-    def train_user_model(self, user_id, behavior_sessions):
-        """Train personalized ML model for user"""
+    def model_path(self, user_id):
+        return os.path.join(self.models_dir, f'{user_id}_model.pkl')
+    
+    def compact_model_path(self, user_id):
+        return os.path.join(self.models_dir, f'{user_id}_model.cmp')
+    
+    def cached_model(self, user_id):
+        """The user's model if it is already in memory, without any disk access"""
+        path = self.compact_model_path(user_id) if self.compact else self.model_path(user_id)
+        return self.model_cache.peek(path)
+    
+    def model_token(self, user_id):
+        """(inode, mtime) of the published model file and its size; a new publish changes both"""
         try:
-            if len(behavior_sessions) < 5:
-                logger.info(f"Insufficient data for user {user_id}, need at least 5 sessions")
+            stat = os.stat(self.model_path(user_id))
+            return (stat.st_ino, stat.st_mtime_ns), stat.st_size
+        except FileNotFoundError:
+            return None, 0
+    
+    def write_compact_model(self, user_id, model_data, source):
+        CompactModel.from_model_data(model_data).save(self.compact_model_path(user_id), source)
+    
+    def load_compact_model(self, user_id, token):
+        compact_path = self.compact_model_path(user_id)
+        try:
+            compact = CompactModel.load(compact_path)
+            if compact.source == token:
+                return compact
+        except (FileNotFoundError, ValueError):
+            pass
+        
+        # Convert models trained before compact mode was enabled (or by another writer)
+        self.write_compact_model(user_id, joblib.load(self.model_path(user_id)), token)
+        return CompactModel.load(compact_path)
+    
+    def load_model(self, user_id):
+        """Get a user's model from the in-memory cache, loading it from disk or the archive on first use"""
+        token, size = self.model_token(user_id)
+        cache_key = self.compact_model_path(user_id) if self.compact else self.model_path(user_id)
+        tier = 'warm'
+        started = time.perf_counter()
+        if token is None:
+            self.model_cache.evict(cache_key)
+            with request_tracer.span('model_promote'):
+                promoted = self.archive.promote(user_id)
+            if not promoted:
+                self.tier_stats.record('missing')
                 return None
+            tier = 'cold'
+            token, size = self.model_token(user_id)
+        
+        model_data = self.model_cache.lookup(cache_key, token)
+        if model_data is not None:
+            self.tier_stats.record('hot')
+            return model_data
+        
+        with request_tracer.span('model_load'):
+            if self.compact:
+                model_data = self.model_cache.get(cache_key, token, lambda: self.load_compact_model(user_id, token), size)
+            else:
+                model_path = self.model_path(user_id)
+                model_data = self.model_cache.get(cache_key, token, lambda: joblib.load(model_path), size)
+        self.tier_stats.record(tier, time.perf_counter() - started)
+        return model_data
+    
+    def publish_model(self, user_id, model_data):
+        """Write a trained model atomically and swap it into the cache in one step"""
+        model_path = self.model_path(user_id)
+        publish_file(model_path, lambda f: joblib.dump(model_data, f))
+        token, size = self.model_token(user_id)
+        if self.compact:
+            compact_path = self.compact_model_path(user_id)
+            self.write_compact_model(user_id, model_data, token)
+            self.model_cache.publish(compact_path, token, CompactModel.load(compact_path), size)
+        else:
+            self.model_cache.publish(model_path, token, model_data, size)
+        return model_path
+    
+    def remove_model_files(self, user_id, identity=None):
+        """Drop the user's warm model files and cache entries
+
+        With identity, the (inode, mtime_ns) the model file had when it was
+        archived, a model retrained since (by this or another process) is kept.
+        """
+        model_path = self.model_path(user_id)
+        compact_path = self.compact_model_path(user_id)
+        if identity is None:
+            removed = 0
+            for path in (model_path, compact_path):
+                self.model_cache.evict(path)
+                try:
+                    os.remove(path)
+                    removed += 1
+                except FileNotFoundError:
+                    pass
+            return removed
+        
+        if not retire_file(model_path, lambda stat: (stat.st_ino, stat.st_mtime_ns) == identity):
+            return 0
+        # The compact file may already belong to a model published after the retired one
+        removed = 1 + retire_file(compact_path, lambda stat: not os.path.exists(model_path))
+        self.model_cache.evict(model_path)
+        self.model_cache.evict(compact_path)
+        return removed
+    
+    def delete_models(self, user_ids):
+        """Remove the users' models from every tier; returns model files and archive entries removed"""
+        removed = sum(self.remove_model_files(user_id) for user_id in user_ids)
+        return removed + self.archive.discard(user_ids)
+    
+    def archive_models(self, active_users, idle_before):
+        """Move warm model files older than idle_before (epoch seconds) to the archive, except active users'"""
+        idle = []
+        with os.scandir(self.models_dir) as entries:
+            for entry in entries:
+                if not entry.name.endswith('_model.pkl') or not entry.is_file():
+                    continue
+                user_id = entry.name[:-len('_model.pkl')]
+                if user_id not in active_users and entry.stat().st_mtime < idle_before:
+                    idle.append(user_id)
+        
+        archived = 0
+        for user_id, identity in self.archive.pack(idle):
+            # A model retrained while its shard was written stays warm
+            archived += bool(self.remove_model_files(user_id, identity))
+        return archived
+    
+    def load_full_model(self, user_id):
+        """Load the complete sklearn model, which warm-starting needs even in compact mode"""
+        if not self.compact:
+            return self.load_model(user_id)
+        model_path = self.model_path(user_id)
+        if not os.path.exists(model_path) and not self.archive.promote(user_id):
+            return None
+        return joblib.load(model_path)
+    
+    def load_warm_start_base(self, user_id, config):
+        """Load the previous model if it can be warm-started under the current config"""
+        previous = self.load_full_model(user_id)
+        if previous is None:
+            return None
+        
+        scaler = previous['scaler']
+        isolation_forest = previous['isolation_forest']
+        if getattr(scaler, 'n_features_in_', None) != len(FEATURE_NAMES):
+            return None
+        if len(isolation_forest.estimators_) != config['nEstimators']:
+            return None
+        return previous
+    
+    def build_model(self, behavior_sessions, config, new_sessions=None, previous=None, version=1):
+        """Fit model parameters in memory, returning (model_data, training summary)
+        
+        behavior_sessions is the recent training window. When previous model data
+        and new_sessions (the sessions added since that model was trained) are
+        given, the previous model is warm-started instead of refit.
+        """
+        # Extract features from all sessions
+        features_list = []
+        for session in behavior_sessions:
+            features = self.extract_features(session)
+            features_list.append(features.flatten())
+        
+        X = np.array(features_list)
+        
+        # Training-only estimators are imported lazily to keep startup fast;
+        # scoring only needs what joblib.load pulls in for the pickled models
+        from sklearn.cluster import DBSCAN
+        from sklearn.ensemble import IsolationForest
+        from sklearn.preprocessing import StandardScaler
+        
+        if previous is not None and new_sessions:
+            X_new = np.vstack([self.extract_features(session) for session in new_sessions])
+            
+            # Fold the new sessions into the running scaler statistics. Existing
+            # trees were grown in the slightly older scaled space, which is an
+            # accepted approximation until they rotate out.
+            scaler = copy.deepcopy(previous['scaler'])
+            scaler.partial_fit(X_new)
+            X_scaled = scaler.transform(X)
             
-            # Extract features from all sessions
-            features_list = []
-            for session in behavior_sessions:
-                features = self.extract_features(session)
-                features_list.append(features.flatten())
+            # Drop the oldest trees and grow the same number on the recent window,
+            # refreshing in proportion to how much of the window is new
+            n_estimators = config['nEstimators']
+            fraction = min(len(new_sessions) / len(behavior_sessions), config['warmStartMaxFraction'])
+            trees_replaced = max(1, int(round(n_estimators * fraction)))
             
-            X = np.array(features_list)
+            isolation_forest = copy.deepcopy(previous['isolation_forest'])
+            isolation_forest.estimators_ = isolation_forest.estimators_[trees_replaced:]
+            isolation_forest.estimators_features_ = isolation_forest.estimators_features_[trees_replaced:]
+            isolation_forest.set_params(
+                warm_start=True,
+                n_estimators=n_estimators,
+                contamination=config['contamination'],
+                # A fresh seed per version so new trees don't replay retained trees' seeds
+                random_state=42 + version
+            )
+            isolation_forest.fit(X_scaled)
+            isolation_forest.set_params(warm_start=False)
             
+            # Recluster the previous core samples together with the new sessions only
+            cluster_input = np.vstack([previous.get('core_samples', np.empty((0, X.shape[1]))),
+                                       scaler.transform(X_new)])
+            mode = 'warm_start'
+        else:
             # Normalize features
-            X_scaled = self.scaler.fit_transform(X)
+            scaler = StandardScaler()
+            X_scaled = scaler.fit_transform(X)
             
             # Train isolation forest for anomaly detection
-            self.isolation_forest.fit(X_scaled)
+            isolation_forest = IsolationForest(
+                contamination=config['contamination'],
+                random_state=42,
+                n_estimators=config['nEstimators']
+            )
+            isolation_forest.fit(X_scaled)
+            trees_replaced = config['nEstimators']
+            cluster_input = X_scaled
+            mode = 'full'
+        
+        # Train DBSCAN for behavior clustering
+        dbscan = DBSCAN(eps=0.5, min_samples=5)
+        clusters = dbscan.fit_predict(cluster_input)
+        
+        feature_means = np.mean(X_scaled, axis=0)
+        feature_stds = np.std(X_scaled, axis=0)
+        distances = np.linalg.norm(X_scaled - feature_means, axis=1)
+        confidence = float(np.mean(np.maximum(0, 1 - distances / max(np.sum(feature_stds), 1e-6))))
+        
+        model_data = {
+            'version': version,
+            'scaler': scaler,
+            'isolation_forest': isolation_forest,
+            'dbscan': dbscan,
+            'feature_means': feature_means,
+            'feature_stds': feature_stds,
+            'clusters': clusters,
+            'core_samples': dbscan.components_,
+            'cluster_eps': dbscan.eps,
+            'normal_score': float(np.median(isolation_forest.decision_function(X_scaled)))
+        }
+        training = {
+            'version': version,
+            'mode': mode,
+            'sessionsUsed': len(behavior_sessions),
+            'newSessions': len(new_sessions) if mode == 'warm_start' else len(behavior_sessions),
+            'treesReplaced': trees_replaced,
+            'nEstimators': config['nEstimators'],
+            'confidence': confidence
+        }
+        return model_data, training
+    
+    def train_user_model(self, user_id, behavior_sessions, config=None, new_sessions=None, version=1):
+        """Train personalized ML model for user
+        
+        Warm-starts from the saved model when new_sessions is given and the saved
+        model is compatible. Returns a training summary dict, or None on failure.
+        """
+        config = config or DEFAULT_BBCA_CONFIG
+        try:
+            if len(behavior_sessions) < 5:
+                logger.info(f"Insufficient data for user {user_id}, need at least 5 sessions")
+                return None
             
-            # Train DBSCAN for behavior clustering
-            clusters = self.dbscan.fit_predict(X_scaled)
+            previous = self.load_warm_start_base(user_id, config) if new_sessions else None
+            model_data, training = self.build_model(behavior_sessions, config, new_sessions, previous, version)
             
-            # Save model
-            model_path = os.path.join(self.models_dir, f'{user_id}_model.pkl')
-            joblib.dump({
-                'scaler': self.scaler,
-                'isolation_forest': self.isolation_forest,
-                'dbscan': self.dbscan,
-                'feature_means': np.mean(X_scaled, axis=0),
-                'feature_stds': np.std(X_scaled, axis=0),
-                'clusters': clusters
-            }, model_path)
+            # Save model; scoring keeps the previous version until the swap
+            model_path = self.publish_model(user_id, model_data)
             
-            logger.info(f"Model trained for user {user_id}")
-            return model_path
+            logger.info(f"Model trained for user {user_id} ({training['mode']}, version {version})")
+            training['modelPath'] = model_path
+            return training
             
         except Exception as e:
             logger.error(f"Model training error: {e}")
             return None
     
-    def predict_anomaly(self, user_id, behavior_data):
+    def zscore_detector(self, model_data, features_scaled, config):
+        """Vouch for rows whose every feature is within zScoreNormal stds of the training mean"""
+        stds = np.maximum(model_data['feature_stds'], 1e-6)
+        z_scores = np.abs(features_scaled - model_data['feature_means']) / stds
+        return z_scores.max(axis=1) <= config.get('zScoreNormal', 2.0)
+    
+    def cluster_detector(self, model_data, features_scaled, config):
+        """Vouch for rows within reach of a stored DBSCAN core sample"""
+        core_samples = model_data.get('core_samples')
+        if core_samples is None and 'dbscan' in model_data:
+            core_samples = getattr(model_data['dbscan'], 'components_', None)
+        if core_samples is None or len(core_samples) == 0:
+            # Every training row was noise; this detector cannot vouch for anything
+            return None
+        
+        eps = model_data.get('cluster_eps')
+        if eps is None:
+            eps = model_data['dbscan'].eps
+        eps *= config.get('clusterDistanceFactor', 1.0)
+        deltas = features_scaled[:, np.newaxis, :] - core_samples[np.newaxis, :, :]
+        nearest = np.sqrt((deltas ** 2).sum(axis=2)).min(axis=1)
+        return nearest <= eps
+    
+    def clear_normal_mask(self, model_data, features_scaled, config, thresholds):
+        """Rows every applicable cheap detector agrees are normal"""
+        rows = len(features_scaled)
+        normal_score = model_data.get('normal_score')
+        if not config.get('ensembleEarlyExit', True) or normal_score is None or normal_score < thresholds['medium']:
+            return np.zeros(rows, dtype=bool)
+        
+        mask = np.ones(rows, dtype=bool)
+        votes = 0
+        for detector in self.detectors:
+            verdict = detector(model_data, features_scaled, config)
+            if verdict is None:
+                continue
+            mask &= verdict
+            votes += 1
+            if not mask.any():
+                break
+        return mask if votes else np.zeros(rows, dtype=bool)
+    
+    def has_model(self, user_id):
+        """Whether the user has a trained model in any tier"""
+        return bool(self.model_version(user_id)) or user_id in self.archive
+    
+    def model_version(self, user_id):
+        """Cheap token that changes whenever the user's model is retrained"""
+        try:
+            return os.stat(self.model_path(user_id)).st_mtime_ns
+        except OSError:
+            return 0
+    
+    def predict_anomaly(self, user_id, behavior_data, config=None):
         """Predict if current behavior is anomalous"""
+        return self.predict_anomaly_batch(user_id, [behavior_data], config)[0]
+    
+    def score_model(self, model_data, behavior_batch, config=None):
+        """Score behavior snapshots against in-memory model data"""
+        config = config or DEFAULT_BBCA_CONFIG
+        scaler = model_data['scaler']
+        isolation_forest = model_data['isolation_forest']
+        feature_means = model_data['feature_means']
+        feature_stds = model_data['feature_stds']
+        
+        # Extract and normalize features
+        with request_tracer.span('features'):
+            features = np.vstack([self.extract_features(behavior_data) for behavior_data in behavior_batch])
+        with request_tracer.span('sklearn.transform'):
+            features_scaled = scaler.transform(features)
+        
+        thresholds = self.risk_thresholds(config)
+        
+        # Cheap detectors short-circuit clear-normal rows with the model's typical
+        # training score; only borderline rows pay for the isolation forest
+        with request_tracer.span('cheap_detectors'):
+            clear_normal = self.clear_normal_mask(model_data, features_scaled, config, thresholds)
+        anomaly_scores = np.full(len(features_scaled), model_data.get('normal_score', 0.0), dtype=features_scaled.dtype)
+        borderline = ~clear_normal
+        if borderline.any():
+            with request_tracer.span('sklearn.decision_function'):
+                anomaly_scores[borderline] = isolation_forest.decision_function(features_scaled[borderline])
+        
+        # Calculate confidence based on distance from normal behavior
+        distances = np.linalg.norm(features_scaled - feature_means, axis=1)
+        confidences = np.maximum(0, 1 - (distances / np.sum(feature_stds)))
+        
+        # Determine risk level
+        assessments = []
+        for anomaly_score, confidence, early_exit in zip(anomaly_scores, confidences, clear_normal):
+            if anomaly_score < thresholds['critical']:
+                risk_level = 'critical'
+            elif anomaly_score < thresholds['high']:
+                risk_level = 'high'
+            elif anomaly_score < thresholds['medium']:
+                risk_level = 'medium'
+            else:
+                risk_level = 'low'
+            
+            assessments.append({
+                'anomaly_score': float(anomaly_score),
+                # IsolationForest.predict flags exactly the negative decision scores
+                'is_anomaly': bool(anomaly_score < 0),
+                'confidence': float(confidence),
+                'risk_level': risk_level,
+                'scored_by': 'cheap_detectors' if early_exit else 'isolation_forest'
+            })
+        return assessments
+    
+    def fallback_assessment(self, user_id, behavior_data, config):
+        """Cheap assessment for shed or out-of-budget requests: z-score check against an already cached model only"""
+        assessment = {
+            'anomaly_score': 0.0,
+            'is_anomaly': False,
+            'confidence': 0.0,
+            'risk_level': 'low',
+            'scored_by': 'neutral',
+            'provisional': True
+        }
+        try:
+            model_data = self.cached_model(user_id)
+            if model_data is None:
+                return assessment
+            
+            features_scaled = model_data['scaler'].transform(self.extract_features(behavior_data).reshape(1, -1))
+            thresholds = self.risk_thresholds(config)
+            assessment['scored_by'] = 'fallback'
+            if self.zscore_detector(model_data, features_scaled, config)[0]:
+                assessment['anomaly_score'] = float(model_data.get('normal_score', 0.0))
+            else:
+                # Out of the usual range but not checked by the forest: flag for a
+                # proper look on the next sample rather than trigger re-auth
+                assessment['anomaly_score'] = float(thresholds['medium'])
+                assessment['risk_level'] = 'medium'
+        except Exception as e:
+            logger.error(f"Fallback assessment error: {e}")
+        return assessment
+    
+    def predict_anomaly_batch(self, user_id, behavior_batch, config=None):
+        """Score several behavior snapshots of one user with a single model load"""
+        config = config or DEFAULT_BBCA_CONFIG
+        default_assessment = {
+            'anomaly_score': 0.0,
+            'is_anomaly': False,
+            'confidence': 0.0,
+            'risk_level': 'low'
+        }
+        try:
+            # Load model
+            model_data = self.load_model(user_id)
+            
+            if model_data is None:
+                logger.info(f"No model found for user {user_id}")
+                return [dict(default_assessment) for _ in behavior_batch]
+            
+            return self.score_model(model_data, behavior_batch, config)
+            
+        except Exception as e:
+            logger.error(f"Anomaly prediction error: {e}")
+            return [dict(default_assessment) for _ in behavior_batch]
+
+class EmailNotificationService:
+    """Email notification service for security alerts"""
+    
+    def __init__(self):
+        self.smtp_server = "smtp.gmail.com"
+        self.smtp_port = 587
+        self.email = os.getenv('SMTP_EMAIL', 'security@canarabank.com')
+        self.password = os.getenv('SMTP_PASSWORD', 'secure_password')
+    
+    def send_security_alert(self, user_email, alert_type, details):
+        """Send security alert email"""
+        try:
+            import smtplib
+            from email.mime.text import MIMEText
+            from email.mime.multipart import MIMEMultipart
+            
+            msg = MIMEMultipart()
+            msg['From'] = self.email
+            msg['To'] = user_email
+            msg['Subject'] = f"Canara Bank Security Alert - {alert_type}"
+            
+            body = f"""
+            Dear Customer,
+            
+            We detected unusual activity on your Canara Bank account:
+            
+            Alert Type: {alert_type}
+            Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+            Details: {details}
+            
+            If this was not you, please contact our security team immediately.
+            
+            Best regards,
+            Canara Bank Security Team
+            """
+            
+            msg.attach(MIMEText(body, 'plain'))
+            
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+            server.starttls()
+            server.login(self.email, self.password)
+            text = msg.as_string()
+            server.sendmail(self.email, user_email, text)
+            server.quit()
+            
+            logger.info(f"Security alert sent to {user_email}")
+            
+        except Exception as e:
+            logger.error(f"Email sending error: {e}")
+
+def flush_pending_counters(owner, merge, label):
+    """Swap out owner.pending, a (tenant_id, *key) -> counters defaultdict, and
+    hand each tenant's (*key, *counters) rows to merge(storage, rows)
+
+    Counters of tenants whose merge fails are added back for the next flush.
+    Returns the number of rows merged.
+    """
+    with owner.lock:
+        pending, owner.pending = owner.pending, defaultdict(owner.pending.default_factory)
+
+    by_tenant = defaultdict(list)
+    for key, counters in pending.items():
+        by_tenant[key[0]].append((key, counters))
+
+    flushed = 0
+    for tenant_id, items in by_tenant.items():
+        try:
+            merge(tenants.storage(tenant_id), [key[1:] + tuple(counters) for key, counters in items])
+            flushed += len(items)
+
+        except Exception as e:
+            logger.error(f"{label} flush error for tenant {tenant_id}: {e}")
+            # Put the counters back so the next flush retries them
+            with owner.lock:
+                for key, counters in items:
+                    merged = owner.pending[key]
+                    for i, value in enumerate(counters):
+                        merged[i] += value
+    return flushed
+
+class RiskRollupAggregator:
+    """Incrementally maintained hourly risk rollups for ops analytics"""
+
+    RISK_LEVELS = ('low', 'medium', 'high', 'critical')
+
+    def __init__(self, bucket_seconds=3600):
+        self.bucket_seconds = bucket_seconds
+        self.lock = Lock()
+        # (tenant_id, bucket_start, cohort, risk_level) -> [sessions, anomalies, events, risk_score_sum]
+        self.pending = defaultdict(lambda: [0, 0, 0, 0.0])
+
+    def bucket_for(self, when=None):
+        """Return the bucket start timestamp string for a point in time"""
+        when = when or datetime.now()
+        epoch = int(when.timestamp())
+        start = datetime.fromtimestamp(epoch - epoch % self.bucket_seconds)
+        return start.strftime('%Y-%m-%d %H:%M:%S')
+
+    def record_session(self, cohort, risk_assessment, tenant_id=None):
+        """Count a scored behavior session"""
+        key = (tenant_id, self.bucket_for(), cohort, risk_assessment.get('risk_level', 'low'))
+        with self.lock:
+            counters = self.pending[key]
+            counters[0] += 1
+            counters[1] += 1 if risk_assessment.get('is_anomaly') else 0
+            counters[3] += float(risk_assessment.get('anomaly_score', 0))
+
+    def record_event(self, cohort, severity, tenant_id=None):
+        """Count a logged security event"""
+        key = (tenant_id, self.bucket_for(), cohort, severity)
+        with self.lock:
+            self.pending[key][2] += 1
+
+    def flush(self):
+        """Merge pending counters into each tenant's risk_rollups table"""
+        return flush_pending_counters(self, lambda storage, rows: storage.merge_risk_rollups(rows), 'Risk rollup')
+
+    def query(self, hours=24, cohort=None, risk_level=None, tenant_id=None):
+        """Return time-bucketed aggregates, including not yet flushed counters"""
+        since = self.bucket_for(datetime.now() - timedelta(hours=hours - 1))
+        rows = defaultdict(lambda: [0, 0, 0, 0.0])
+
+        for row in tenants.storage(tenant_id).risk_rollups_since(since):
+            rows[tuple(row[:3])] = list(row[3:])
+
+        with self.lock:
+            for key, counters in self.pending.items():
+                if key[0] == tenant_id and key[1] >= since:
+                    merged = rows[key[1:]]
+                    for i, value in enumerate(counters):
+                        merged[i] += value
+
+        buckets = []
+        for (bucket_start, row_cohort, row_level), counters in sorted(rows.items()):
+            if cohort and row_cohort != cohort:
+                continue
+            if risk_level and row_level != risk_level:
+                continue
+            sessions, anomalies, events, risk_score_sum = counters
+            buckets.append({
+                'bucketStart': bucket_start,
+                'cohort': row_cohort,
+                'riskLevel': row_level,
+                'sessions': sessions,
+                'anomalies': anomalies,
+                'anomalyRate': anomalies / sessions if sessions else 0.0,
+                'events': events,
+                'avgRiskScore': risk_score_sum / sessions if sessions else 0.0
+            })
+        return buckets
+
+class SessionSampler:
+    """Decides which behavior sessions are written under the configured persistence policy
+
+    With the sampled policy each user gets a reservoir of lowRiskSampleSize
+    low-risk sessions per persistenceSampleWindow (Algorithm R within the
+    window), so the training window holds a uniform sample of recent normal
+    behavior. Every low-risk session is counted per user and window; the
+    counters are flushed in batches like the risk rollups.
+    """
+
+    def __init__(self, max_users=100000):
+        self.max_users = max_users
+        self.lock = Lock()
+        self.random = random.Random()
+        # (tenant_id, user_id) -> [window_start, low-risk sessions seen], least recently seen first
+        self.windows = OrderedDict()
+        # (tenant_id, user_id, window_start) -> [sessions, sampled, risk_score_sum]
+        self.pending = defaultdict(lambda: [0, 0, 0.0])
+        self.decisions = {'full': 0, 'sampled': 0, 'replaced': 0, 'folded': 0}
+
+    def window_for(self, window_seconds):
+        epoch = int(time.time())
+        return datetime.fromtimestamp(epoch - epoch % window_seconds).strftime('%Y-%m-%d %H:%M:%S')
+
+    def decide(self, tenant_id, user_id, risk_assessment, config):
+        """Return (decision, window_start) for a scored session
+
+        decision is 'full' (store as is), 'sampled' (store in the reservoir),
+        'replaced' (store and evict a random sampled session of the window) or
+        'folded' (count only).
+        """
+        if config['persistencePolicy'] == 'full' or risk_assessment.get('is_anomaly') or \
+                risk_assessment.get('risk_level', 'low') != 'low':
+            with self.lock:
+                self.decisions['full'] += 1
+            return 'full', None
+        
+        window_start = self.window_for(int(config['persistenceSampleWindow']))
+        sample_size = int(config['lowRiskSampleSize'])
+        key = (tenant_id, user_id)
+        with self.lock:
+            state = self.windows.pop(key, None)
+            if state is None or state[0] != window_start:
+                state = [window_start, 0]
+            self.windows[key] = state
+            if len(self.windows) > self.max_users:
+                # A forgotten user restarts its reservoir, which only over-samples
+                self.windows.popitem(last=False)
+            
+            state[1] += 1
+            if state[1] <= sample_size:
+                decision = 'sampled'
+            elif self.random.random() < sample_size / state[1]:
+                decision = 'replaced'
+            else:
+                decision = 'folded'
+            
+            counters = self.pending[(tenant_id, user_id, window_start)]
+            counters[0] += 1
+            counters[1] += decision != 'folded'
+            counters[2] += float(risk_assessment.get('anomaly_score', 0))
+            self.decisions[decision] += 1
+        return decision, window_start
+
+    def flush(self):
+        """Merge pending counters into each tenant's user_session_counters table"""
+        return flush_pending_counters(self, lambda storage, rows: storage.merge_session_counters(rows),
+                                      'Session counter')
+
+    def forget(self, owners):
+        """Drop reservoir state and unflushed counters of (tenant_id, user_id) owners"""
+        with self.lock:
+            for owner in owners:
+                self.windows.pop(owner, None)
+            for key in [key for key in self.pending if key[:2] in owners]:
+                del self.pending[key]
+
+    def stats(self):
+        with self.lock:
+            decisions = dict(self.decisions)
+        total = sum(decisions.values())
+        decisions['writeRatio'] = (total - decisions['folded']) / total if total else 1.0
+        return decisions
+
+class ConfigStore:
+    """Persisted per-tenant/per-user BBCA configuration with versioned hot reload"""
+
+    def __init__(self, reload_interval=5, max_resolved=50000):
+        self.reload_interval = reload_interval
+        self.max_resolved = max_resolved
+        self.lock = Lock()
+        self.version = 0
+        self.scopes = {}
+        # (tenant_id, user_id) -> resolved config, dropped whenever the version changes
+        self.resolved = {}
+
+    SCOPES = ('global', 'tenant', 'user')
+
+    @staticmethod
+    def scope_key(scope, tenant_id=None, user_id=None):
+        """Build the storage key for a configuration scope, raising ValueError for unknown scopes"""
+        if scope == 'user':
+            # User IDs are only unique per tenant; the default tenant keeps the original key
+            return f'user:{tenant_id}:{user_id}' if tenant_id else f'user:{user_id}'
+        if scope == 'tenant':
+            return f'tenant:{tenant_id}'
+        if scope == 'global':
+            return 'global'
+        raise ValueError(f"scope must be one of {list(ConfigStore.SCOPES)}")
+
+    def validate(self, overrides):
+        """Validate configuration overrides, raising ValueError on bad input"""
+        if not isinstance(overrides, dict):
+            raise ValueError("Configuration overrides must be an object")
+        for key, value in overrides.items():
+            if key not in DEFAULT_BBCA_CONFIG:
+                raise ValueError(f"Unknown configuration key: {key}")
+            default = DEFAULT_BBCA_CONFIG[key]
+            if isinstance(default, bool):
+                if not isinstance(value, bool):
+                    raise ValueError(f"{key} must be a boolean")
+            elif isinstance(default, (int, float)):
+                if not is_finite_number(value) or value <= 0:
+                    raise ValueError(f"{key} must be a positive number")
+
+        if 'sensitivity' in overrides and overrides['sensitivity'] not in SENSITIVITY_OFFSETS:
+            raise ValueError(f"sensitivity must be one of {sorted(SENSITIVITY_OFFSETS)}")
+        if 'persistencePolicy' in overrides and overrides['persistencePolicy'] not in PERSISTENCE_POLICIES:
+            raise ValueError(f"persistencePolicy must be one of {list(PERSISTENCE_POLICIES)}")
+        for key in ('lowRiskSampleSize', 'persistenceSampleWindow', 'erasureBatchUsers', 'erasureChunkRows'):
+            if key in overrides and int(overrides[key]) != overrides[key]:
+                raise ValueError(f"{key} must be an integer")
+        if 'contamination' in overrides and not 0 < overrides['contamination'] <= 0.5:
+            raise ValueError("contamination must be in (0, 0.5]")
+        if 'warmStartMaxFraction' in overrides and not overrides['warmStartMaxFraction'] <= 1:
+            raise ValueError("warmStartMaxFraction must be in (0, 1]")
+        if 'reAuthThreshold' in overrides and not overrides['reAuthThreshold'] <= 1:
+            raise ValueError("reAuthThreshold must be in (0, 1]")
+        if 'sessionRiskHysteresis' in overrides and not overrides['sessionRiskHysteresis'] < SESSION_RISK_LEVELS[-1][1]:
+            raise ValueError(f"sessionRiskHysteresis must be below {SESSION_RISK_LEVELS[-1][1]}")
+        if 'nEstimators' in overrides and int(overrides['nEstimators']) != overrides['nEstimators']:
+            raise ValueError("nEstimators must be an integer")
+        if 'riskThresholds' in overrides:
+            thresholds = overrides['riskThresholds']
+            if not isinstance(thresholds, dict) or set(thresholds) != {'critical', 'high', 'medium'}:
+                raise ValueError("riskThresholds needs critical, high and medium values")
+            if not all(is_finite_number(value) for value in thresholds.values()):
+                raise ValueError("riskThresholds values must be finite numbers")
+            if not thresholds['critical'] < thresholds['high'] < thresholds['medium']:
+                raise ValueError("riskThresholds must satisfy critical < high < medium")
+
+    def reload(self):
+        """Reload overrides from the database if another writer bumped the version"""
+        try:
+            # Configuration is control plane data and lives in the default tenant's storage
+            storage = tenants.storage()
+            latest = storage.config_version()
+            if latest <= self.version:
+                return False
+
+            scopes = {scope: json.loads(config) for scope, config in storage.load_config().items()}
+
+            with self.lock:
+                self.scopes = scopes
+                self.resolved = {}
+                self.version = latest
+            logger.info(f"Configuration reloaded at version {latest}")
+            return True
+
+        except Exception as e:
+            logger.error(f"Configuration reload error: {e}")
+            return False
+
+    def watch(self):
+        """Background loop picking up configuration changes without a restart"""
+        while True:
+            time.sleep(self.reload_interval)
+            self.reload()
+
+    def get(self, tenant_id=None, user_id=None):
+        """Get the effective configuration, served from memory"""
+        key = (tenant_id, user_id)
+        config = self.resolved.get(key)
+        if config is not None:
+            return config
+
+        with self.lock:
+            config = json.loads(json.dumps(DEFAULT_BBCA_CONFIG))
+            scopes = ['global']
+            if tenant_id:
+                scopes.append(self.scope_key('tenant', tenant_id))
+            if user_id:
+                scopes.append(self.scope_key('user', tenant_id, user_id))
+            for scope in scopes:
+                overrides = self.scopes.get(scope, {})
+                for name, value in overrides.items():
+                    if name not in config:
+                        # Stored under a key that has since been retired
+                        continue
+                    if isinstance(value, dict):
+                        config[name].update(value)
+                    else:
+                        config[name] = value
+            config['version'] = self.version
+            if len(self.resolved) >= self.max_resolved:
+                self.resolved = {}
+            self.resolved[key] = config
+        return config
+
+    def update(self, scope, overrides, tenant_id=None, user_id=None):
+        """Persist configuration overrides for a scope and bump the version"""
+        self.validate(overrides)
+        key = self.scope_key(scope, tenant_id, user_id)
+
+        with self.lock:
+            merged = dict(self.scopes.get(key, {}))
+            merged.update(overrides)
+
+            version = tenants.storage().save_config(key, json.dumps(merged), self.version + 1, datetime.now())
+
+            self.scopes[key] = merged
+            self.resolved = {}
+            self.version = version
+
+        logger.info(f"Configuration scope {key} updated to version {version}")
+        return version
+
+class InFlightCounter:
+    """Tracks concurrent requests as a cheap server load signal"""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.active = 0
+
+    def __enter__(self):
+        with self.lock:
+            self.active += 1
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.lock:
+            self.active -= 1
+
+class AdmissionController:
+    """Token-bucket rate limits, a training concurrency cap and load shedding counters"""
+
+    def __init__(self, load_counter, max_keys=100000):
+        self.load_counter = load_counter
+        self.max_keys = max_keys
+        self.lock = Lock()
+        # (scope, key) -> [tokens, last_refill], least recently seen first
+        self.buckets = OrderedDict()
+        self.training = 0
+        self.limited = defaultdict(int)
+        self.shed = defaultdict(int)
+        self.training_rejected = 0
+
+    def allow(self, scope, key, rate, burst):
+        """Take one token from the bucket; return 0 if allowed, else seconds until a token is free"""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.pop((scope, key), None)
+            if bucket is None:
+                bucket = [burst, now]
+                if len(self.buckets) >= self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            self.buckets[(scope, key)] = bucket
+            
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            self.limited[scope] += 1
+            return (1 - bucket[0]) / rate
+
+    def check(self, checks):
+        """Apply (scope, key, rate, burst) checks in order; return the first retry-after or 0"""
+        for scope, key, rate, burst in checks:
+            if key is None:
+                continue
+            retry_after = self.allow(scope, key, rate, burst)
+            if retry_after:
+                return retry_after
+        return 0
+
+    def should_shed(self, priority, config):
+        """Whether an analyze request at this priority should get the fallback score"""
+        factor = SHED_LOAD_FACTORS.get(priority)
+        if factor is None or self.load_counter.active <= config['shedConcurrency'] * factor:
+            return False
+        with self.lock:
+            self.shed[priority] += 1
+        return True
+
+    def try_start_training(self, config):
+        with self.lock:
+            if self.training >= config['maxConcurrentTraining']:
+                self.training_rejected += 1
+                return False
+            self.training += 1
+            return True
+
+    def finish_training(self):
+        with self.lock:
+            self.training -= 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                'inFlight': self.load_counter.active,
+                'training': self.training,
+                'trackedBuckets': len(self.buckets),
+                'rateLimited': dict(self.limited),
+                'shed': dict(self.shed),
+                'trainingRejected': self.training_rejected
+            }
+
+class SessionRiskTracker:
+    """Per-session risk state machine that smooths snapshot assessments into stable decisions
+
+    Each session keeps an exponentially decayed mean of its snapshots' risk
+    scores (half-life sessionRiskHalfLife seconds), seeded with one low-risk
+    pseudo-sample so a single noisy snapshot cannot jump straight to a high
+    level, and moves between levels with hysteresis. Updates are O(1). State
+    expires after sessionRiskTtl idle seconds and is written to storage only
+    when the level changes, so an evicted or restarted session resumes from
+    its last level instead of starting clean.
+    """
+
+    def __init__(self, max_sessions=200000):
+        self.max_sessions = max_sessions
+        self.lock = Lock()
+        # (tenant_id, user_id, session_key) -> [risk_level, score_sum, weight, updated_at, samples],
+        # least recently updated first
+        self.sessions = OrderedDict()
+        self.transitions = 0
+        self.restored = 0
+
+    @staticmethod
+    def level_for(score, current, hysteresis):
+        current_rank = RISK_LEVEL_SCORES[current]
+        for level, entry_score in SESSION_RISK_LEVELS:
+            # Holding a level (or a higher one) only needs the lower exit score
+            threshold = entry_score - hysteresis if current_rank >= RISK_LEVEL_SCORES[level] else entry_score
+            if score >= threshold:
+                return level
+        return 'low'
+
+    def restore(self, tenant_id, user_id, session_key):
+        """State for a session not in memory: its last persisted level, or a fresh low-risk start"""
+        try:
+            row = tenants.storage(tenant_id).get_session_risk(user_id, session_key)
+        except Exception as e:
+            logger.error(f"Session risk restore error: {e}")
+            row = None
+        if row is None:
+            return ['low', 0.0, 1.0, time.time(), 0]
+        self.restored += 1
+        risk_level, score_sum, weight, updated_at = row
+        return [risk_level, score_sum, weight, datetime.fromisoformat(str(updated_at)).timestamp(), 0]
+
+    def update(self, tenant_id, user_id, session_key, risk_assessment, config):
+        """Fold one snapshot assessment into its session and return the session's risk
+
+        Provisional assessments are not folded in; the session's current risk is returned as is.
+        """
+        key = (tenant_id, user_id, session_key)
+        state = self.sessions.get(key)
+        if state is None:
+            state = self.restore(tenant_id, user_id, session_key)
+        if risk_assessment.get('provisional'):
+            score = state[1] / state[2]
+            return {'level': state[0], 'score': round(score, 4), 'samples': state[4], 'changed': False}
+        
+        sample = RISK_LEVEL_SCORES.get(risk_assessment.get('risk_level'), 0.0)
+        now = time.time()
+        with self.lock:
+            # Another request for the session may have got here first
+            state = self.sessions.pop(key, state)
+            decay = 0.5 ** (max(now - state[3], 0.0) / config['sessionRiskHalfLife'])
+            state[1] = state[1] * decay + sample
+            state[2] = state[2] * decay + 1
+            state[3] = now
+            state[4] += 1
+            previous = state[0]
+            score = state[1] / state[2]
+            state[0] = self.level_for(score, previous, config['sessionRiskHysteresis'])
+            self.sessions[key] = state
+            
+            # Sessions are ordered by last update, so expired ones sit at the front
+            expire_before = now - config['sessionRiskTtl']
+            while self.sessions:
+                oldest = next(iter(self.sessions.values()))
+                if oldest[3] >= expire_before and len(self.sessions) <= self.max_sessions:
+                    break
+                self.sessions.popitem(last=False)
+            risk_level, score_sum, weight, samples = state[0], state[1], state[2], state[4]
+        
+        changed = risk_level != previous
+        if changed:
+            self.transitions += 1
+            try:
+                with request_tracer.span('db.session_risk'):
+                    tenants.storage(tenant_id).save_session_risk(user_id, session_key, risk_level, score_sum,
+                                                                 weight, datetime.fromtimestamp(now))
+            except Exception as e:
+                logger.error(f"Session risk save error: {e}")
+        return {
+            'level': risk_level,
+            'score': round(score, 4),
+            'samples': samples,
+            'changed': changed
+        }
+
+    def forget(self, owners):
+        """Drop in-memory sessions of (tenant_id, user_id) owners"""
+        with self.lock:
+            for key in [key for key in self.sessions if key[:2] in owners]:
+                del self.sessions[key]
+
+    def stats(self):
+        return {'sessions': len(self.sessions), 'transitions': self.transitions, 'restored': self.restored}
+
+class MonitoringIntervalPlanner:
+    """Computes the next client polling interval from recent risk history and load"""
+
+    HISTORY_SIZE = 10
+
+    def __init__(self, load_counter, max_users=100000):
+        self.load_counter = load_counter
+        self.max_users = max_users
+        self.lock = Lock()
+        # user_id -> deque of (risk_level, confidence), least recently seen first
+        self.history = OrderedDict()
+
+    def record(self, user_id, risk_assessment):
+        """Remember the latest risk assessment for a user"""
+        with self.lock:
+            history = self.history.pop(user_id, None)
+            if history is None:
+                history = deque(maxlen=self.HISTORY_SIZE)
+                if len(self.history) >= self.max_users:
+                    self.history.popitem(last=False)
+            history.append((risk_assessment['risk_level'], risk_assessment.get('confidence', 0.0)))
+            self.history[user_id] = history
+            return list(history)
+
+    def forget(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.history.pop(user_id, None)
+
+    def next_interval(self, user_id, risk_assessment, config):
+        """Return the interval in milliseconds before the client should sample again"""
+        base = config['monitoringInterval']
+        history = self.record(user_id, risk_assessment)
+        if not config.get('adaptiveInterval', True):
+            return base
+
+        min_interval = config['minMonitoringInterval']
+        max_interval = config['maxMonitoringInterval']
+        risk_level = risk_assessment['risk_level']
+
+        if risk_level in ('high', 'critical'):
+            return min_interval
+
+        if risk_level == 'medium' or any(level != 'low' for level, _ in history):
+            interval = base
+        elif not any(conf for _, conf in history):
+            # No trained model yet: keep sampling at the configured rate to collect training data
+            interval = base
+        else:
+            # Back off exponentially while the user keeps looking normal,
+            # scaled down when the model is not confident about it
+            stable_streak = len(history)
+            confidence = sum(conf for _, conf in history) / stable_streak
+            interval = base * 2 ** min(stable_streak - 1, 4) * (0.5 + 0.5 * confidence)
+
+        # Stretch non-risky intervals further when the server is busy
+        load = self.load_counter.active / config['targetConcurrency']
+        if load > 0.75:
+            interval *= 1 + load
+
+        return int(min(max(interval, min_interval), max_interval))
+
+class AssessmentCache:
+    """Short-TTL cache of analyze responses with in-flight duplicate coalescing"""
+
+    def __init__(self, max_entries=100000, wait_timeout=5.0):
+        self.max_entries = max_entries
+        self.wait_timeout = wait_timeout
+        self.lock = Lock()
+        # key -> (expires_at, response), oldest first
+        self.entries = OrderedDict()
+        # key -> Event set once the request that claimed the key finishes
+        self.pending = {}
+
+    def acquire(self, keys, wait_timeout=None):
+        """Return a cached response for any of the keys, or claim them all and return None
+
+        A request that finds one of its keys claimed by an identical in-flight
+        request waits for that result instead of scoring the snapshot again.
+        """
+        if wait_timeout is None or wait_timeout > self.wait_timeout:
+            wait_timeout = self.wait_timeout
+        deadline = time.monotonic() + wait_timeout
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                for key in keys:
+                    entry = self.entries.get(key)
+                    if entry is not None:
+                        if entry[0] > now:
+                            return entry[1]
+                        del self.entries[key]
+
+                waiting = next((self.pending[key] for key in keys if key in self.pending), None)
+                if waiting is None or now >= deadline:
+                    for key in keys:
+                        self.pending.setdefault(key, Event())
+                    return None
+
+            waiting.wait(max(0.0, deadline - time.monotonic()))
+
+    def release(self, keys, response=None, ttls=None):
+        """Store the response under the claimed keys (each with its own TTL) and wake waiters"""
+        with self.lock:
+            now = time.monotonic()
+            if response is not None:
+                for key, ttl in zip(keys, ttls):
+                    self.entries.pop(key, None)
+                    self.entries[key] = (now + ttl, response)
+                while len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+            for key in keys:
+                event = self.pending.pop(key, None)
+                if event is not None:
+                    event.set()
+
+    def forget(self, owners):
+        """Drop cached responses of (tenant_id, user_id) owners"""
+        with self.lock:
+            for key in [key for key in self.entries if key[1:3] in owners]:
+                del self.entries[key]
+
+class BehaviorSnapshotCache:
+    """Last feature summary per user, used as the base for delta payloads"""
+
+    def __init__(self, max_users=100000):
+        self.max_users = max_users
+        self.lock = Lock()
+        # user_id -> (session_id, feature summary)
+        self.snapshots = OrderedDict()
+
+    def get(self, user_id):
+        with self.lock:
+            return self.snapshots.get(user_id)
+
+    def put(self, user_id, session_id, summary):
+        with self.lock:
+            self.snapshots.pop(user_id, None)
+            if len(self.snapshots) >= self.max_users:
+                self.snapshots.popitem(last=False)
+            self.snapshots[user_id] = (session_id, summary)
+
+    def forget(self, user_ids):
+        with self.lock:
+            for user_id in user_ids:
+                self.snapshots.pop(user_id, None)
+
+class BehaviorSimilarityIndex:
+    """Time-windowed LSH index of behavior fingerprints across users
+
+    Fingerprints are sign-preserving log1p transforms of the raw feature summary
+    (per-user scalers are not comparable across users), stored int16-quantized in
+    a ring buffer. Each hash table buckets them by `bits` p-stable projections
+    floor((a.v + b) / width), so a lookup only inspects colliding entries instead
+    of every recent session.
+    
+    Near-empty fingerprints (idle or stub sessions) all land in the same buckets
+    and would correlate unrelated users, so they are neither indexed nor matched.
+    """
+
+    QUANT_SCALE = 1024.0
+    # Fingerprint components at or below this magnitude carry no signal
+    TRIVIAL_VALUE = 0.05
+
+    def __init__(self, capacity=200000, retention=3600, tables=8, bits=4, width=1.0, bucket_scan=256, seed=7,
+                 min_features=6, min_norm=1.0):
+        rng = np.random.RandomState(seed)
+        dims = len(FEATURE_NAMES)
+        self.capacity = capacity
+        self.retention = retention
+        self.min_features = min_features
+        self.min_norm = min_norm
+        self.skipped = 0
+        self.tables = tables
+        self.width = width
+        self.bucket_scan = bucket_scan
+        self.projections = rng.normal(size=(tables * bits, dims)).astype(np.float32)
+        self.offsets = rng.uniform(0, width, size=tables * bits).astype(np.float32)
+        self.lock = Lock()
+        
+        # Ring buffer: entry id -> slot id % capacity
+        self.vectors = np.zeros((capacity, dims), dtype=np.int16)
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.keys = [None] * capacity
+        self.owners = [None] * capacity
+        self.next_id = 0
+        self.oldest_id = 0
+        # (table, bucket hash) -> deque of entry ids, oldest first
+        self.buckets = {}
+        # (tenant_id, user_id) -> newest entry id
+        self.latest = {}
+        # (tenant_id, user_id) -> time of the last correlation alert
+        self.alerted = OrderedDict()
+
+    def fingerprint(self, summary):
+        values = np.array([float(summary.get(name, 0)) for name in FEATURE_NAMES], dtype=np.float32)
+        return np.sign(values) * np.log1p(np.abs(values))
+
+    def informative(self, vector):
+        """Whether a fingerprint has enough non-trivial features to compare across users"""
+        return np.count_nonzero(np.abs(vector) > self.TRIVIAL_VALUE) >= self.min_features and \
+            float(np.linalg.norm(vector)) >= self.min_norm
+
+    def bucket_keys(self, vector):
+        hashes = np.floor((self.projections @ vector + self.offsets) / self.width).astype(np.int32)
+        return [(table, row.tobytes()) for table, row in enumerate(hashes.reshape(self.tables, -1))]
+
+    def _expire(self, cutoff):
+        """Drop entries older than cutoff and free a slot for the next one; caller holds the lock"""
+        while self.oldest_id < self.next_id:
+            slot = self.oldest_id % self.capacity
+            if self.times[slot] >= cutoff and self.next_id - self.oldest_id < self.capacity:
+                break
+            # Ids enter buckets in increasing order, so the oldest is always leftmost
+            for key in self.keys[slot]:
+                bucket = self.buckets[key]
+                bucket.popleft()
+                if not bucket:
+                    del self.buckets[key]
+            if self.latest.get(self.owners[slot]) == self.oldest_id:
+                del self.latest[self.owners[slot]]
+            self.keys[slot] = self.owners[slot] = None
+            self.oldest_id += 1
+
+    def _candidates(self, keys, since):
+        ids = set()
+        for key in keys:
+            bucket = self.buckets.get(key)
+            if bucket:
+                # Newest entries sit at the right; stop at the window start
+                for scanned, entry_id in enumerate(reversed(bucket)):
+                    if scanned >= self.bucket_scan or self.times[entry_id % self.capacity] < since:
+                        break
+                    ids.add(entry_id)
+        return ids
+
+    def _match(self, vector, ids, owner, radius):
+        """Other users of the same tenant within radius, as user_id -> (distance, seen_at)"""
+        if not ids:
+            return {}
+        ids = np.fromiter(ids, dtype=np.int64)
+        slots = ids % self.capacity
+        distances = np.linalg.norm(self.vectors[slots] / self.QUANT_SCALE - vector, axis=1)
+        matches = {}
+        for slot, distance in zip(slots[distances <= radius], distances[distances <= radius]):
+            tenant_id, user_id = self.owners[slot]
+            if tenant_id != owner[0] or user_id in (owner[1], None):
+                continue
+            if user_id not in matches or distance < matches[user_id][0]:
+                matches[user_id] = (float(distance), float(self.times[slot]))
+        return matches
+
+    def add(self, tenant_id, user_id, summary, config):
+        """Index a fingerprint and return the other users seen within radius during the window"""
+        vector = self.fingerprint(summary)
+        if not self.informative(vector):
+            with self.lock:
+                self.skipped += 1
+            return {}
+        keys = self.bucket_keys(vector)
+        owner = (tenant_id, user_id)
+        now = time.time()
+        since = now - min(config['similarityWindow'], self.retention)
+        with self.lock:
+            self._expire(now - self.retention)
+            matches = self._match(vector, self._candidates(keys, since), owner, config['similarityRadius'])
+            
+            entry_id = self.next_id
+            slot = entry_id % self.capacity
+            self.next_id += 1
+            self.vectors[slot] = np.clip(np.round(vector * self.QUANT_SCALE), -32767, 32767)
+            self.times[slot] = now
+            self.keys[slot] = keys
+            self.owners[slot] = owner
+            self.latest[owner] = entry_id
+            for key in keys:
+                self.buckets.setdefault(key, deque()).append(entry_id)
+        return matches
+
+    def similar_users(self, tenant_id, user_id, config, window=None):
+        """Users whose recent behavior was near-identical to this user's latest fingerprint"""
+        owner = (tenant_id, user_id)
+        now = time.time()
+        since = now - min(window or config['similarityWindow'], self.retention)
+        with self.lock:
+            entry_id = self.latest.get(owner)
+            if entry_id is None:
+                return {}
+            slot = entry_id % self.capacity
+            vector = self.vectors[slot] / self.QUANT_SCALE
+            return self._match(vector, self._candidates(self.keys[slot], since), owner,
+                               config['similarityRadius'])
+
+    def should_alert(self, tenant_id, user_id, window, max_users=100000):
+        """Raise at most one correlation alert per user per window"""
+        owner = (tenant_id, user_id)
+        now = time.time()
+        with self.lock:
+            last = self.alerted.pop(owner, None)
+            if last is not None and now - last < window:
+                self.alerted[owner] = last
+                return False
+            self.alerted[owner] = now
+            while len(self.alerted) > max_users:
+                self.alerted.popitem(last=False)
+            return True
+
+    def forget(self, owners):
+        """Unlink the fingerprints of (tenant_id, user_id) owners; their slots age out as usual"""
+        with self.lock:
+            for entry_id in range(self.oldest_id, self.next_id):
+                slot = entry_id % self.capacity
+                if self.owners[slot] in owners:
+                    self.vectors[slot] = 0
+                    self.owners[slot] = (self.owners[slot][0], None)
+            for owner in owners:
+                self.latest.pop(owner, None)
+                self.alerted.pop(owner, None)
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': self.next_id - self.oldest_id,
+                'capacity': self.capacity,
+                'buckets': len(self.buckets),
+                'users': len(self.latest),
+                'skipped': self.skipped
+            }
+
+class PooledConnection:
+    """DB-API connection handle whose close() hands the connection back to its pool"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def close(self):
+        if self._conn is not None:
+            self._pool.release(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    """Reusable connections made by connect(); max_open caps connections checked out at once"""
+
+    def __init__(self, connect, size=8, max_open=None):
+        self.factory = connect
+        self.idle = queue.LifoQueue(maxsize=size)
+        self.slots = BoundedSemaphore(max_open) if max_open else None
+
+    def connect(self):
+        if self.slots:
+            self.slots.acquire()
+        try:
+            try:
+                conn = self.idle.get_nowait()
+            except queue.Empty:
+                conn = self.factory()
+        except Exception:
+            if self.slots:
+                self.slots.release()
+            raise
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            if getattr(conn, 'in_transaction', True):
+                conn.rollback()
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+        except Exception:
+            # Broken connection; drop it and let the next caller open a fresh one
+            conn.close()
+        finally:
+            if self.slots:
+                self.slots.release()
+
+class StorageBackend:
+    """Persistence interface for one tenant's sessions, events, model metadata, rollups and config
+
+    Timestamps are passed in as datetimes (or 'YYYY-MM-DD HH:MM:SS' strings for
+    bounds) and always come back as strings in that format, whatever the backend.
+    """
+
+    # Sessions
+    def insert_session(self, session_id, user_id, behavior_json, risk_score, anomaly, timestamp,
+                       sampled=False, replace_since=None):
+        """Store a session; replace_since first evicts a random sampled session newer than it"""
+        raise NotImplementedError
+
+    def recent_sessions(self, user_id, limit):
+        """Behavior JSON of the user's newest sessions, newest first"""
+        raise NotImplementedError
+
+    def session_window(self, user_id, limit, since=None):
+        """(behavior JSON, timestamp) of the user's newest sessions after since, newest first"""
+        raise NotImplementedError
+
+    def iter_sessions(self, start=None, end=None, page_size=5000):
+        """Yield (session_id, user_id, behavior JSON, risk_score, anomaly, timestamp) in time order"""
+        raise NotImplementedError
+
+    def users_by_recency(self):
+        """Yield (last_seen, user_id) for every user with sessions, most recent first"""
+        raise NotImplementedError
+
+    def pending_users(self, since, after_user, limit):
+        """User IDs after after_user with sessions but no model updated since `since`"""
+        raise NotImplementedError
+
+    # Model metadata
+    def get_model_metadata(self, user_id):
+        raise NotImplementedError
+
+    def save_model_metadata(self, user_id, metadata_json, confidence, timestamp):
+        raise NotImplementedError
+
+    # Security events
+    def insert_security_event(self, event_id, user_id, event_type, severity, description, timestamp):
+        """Store an event and return its feed sequence number
+
+        Sequence numbers must become visible in increasing order so feed
+        consumers resuming from a cursor never skip an event.
+        """
+        raise NotImplementedError
+
+    def user_security_events(self, user_id, limit):
+        """(event_type, severity, description, timestamp) of the user's newest events"""
+        raise NotImplementedError
+
+    def security_events_after(self, cursor, limit):
+        """(seq, event_id, user_id, event_type, severity, description, timestamp) rows after cursor"""
+        raise NotImplementedError
+
+    def security_events_head(self):
+        raise NotImplementedError
+
+    # Aggregates
+    def merge_risk_rollups(self, rows):
+        """Add (bucket_start, cohort, risk_level, sessions, anomalies, events, risk_score_sum) rows"""
+        raise NotImplementedError
+
+    def risk_rollups_since(self, since):
+        raise NotImplementedError
+
+    def merge_session_counters(self, rows):
+        """Add (user_id, window_start, sessions, sampled, risk_score_sum) rows"""
+        raise NotImplementedError
+
+    # Session risk
+    def get_session_risk(self, user_id, session_key):
+        """(risk_level, score_sum, weight, updated_at) last saved for the session, or None"""
+        raise NotImplementedError
+
+    def save_session_risk(self, user_id, session_key, risk_level, score_sum, weight, timestamp):
+        raise NotImplementedError
+
+    # Data erasure and export
+    def user_rows(self, table, user_ids, page_size=5000):
+        """Yield (user_id, *USER_DATA_TABLES[table]) rows belonging to the users"""
+        raise NotImplementedError
+
+    def delete_user_rows(self, table, user_ids, limit):
+        """Delete up to limit of the users' rows from table in one transaction; returns the count"""
+        raise NotImplementedError
+
+    # Configuration
+    def config_version(self):
+        raise NotImplementedError
+
+    def load_config(self):
+        """scope -> config JSON"""
+        raise NotImplementedError
+
+    def save_config(self, scope, config_json, min_version, timestamp):
+        """Store a scope's config under a new version (at least min_version) and return it"""
+        raise NotImplementedError
+
+class SQLStorage(StorageBackend):
+    """StorageBackend over a DB-API connection pool; queries are written with ? placeholders"""
+
+    # Column that orders security_events for the feed
+    EVENT_SEQ = 'seq'
+    # Physical row identifier, used to delete in bounded chunks
+    ROW_ID = 'rowid'
+
+    def connect(self):
+        raise NotImplementedError
+
+    def sql(self, query):
+        return query
+
+    def rows(self, rows):
+        return rows
+
+    def stream_cursor(self, conn):
+        """Cursor for scans too large to fetch at once"""
+        return conn.cursor()
+
+    def query(self, query, params=()):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.sql(query), params)
+            return self.rows(cursor.fetchall())
+        finally:
+            conn.close()
+
+    def scan(self, query, params=(), page_size=5000):
+        """Stream a large result in pages, holding one connection until exhausted or closed"""
+        conn = self.connect()
+        try:
+            cursor = self.stream_cursor(conn)
+            cursor.execute(self.sql(query), params)
+            while True:
+                rows = cursor.fetchmany(page_size)
+                if not rows:
+                    break
+                yield from self.rows(rows)
+        finally:
+            conn.close()
+
+    def write(self, query, params=(), many=False):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            if many:
+                cursor.executemany(self.sql(query), params)
+            else:
+                cursor.execute(self.sql(query), params)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def insert_session(self, session_id, user_id, behavior_json, risk_score, anomaly, timestamp,
+                       sampled=False, replace_since=None):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            if replace_since:
+                cursor.execute(self.sql('''
+                    DELETE FROM behavior_sessions WHERE session_id = (
+                        SELECT session_id FROM behavior_sessions
+                        WHERE user_id = ? AND timestamp >= ? AND sampled = 1
+                        ORDER BY RANDOM()
+                        LIMIT 1
+                    )
+                '''), (user_id, replace_since))
+            cursor.execute(self.sql('''
+                INSERT INTO behavior_sessions 
+                (session_id, user_id, behavior_data, risk_score, anomaly_detected, timestamp, sampled)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            '''), (session_id, user_id, behavior_json, float(risk_score), bool(anomaly), timestamp,
+                   1 if sampled else 0))
+            conn.commit()
+        finally:
+            conn.close()
+
+    def recent_sessions(self, user_id, limit):
+        rows = self.query('''
+            SELECT behavior_data FROM behavior_sessions 
+            WHERE user_id = ? 
+            ORDER BY timestamp DESC 
+            LIMIT ?
+        ''', (user_id, limit))
+        return [row[0] for row in rows]
+
+    def session_window(self, user_id, limit, since=None):
+        if since is None:
+            return self.query('''
+                SELECT behavior_data, timestamp FROM behavior_sessions 
+                WHERE user_id = ?
+                ORDER BY timestamp DESC 
+                LIMIT ?
+            ''', (user_id, limit))
+        return self.query('''
+            SELECT behavior_data, timestamp FROM behavior_sessions 
+            WHERE user_id = ? AND timestamp > ?
+            ORDER BY timestamp DESC 
+            LIMIT ?
+        ''', (user_id, since, limit))
+
+    def iter_sessions(self, start=None, end=None, page_size=5000):
+        conditions, params = [], []
+        if start:
+            conditions.append('timestamp >= ?')
+            params.append(start)
+        if end:
+            conditions.append('timestamp < ?')
+            params.append(end)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self.scan(f'''
+            SELECT session_id, user_id, behavior_data, risk_score, anomaly_detected, timestamp
+            FROM behavior_sessions
+            {where}
+            ORDER BY timestamp
+        ''', params, page_size)
+
+    def users_by_recency(self):
+        return self.scan('''
+            SELECT MAX(timestamp) AS last_seen, user_id FROM behavior_sessions
+            GROUP BY user_id
+            ORDER BY last_seen DESC
+        ''')
+
+    def pending_users(self, since, after_user, limit):
+        rows = self.query('''
+            SELECT DISTINCT s.user_id FROM behavior_sessions s
+            LEFT JOIN behavior_models m ON m.user_id = s.user_id
+            WHERE s.user_id > ? AND (m.user_id IS NULL OR m.last_updated < ?)
+            ORDER BY s.user_id
+            LIMIT ?
+        ''', (after_user, since, limit))
+        return [row[0] for row in rows]
+
+    def get_model_metadata(self, user_id):
+        rows = self.query('SELECT model_data FROM behavior_models WHERE user_id = ?', (user_id,))
+        return rows[0][0] if rows else None
+
+    def save_model_metadata(self, user_id, metadata_json, confidence, timestamp):
+        self.write('''
+            INSERT INTO behavior_models (user_id, model_data, confidence, last_updated, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id) DO UPDATE SET
+                model_data = excluded.model_data,
+                confidence = excluded.confidence,
+                last_updated = excluded.last_updated
+        ''', (user_id, metadata_json, float(confidence), timestamp, timestamp))
+
+    def insert_security_event(self, event_id, user_id, event_type, severity, description, timestamp):
+        # SQLite assigns seq inside its single write transaction, so values
+        # become visible in increasing order; AUTOINCREMENT never hands out a
+        # purged value again
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO security_events 
+                (event_id, user_id, event_type, severity, description, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (event_id, user_id, event_type, severity, description, timestamp))
+            conn.commit()
+            return cursor.lastrowid
+        finally:
+            conn.close()
+
+    def user_security_events(self, user_id, limit):
+        return self.query('''
+            SELECT event_type, severity, description, timestamp 
+            FROM security_events 
+            WHERE user_id = ? 
+            ORDER BY timestamp DESC 
+            LIMIT ?
+        ''', (user_id, limit))
+
+    def security_events_after(self, cursor, limit):
+        return self.query(f'''
+            SELECT {self.EVENT_SEQ}, event_id, user_id, event_type, severity, description, timestamp
+            FROM security_events
+            WHERE {self.EVENT_SEQ} > ?
+            ORDER BY {self.EVENT_SEQ}
+            LIMIT ?
+        ''', (cursor, limit))
+
+    def security_events_head(self):
+        return self.query(f'SELECT MAX({self.EVENT_SEQ}) FROM security_events')[0][0] or 0
+
+    def merge_risk_rollups(self, rows):
+        self.write('''
+            INSERT INTO risk_rollups
+            (bucket_start, cohort, risk_level, sessions, anomalies, events, risk_score_sum)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (bucket_start, cohort, risk_level) DO UPDATE SET
+                sessions = risk_rollups.sessions + excluded.sessions,
+                anomalies = risk_rollups.anomalies + excluded.anomalies,
+                events = risk_rollups.events + excluded.events,
+                risk_score_sum = risk_rollups.risk_score_sum + excluded.risk_score_sum
+        ''', rows, many=True)
+
+    def risk_rollups_since(self, since):
+        return self.query('''
+            SELECT bucket_start, cohort, risk_level, sessions, anomalies, events, risk_score_sum
+            FROM risk_rollups
+            WHERE bucket_start >= ?
+        ''', (since,))
+
+    def merge_session_counters(self, rows):
+        self.write('''
+            INSERT INTO user_session_counters
+            (user_id, window_start, sessions, sampled, risk_score_sum)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, window_start) DO UPDATE SET
+                sessions = user_session_counters.sessions + excluded.sessions,
+                sampled = user_session_counters.sampled + excluded.sampled,
+                risk_score_sum = user_session_counters.risk_score_sum + excluded.risk_score_sum
+        ''', rows, many=True)
+
+    def get_session_risk(self, user_id, session_key):
+        rows = self.query('''
+            SELECT risk_level, score_sum, weight, updated_at FROM session_risk
+            WHERE user_id = ? AND session_key = ?
+        ''', (user_id, session_key))
+        return rows[0] if rows else None
+
+    def save_session_risk(self, user_id, session_key, risk_level, score_sum, weight, timestamp):
+        self.write('''
+            INSERT INTO session_risk (user_id, session_key, risk_level, score_sum, weight, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (user_id, session_key) DO UPDATE SET
+                risk_level = excluded.risk_level,
+                score_sum = excluded.score_sum,
+                weight = excluded.weight,
+                updated_at = excluded.updated_at
+        ''', (user_id, session_key, risk_level, float(score_sum), float(weight), timestamp))
+
+    def user_rows(self, table, user_ids, page_size=5000):
+        placeholders = ', '.join('?' * len(user_ids))
+        return self.scan(f'''
+            SELECT user_id, {', '.join(USER_DATA_TABLES[table])} FROM {table}
+            WHERE user_id IN ({placeholders})
+        ''', list(user_ids), page_size)
+
+    def delete_user_rows(self, table, user_ids, limit):
+        if table not in USER_DATA_TABLES:
+            raise ValueError(f'Not a user data table: {table}')
+        placeholders = ', '.join('?' * len(user_ids))
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(self.sql(f'''
+                DELETE FROM {table} WHERE {self.ROW_ID} IN (
+                    SELECT {self.ROW_ID} FROM {table}
+                    WHERE user_id IN ({placeholders})
+                    LIMIT ?
+                )
+            '''), (*user_ids, limit))
+            deleted = cursor.rowcount
+            conn.commit()
+            return deleted
+        finally:
+            conn.close()
+
+    def config_version(self):
+        return self.query('SELECT MAX(version) FROM bbca_config')[0][0] or 0
+
+    def load_config(self):
+        return dict(self.query('SELECT scope, config FROM bbca_config'))
+
+    def save_config(self, scope, config_json, min_version, timestamp):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            self.lock_config(cursor)
+            cursor.execute(self.sql('SELECT COALESCE(MAX(version), 0) + 1 FROM bbca_config'))
+            version = max(cursor.fetchone()[0], min_version)
+            cursor.execute(self.sql('''
+                INSERT INTO bbca_config (scope, config, version, updated_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (scope) DO UPDATE SET
+                    config = excluded.config,
+                    version = excluded.version,
+                    updated_at = excluded.updated_at
+            '''), (scope, config_json, version, timestamp))
+            conn.commit()
+            return version
+        finally:
+            conn.close()
+
+    def lock_config(self, cursor):
+        """Serialize version allocation across writers"""
+        cursor.execute('BEGIN IMMEDIATE')
+
+class SQLiteStorage(SQLStorage):
+    """The tenant's SQLite file through a pool of reusable connections"""
+
+    def __init__(self, db_path, pool_size=8):
+        self.db_path = db_path
+        init_db(db_path)
+        # Pooled connections move between request threads, one at a time
+        self.pool = ConnectionPool(lambda: sqlite3.connect(db_path, check_same_thread=False), pool_size)
+
+    def connect(self):
+        return self.pool.connect()
+
+class MemoryStorage(StorageBackend):
+    """Process-local storage for benchmarks and tests; nothing survives a restart"""
+
+    def __init__(self):
+        self.lock = Lock()
+        # user_id -> [(timestamp, session_id, behavior JSON, risk_score, anomaly, sampled)] in insertion order
+        self.sessions = defaultdict(list)
+        self.models = {}
+        # Index i holds the event with sequence number i + 1
+        self.events = []
+        self.rollups = defaultdict(lambda: [0, 0, 0, 0.0])
+        self.counters = defaultdict(lambda: [0, 0, 0.0])
+        # (user_id, session_key) -> (risk_level, score_sum, weight, updated_at)
+        self.session_risk = {}
+        # scope -> (config JSON, version)
+        self.config = {}
+
+    def insert_session(self, session_id, user_id, behavior_json, risk_score, anomaly, timestamp,
+                       sampled=False, replace_since=None):
+        with self.lock:
+            sessions = self.sessions[user_id]
+            if replace_since:
+                candidates = [i for i, row in enumerate(sessions) if row[5] and row[0] >= replace_since]
+                if candidates:
+                    del sessions[random.choice(candidates)]
+            sessions.append((str(timestamp), session_id, behavior_json, float(risk_score), bool(anomaly), sampled))
+
+    def recent_sessions(self, user_id, limit):
+        return [row[2] for row in self.session_window_rows(user_id, limit)]
+
+    def session_window_rows(self, user_id, limit, since=None):
+        with self.lock:
+            rows = [row for row in self.sessions.get(user_id, ()) if since is None or row[0] > since]
+        return sorted(rows, key=lambda row: row[0], reverse=True)[:limit]
+
+    def session_window(self, user_id, limit, since=None):
+        return [(row[2], row[0]) for row in self.session_window_rows(user_id, limit, since)]
+
+    def iter_sessions(self, start=None, end=None, page_size=5000):
+        with self.lock:
+            rows = [(row[0], row[1], user_id, row[2], row[3], row[4])
+                    for user_id, sessions in self.sessions.items() for row in sessions
+                    if (not start or row[0] >= start) and (not end or row[0] < end)]
+        for timestamp, session_id, user_id, behavior_json, risk_score, anomaly in sorted(rows):
+            yield session_id, user_id, behavior_json, risk_score, anomaly, timestamp
+
+    def users_by_recency(self):
+        with self.lock:
+            latest = [(max(row[0] for row in sessions), user_id)
+                      for user_id, sessions in self.sessions.items() if sessions]
+        yield from sorted(latest, reverse=True)
+
+    def pending_users(self, since, after_user, limit):
+        with self.lock:
+            users = sorted(user_id for user_id, sessions in self.sessions.items()
+                           if sessions and user_id > after_user and
+                           (user_id not in self.models or self.models[user_id][2] < since))
+        return users[:limit]
+
+    def get_model_metadata(self, user_id):
+        model = self.models.get(user_id)
+        return model[0] if model else None
+
+    def save_model_metadata(self, user_id, metadata_json, confidence, timestamp):
+        with self.lock:
+            self.models[user_id] = (metadata_json, float(confidence), str(timestamp))
+
+    def insert_security_event(self, event_id, user_id, event_type, severity, description, timestamp):
+        with self.lock:
+            self.events.append((event_id, user_id, event_type, severity, description, str(timestamp)))
+            return len(self.events)
+
+    def user_security_events(self, user_id, limit):
+        with self.lock:
+            rows = [event[2:] for event in self.events if event and event[1] == user_id]
+        return sorted(rows, key=lambda row: row[3], reverse=True)[:limit]
+
+    def security_events_after(self, cursor, limit):
+        rows = []
+        with self.lock:
+            # Erased events leave None behind so sequence numbers stay put
+            for seq in range(max(int(cursor), 0) + 1, len(self.events) + 1):
+                event = self.events[seq - 1]
+                if event is not None:
+                    rows.append((seq, *event))
+                    if len(rows) >= limit:
+                        break
+        return rows
+
+    def security_events_head(self):
+        return len(self.events)
+
+    def merge_risk_rollups(self, rows):
+        with self.lock:
+            for row in rows:
+                merged = self.rollups[tuple(row[:3])]
+                for i, value in enumerate(row[3:]):
+                    merged[i] += value
+
+    def risk_rollups_since(self, since):
+        with self.lock:
+            return [key + tuple(counters) for key, counters in self.rollups.items() if key[0] >= since]
+
+    def merge_session_counters(self, rows):
+        with self.lock:
+            for row in rows:
+                merged = self.counters[tuple(row[:2])]
+                for i, value in enumerate(row[2:]):
+                    merged[i] += value
+
+    def get_session_risk(self, user_id, session_key):
+        return self.session_risk.get((user_id, session_key))
+
+    def save_session_risk(self, user_id, session_key, risk_level, score_sum, weight, timestamp):
+        with self.lock:
+            self.session_risk[(user_id, session_key)] = (risk_level, float(score_sum), float(weight), str(timestamp))
+
+    def user_rows(self, table, user_ids, page_size=5000):
+        users = set(user_ids)
+        with self.lock:
+            if table == 'behavior_sessions':
+                rows = [(user_id, row[1], row[2], row[3], row[4], row[0], int(row[5]))
+                        for user_id in users for row in self.sessions.get(user_id, ())]
+            elif table == 'security_events':
+                rows = [(event[1], event[0], *event[2:]) for event in self.events if event and event[1] in users]
+            elif table == 'user_session_counters':
+                rows = [key + tuple(counters) for key, counters in self.counters.items() if key[0] in users]
+            elif table == 'session_risk':
+                rows = [key + state for key, state in self.session_risk.items() if key[0] in users]
+            elif table == 'behavior_models':
+                rows = [(user_id, *self.models[user_id], self.models[user_id][2])
+                        for user_id in users if user_id in self.models]
+            else:
+                raise ValueError(f'Not a user data table: {table}')
+        return iter(rows)
+
+    def delete_user_rows(self, table, user_ids, limit):
+        users = set(user_ids)
+        deleted = 0
+        with self.lock:
+            if table == 'behavior_sessions':
+                for user_id in users:
+                    sessions = self.sessions.get(user_id)
+                    if sessions:
+                        count = min(len(sessions), limit - deleted)
+                        del sessions[:count]
+                        deleted += count
+                        if not sessions:
+                            del self.sessions[user_id]
+                    if deleted >= limit:
+                        break
+            elif table == 'security_events':
+                for i, event in enumerate(self.events):
+                    if deleted >= limit:
+                        break
+                    if event and event[1] in users:
+                        self.events[i] = None
+                        deleted += 1
+            elif table == 'user_session_counters':
+                for key in [key for key in self.counters if key[0] in users][:limit]:
+                    del self.counters[key]
+                    deleted += 1
+            elif table == 'session_risk':
+                for key in [key for key in self.session_risk if key[0] in users][:limit]:
+                    del self.session_risk[key]
+                    deleted += 1
+            elif table == 'behavior_models':
+                for user_id in [user_id for user_id in users if user_id in self.models][:limit]:
+                    del self.models[user_id]
+                    deleted += 1
+            else:
+                raise ValueError(f'Not a user data table: {table}')
+        return deleted
+
+    def config_version(self):
+        with self.lock:
+            return max((version for _, version in self.config.values()), default=0)
+
+    def load_config(self):
+        with self.lock:
+            return {scope: config_json for scope, (config_json, _) in self.config.items()}
+
+    def save_config(self, scope, config_json, min_version, timestamp):
+        with self.lock:
+            version = max(max((version for _, version in self.config.values()), default=0) + 1, min_version)
+            self.config[scope] = (config_json, version)
+            return version
+
+class PostgresStorage(SQLStorage):
+    """Client/server storage in a PostgreSQL database, so several nodes can write concurrently
+
+    Each tenant gets its own schema (the default tenant uses bbca_default).
+    Connections are pooled and capped at pool_size per tenant; callers block
+    while all of them are checked out.
+    """
+
+    ROW_ID = 'ctid'
+
+    SCHEMA = [
+        '''CREATE TABLE IF NOT EXISTS behavior_models (
+            user_id TEXT PRIMARY KEY,
+            model_data TEXT,
+            confidence DOUBLE PRECISION,
+            last_updated TIMESTAMP,
+            created_at TIMESTAMP
+        )''',
+        '''CREATE TABLE IF NOT EXISTS behavior_sessions (
+            session_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            behavior_data TEXT,
+            risk_score DOUBLE PRECISION,
+            anomaly_detected BOOLEAN,
+            timestamp TIMESTAMP,
+            sampled INTEGER DEFAULT 0
+        )''',
+        '''CREATE TABLE IF NOT EXISTS security_events (
+            seq BIGSERIAL UNIQUE,
+            event_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            event_type TEXT,
+            severity TEXT,
+            description TEXT,
+            timestamp TIMESTAMP
+        )''',
+        '''CREATE INDEX IF NOT EXISTS idx_behavior_sessions_user_time
+            ON behavior_sessions (user_id, timestamp)''',
+        '''CREATE INDEX IF NOT EXISTS idx_security_events_user_time
+            ON security_events (user_id, timestamp)''',
+        '''CREATE TABLE IF NOT EXISTS risk_rollups (
+            bucket_start TIMESTAMP,
+            cohort TEXT,
+            risk_level TEXT,
+            sessions INTEGER DEFAULT 0,
+            anomalies INTEGER DEFAULT 0,
+            events INTEGER DEFAULT 0,
+            risk_score_sum DOUBLE PRECISION DEFAULT 0,
+            PRIMARY KEY (bucket_start, cohort, risk_level)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS user_session_counters (
+            user_id TEXT,
+            window_start TIMESTAMP,
+            sessions INTEGER DEFAULT 0,
+            sampled INTEGER DEFAULT 0,
+            risk_score_sum DOUBLE PRECISION DEFAULT 0,
+            PRIMARY KEY (user_id, window_start)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS session_risk (
+            user_id TEXT,
+            session_key TEXT,
+            risk_level TEXT,
+            score_sum DOUBLE PRECISION,
+            weight DOUBLE PRECISION,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (user_id, session_key)
+        )''',
+        '''CREATE TABLE IF NOT EXISTS bbca_config (
+            scope TEXT PRIMARY KEY,
+            config TEXT,
+            version INTEGER,
+            updated_at TIMESTAMP
+        )'''
+    ]
+
+    # pg_advisory_xact_lock keys
+    EVENT_LOCK = 0x62626361
+    CONFIG_LOCK = 0x62626362
+
+    def __init__(self, dsn, tenant_id=None, pool_size=8):
+        if psycopg2 is None:
+            raise RuntimeError('PostgreSQL storage requires the psycopg2 package')
+        self.dsn = dsn
+        self.schema = self.schema_for(tenant_id)
+        self.pool = ConnectionPool(self.open_connection, pool_size, max_open=pool_size)
+        
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            for statement in self.SCHEMA:
+                cursor.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+
+    @staticmethod
+    def schema_for(tenant_id):
+        return f'bbca_{tenant_id}' if tenant_id else 'bbca_default'
+
+    @staticmethod
+    def tenant_ids(dsn):
+        """Tenants with a schema in the database"""
+        conn = psycopg2.connect(dsn)
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT schema_name FROM information_schema.schemata WHERE schema_name LIKE 'bbca\\_%'")
+            names = [row[0][len('bbca_'):] for row in cursor.fetchall()]
+        finally:
+            conn.close()
+        return sorted(name for name in names if name != 'default' and TENANT_ID_PATTERN.match(name))
+
+    def open_connection(self):
+        conn = psycopg2.connect(self.dsn)
+        # Tenant IDs may contain '-' and upper case, so the schema is always quoted
+        cursor = conn.cursor()
+        cursor.execute(f'CREATE SCHEMA IF NOT EXISTS "{self.schema}"')
+        cursor.execute(f'SET search_path TO "{self.schema}"')
+        conn.commit()
+        return conn
+
+    def connect(self):
+        return self.pool.connect()
+
+    def sql(self, query):
+        return query.replace('?', '%s')
+
+    def rows(self, rows):
+        return [tuple(str(value) if isinstance(value, datetime) else value for value in row) for row in rows]
+
+    def stream_cursor(self, conn):
+        # Named cursors stay on the server instead of fetching the whole result
+        return conn.cursor(name=f'bbca_scan_{uuid.uuid4().hex}')
+
+    def insert_security_event(self, event_id, user_id, event_type, severity, description, timestamp):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            # Sequence values from concurrent transactions can commit out of order;
+            # serializing event inserts keeps the feed gap-free for consumers
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', (self.EVENT_LOCK,))
+            cursor.execute('''
+                INSERT INTO security_events 
+                (event_id, user_id, event_type, severity, description, timestamp)
+                VALUES (%s, %s, %s, %s, %s, %s)
+                RETURNING seq
+            ''', (event_id, user_id, event_type, severity, description, timestamp))
+            seq = cursor.fetchone()[0]
+            conn.commit()
+            return seq
+        finally:
+            conn.close()
+
+    def lock_config(self, cursor):
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', (self.CONFIG_LOCK,))
+
+class TenantRegistry:
+    """Maps tenants to their own storage, model namespace and connection pool
+
+    storage_url selects the backend: 'sqlite' (default), 'memory' or a
+    postgresql:// DSN. With SQLite the default tenant (no tenant ID) keeps the
+    original bbca_data.db and models/ layout; named tenants live under
+    <root>/<tenant_id>/ and are created on first use.
+    """
+
+    def __init__(self, root='tenants', pool_size=8, api_keys=None, storage_url='sqlite', provisioned=None):
+        self.root = root
+        self.pool_size = pool_size
+        self.storage_url = storage_url
+        # API key -> tenant ID
+        self.api_keys = api_keys or {}
+        # Tenants requests may address besides API key tenants and those with stored data
+        self.provisioned = set(provisioned or ())
+        self.lock = Lock()
+        self.storages = {}
+        self.engines = {}
+        # One memory budget across tenants; entries are keyed by path so namespaces never mix
+        self.model_cache = ModelCache(int(os.getenv('BBCA_MODEL_CACHE_MB', '512')) * 1024 * 1024)
+        self.model_tiers = ModelTierStats()
+
+    @staticmethod
+    def parse_api_keys(spec):
+        """Parse 'key:tenant,key:tenant' into a key -> tenant mapping"""
+        api_keys = {}
+        for pair in filter(None, (item.strip() for item in (spec or '').split(','))):
+            api_key, _, tenant_id = pair.partition(':')
+            api_keys[api_key] = tenant_id
+        return api_keys
+
+    def validate(self, tenant_id):
+        if tenant_id is not None and not TENANT_ID_PATTERN.match(tenant_id):
+            raise ValueError('Invalid tenant ID')
+        return tenant_id
+
+    def tenant_for_key(self, api_key):
+        tenant_id = self.api_keys.get(api_key)
+        if tenant_id is None:
+            raise PermissionError('Unknown API key')
+        return tenant_id or None
+
+    def is_provisioned(self, tenant_id):
+        """Whether requests may address tenant_id; only these ever get storage created"""
+        if tenant_id is None or tenant_id in self.storages or tenant_id in self.provisioned or \
+                tenant_id in self.api_keys.values():
+            return True
+        if self.storage_url == 'sqlite':
+            return os.path.exists(self.db_path(tenant_id))
+        if self.storage_url == 'memory':
+            return False
+        return tenant_id in PostgresStorage.tenant_ids(self.storage_url)
+
+    def tenant_dir(self, tenant_id):
+        return '.' if tenant_id is None else os.path.join(self.root, tenant_id)
+
+    def db_path(self, tenant_id=None):
+        return os.path.join(self.tenant_dir(tenant_id), 'bbca_data.db') if tenant_id else 'bbca_data.db'
+
+    def create_storage(self, tenant_id):
+        if self.storage_url == 'memory':
+            return MemoryStorage()
+        if self.storage_url.startswith(('postgresql://', 'postgres://')):
+            return PostgresStorage(self.storage_url, tenant_id, self.pool_size)
+        if self.storage_url != 'sqlite':
+            raise ValueError(f'Unsupported storage: {self.storage_url}')
+        os.makedirs(self.tenant_dir(tenant_id), exist_ok=True)
+        return SQLiteStorage(self.db_path(tenant_id), self.pool_size)
+
+    def storage(self, tenant_id=None):
+        """The tenant's StorageBackend, created (with its schema) on first use"""
+        storage = self.storages.get(tenant_id)
+        if storage is None:
+            with self.lock:
+                storage = self.storages.get(tenant_id)
+                if storage is None:
+                    self.validate(tenant_id)
+                    storage = self.storages[tenant_id] = self.create_storage(tenant_id)
+        return storage
+
+    def engine(self, tenant_id=None):
+        """BBCAEngine whose models live in the tenant's namespace"""
+        engine = self.engines.get(tenant_id)
+        if engine is None:
+            with self.lock:
+                engine = self.engines.get(tenant_id)
+                if engine is None:
+                    self.validate(tenant_id)
+                    models_dir = os.path.join(self.tenant_dir(tenant_id), 'models') if tenant_id else 'models'
+                    engine = self.engines[tenant_id] = BBCAEngine(models_dir, self.model_cache, self.model_tiers)
+        return engine
+
+    def known(self):
+        """The default tenant plus every tenant with stored data"""
+        tenant_ids = [None]
+        if self.storage_url == 'memory':
+            return tenant_ids + sorted(tenant_id for tenant_id in self.storages if tenant_id)
+        if self.storage_url != 'sqlite':
+            return tenant_ids + PostgresStorage.tenant_ids(self.storage_url)
+        if os.path.isdir(self.root):
+            for name in sorted(os.listdir(self.root)):
+                if TENANT_ID_PATTERN.match(name) and os.path.exists(self.db_path(name)):
+                    tenant_ids.append(name)
+        return tenant_ids
+
+class SecurityEventFeed:
+    """Append-only change feed over security_events for downstream consumers (SIEM)
+
+    Storage backends hand out sequence numbers that become visible in increasing
+    order, so a consumer resuming after the last sequence it saw never skips an
+    event. Writers in this process wake waiting consumers immediately; writes from other
+    processes are picked up on the next poll.
+    """
+
+    def __init__(self, max_streams=16, poll_interval=1.0, heartbeat=15.0):
+        self.max_streams = max_streams
+        self.poll_interval = poll_interval
+        self.heartbeat = heartbeat
+        self.condition = Condition()
+        # tenant -> highest sequence number written by this process
+        self.latest = {}
+        self.streams = 0
+        self.delivered = 0
+    
+    def notify(self, tenant_id, seq):
+        with self.condition:
+            if seq > self.latest.get(tenant_id, 0):
+                self.latest[tenant_id] = seq
+            self.condition.notify_all()
+    
+    def head(self, tenant_id=None):
+        """Sequence number of the newest event, for consumers starting at the tail"""
+        return tenants.storage(tenant_id).security_events_head()
+    
+    def read(self, tenant_id, cursor, limit):
+        """Up to limit events with a sequence number greater than cursor, oldest first"""
+        rows = tenants.storage(tenant_id).security_events_after(cursor, limit)
+        events = [{
+            'seq': row[0],
+            'eventId': row[1],
+            'userId': row[2],
+            'eventType': row[3],
+            'severity': row[4],
+            'description': row[5],
+            'timestamp': row[6]
+        } for row in rows]
+        with self.condition:
+            self.delivered += len(events)
+        return events
+    
+    def wait(self, tenant_id, mark, timeout):
+        """Block until an event newer than mark is written here, or timeout elapses"""
+        with self.condition:
+            if self.latest.get(tenant_id, 0) == mark:
+                self.condition.wait(timeout)
+    
+    def poll(self, tenant_id, cursor, limit, wait):
+        """Long-poll: the next batch after cursor, waiting up to `wait` seconds for one"""
+        deadline = time.monotonic() + wait
+        while True:
+            mark = self.latest.get(tenant_id, 0)
+            events = self.read(tenant_id, cursor, limit)
+            remaining = deadline - time.monotonic()
+            if events or remaining <= 0:
+                return events
+            self.wait(tenant_id, mark, min(remaining, self.poll_interval))
+    
+    def open_stream(self):
+        """Reserve a stream slot; each open stream holds a server thread"""
+        with self.condition:
+            if self.streams >= self.max_streams:
+                return False
+            self.streams += 1
+            return True
+    
+    def close_stream(self):
+        with self.condition:
+            self.streams -= 1
+    
+    def stream(self, tenant_id, cursor, limit):
+        """Server-Sent Events frames, one per batch, resuming after cursor
+
+        The next batch is only read once the previous frame has been written to
+        the client, so a slow consumer falls behind on its cursor instead of
+        events piling up in server memory.
+        """
+        last_sent = time.monotonic()
+        while True:
+            mark = self.latest.get(tenant_id, 0)
+            events = self.read(tenant_id, cursor, limit)
+            if events:
+                cursor = events[-1]['seq']
+                yield f"id: {cursor}\nevent: security-events\ndata: {json.dumps(events)}\n\n"
+                last_sent = time.monotonic()
+                continue
+            
+            # Comment frames keep proxies from closing an idle stream
+            if time.monotonic() - last_sent >= self.heartbeat:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            self.wait(tenant_id, mark, self.poll_interval)
+    
+    def stats(self):
+        with self.condition:
+            return {
+                'streams': self.streams,
+                'maxStreams': self.max_streams,
+                'delivered': self.delivered
+            }
+
+def tenant_user_key(tenant_id, user_id):
+    """Key for per-user in-memory state and socket rooms; user IDs are only unique per tenant"""
+    return f"{tenant_id or ''}/{user_id}"
+
+# Initialize services
+tenants = TenantRegistry(
+    os.getenv('BBCA_TENANT_ROOT', 'tenants'),
+    int(os.getenv('BBCA_DB_POOL_SIZE', '8')),
+    TenantRegistry.parse_api_keys(os.getenv('BBCA_TENANT_API_KEYS')),
+    os.getenv('BBCA_STORAGE_URL', 'sqlite'),
+    [tenant_id.strip() for tenant_id in os.getenv('BBCA_TENANTS', '').split(',') if tenant_id.strip()]
+)
+bbca_engine = tenants.engine()
+email_service = EmailNotificationService()
+risk_rollups = RiskRollupAggregator()
+atexit.register(risk_rollups.flush)
+session_sampler = SessionSampler()
+atexit.register(session_sampler.flush)
+config_store = ConfigStore()
+analyze_load = InFlightCounter()
+admission_control = AdmissionController(analyze_load)
+interval_planner = MonitoringIntervalPlanner(analyze_load)
+session_risk_tracker = SessionRiskTracker()
+behavior_snapshots = BehaviorSnapshotCache()
+assessment_cache = AssessmentCache()
+similarity_index = BehaviorSimilarityIndex(
+    int(os.getenv('BBCA_SIMILARITY_CAPACITY', '200000')),
+    int(os.getenv('BBCA_SIMILARITY_RETENTION', '3600'))
+)
+security_feed = SecurityEventFeed(int(os.getenv('BBCA_FEED_MAX_STREAMS', '16')))
+startup_state = {'status': 'starting', 'preloadedModels': 0, 'warmupSeconds': None}
+
+# Database helper functions
+def save_behavior_session(user_id, behavior_data, risk_assessment, tenant_id=None, session_id=None,
+                          sampled=False, replace_since=None):
+    """Save behavior session to database
+    
+    Sampled sessions belong to the user's low-risk reservoir; replace_since evicts
+    a random reservoir session of the window starting then in the same transaction.
+    """
+    try:
+        session_id = session_id or str(uuid.uuid4())
+        with request_tracer.span('db.save_session'):
+            tenants.storage(tenant_id).insert_session(
+                session_id,
+                user_id,
+                json.dumps(behavior_data),
+                risk_assessment.get('anomaly_score', 0),
+                risk_assessment.get('is_anomaly', False),
+                datetime.now(),
+                sampled,
+                replace_since
+            )
+        return session_id
+        
+    except Exception as e:
+        logger.error(f"Database save error: {e}")
+        return None
+
+def get_user_behavior_sessions(user_id, limit=50, tenant_id=None):
+    """Get user's behavior sessions from database"""
+    try:
+        return [json.loads(row) for row in tenants.storage(tenant_id).recent_sessions(user_id, limit)]
+        
+    except Exception as e:
+        logger.error(f"Database fetch error: {e}")
+        return []
+
+def get_user_training_window(user_id, limit=50, since=None, tenant_id=None):
+    """Get user's most recent behavior sessions and the newest session timestamp"""
+    try:
+        rows = tenants.storage(tenant_id).session_window(user_id, limit, since)
+        sessions = [json.loads(row[0]) for row in rows]
+        latest_at = rows[0][1] if rows else since
+        return sessions, latest_at
+        
+    except Exception as e:
+        logger.error(f"Database fetch error: {e}")
+        return [], since
+
+def get_model_lineage(user_id, tenant_id=None):
+    """Get the lineage record of a user's current model"""
+    try:
+        metadata = tenants.storage(tenant_id).get_model_metadata(user_id)
+        return json.loads(metadata) if metadata else None
+        
+    except Exception as e:
+        logger.error(f"Model lineage fetch error: {e}")
+        return None
+
+def save_model_lineage(user_id, training, previous_lineage, last_session_at, tenant_id=None):
+    """Record a trained model version in behavior_models"""
+    history = list((previous_lineage or {}).get('history', []))
+    entry = {
+        'version': training['version'],
+        'mode': training['mode'],
+        'sessionsUsed': training['sessionsUsed'],
+        'newSessions': training['newSessions'],
+        'treesReplaced': training['treesReplaced'],
+        'trainedAt': datetime.now().isoformat()
+    }
+    history = (history + [entry])[-20:]
+    lineage = dict(entry)
+    lineage.update({
+        'parentVersion': (previous_lineage or {}).get('version'),
+        'modelPath': training['modelPath'],
+        'nEstimators': training['nEstimators'],
+        'featureCount': len(FEATURE_NAMES),
+        'lastSessionAt': last_session_at,
+        'history': history
+    })
+    
+    try:
+        tenants.storage(tenant_id).save_model_metadata(user_id, json.dumps(lineage), training['confidence'],
+                                                       datetime.now())
+        
+    except Exception as e:
+        logger.error(f"Model lineage save error: {e}")
+    return lineage
+
+def retrain_user(user_id, config, warm_start=True, tenant_id=None):
+    """Train or warm-start a user's model and record its lineage
+    
+    Returns a (status, details) tuple where status is one of 'trained',
+    'up_to_date', 'insufficient_data' or 'failed'.
+    """
+    lineage = get_model_lineage(user_id, tenant_id)
+    sessions, latest_at = get_user_training_window(user_id, tenant_id=tenant_id)
+    
+    if len(sessions) < 5:
+        return 'insufficient_data', {'sessionsCount': len(sessions), 'requiredSessions': 5}
+    
+    new_sessions = None
+    if warm_start and lineage and lineage.get('featureCount') == len(FEATURE_NAMES):
+        new_sessions, _ = get_user_training_window(user_id, since=lineage.get('lastSessionAt'), tenant_id=tenant_id)
+        if not new_sessions:
+            return 'up_to_date', {'version': lineage['version']}
+    
+    version = (lineage or {}).get('version', 0) + 1
+    training = tenants.engine(tenant_id).train_user_model(user_id, sessions, config, new_sessions, version)
+    if not training:
+        return 'failed', {}
+    
+    save_model_lineage(user_id, training, lineage, latest_at, tenant_id)
+    return 'trained', training
+
+def log_security_event(user_id, event_type, severity, description, cohort='default', tenant_id=None):
+    """Log security event to database"""
+    risk_rollups.record_event(cohort, severity, tenant_id)
+    try:
+        with request_tracer.span('db.security_event'):
+            seq = tenants.storage(tenant_id).insert_security_event(
+                str(uuid.uuid4()),
+                user_id,
+                event_type,
+                severity,
+                description,
+                datetime.now()
+            )
+        security_feed.notify(tenant_id, seq)
+        
+    except Exception as e:
+        logger.error(f"Security event logging error: {e}")
+
+# Analysis pipeline
+def persist_behavior_assessment(user_id, behavior_data, risk_assessment, config, cohort='default',
+                                tenant_id=None, session_id=None):
+    """Store a scored behavior snapshot, update rollups and indexes and raise alerts"""
+    risk_rollups.record_session(cohort, risk_assessment, tenant_id)
+    user_key = tenant_user_key(tenant_id, user_id)
+    
+    summary = behavior_data.get('featureSummary') or bbca_engine.summarize_behavior(behavior_data)
+    
+    # Save session to database; sampled low-risk sessions only need their features for training
+    decision, window_start = session_sampler.decide(tenant_id, user_id, risk_assessment, config)
+    if decision == 'full':
+        session_id = save_behavior_session(user_id, behavior_data, risk_assessment, tenant_id, session_id)
+    elif decision == 'folded':
+        session_id = session_id or str(uuid.uuid4())
+    else:
+        session_id = save_behavior_session(user_id, {'featureSummary': summary}, risk_assessment, tenant_id,
+                                           session_id, sampled=True,
+                                           replace_since=window_start if decision == 'replaced' else None)
+    if session_id:
+        behavior_snapshots.put(user_key, session_id, summary)
+    
+    # One fingerprint turning up on several accounts suggests a shared attacker
+    if config['similarityEnabled']:
+        matches = similarity_index.add(tenant_id, user_id, summary, config)
+        if len(matches) >= config['similarityMinUsers'] and \
+                similarity_index.should_alert(tenant_id, user_id, config['similarityWindow']):
+            log_security_event(
+                user_id,
+                'correlated_behavior',
+                'high',
+                f"Behavior matches {len(matches)} other users in the last "
+                f"{config['similarityWindow'] // 60} min: {', '.join(sorted(matches)[:10])}",
+                cohort,
+                tenant_id
+            )
+    
+    # Log security event if anomaly detected
+    if risk_assessment['is_anomaly']:
+        log_security_event(
+            user_id,
+            'behavior_anomaly',
+            risk_assessment['risk_level'],
+            f"Anomaly score: {risk_assessment['anomaly_score']:.3f}",
+            cohort,
+            tenant_id
+        )
+        
+        # Send real-time alert via WebSocket, skipping users with no live connection
+        if connection_registry.has_user(user_key):
+            with request_tracer.span('emit'):
+                socketio.emit('security_alert', {
+                    'userId': user_id,
+                    'alertType': 'behavior_anomaly',
+                    'riskLevel': risk_assessment['risk_level'],
+                    'timestamp': datetime.now().isoformat()
+                }, room=user_key)
+    return session_id
+
+def rescore_behavior_assessment(user_id, behavior_data, config, cohort='default', tenant_id=None, session_id=None):
+    """Score a snapshot answered provisionally with the full model, then persist it"""
+    risk_assessment = tenants.engine(tenant_id).predict_anomaly(user_id, behavior_data, config)
+    return persist_behavior_assessment(user_id, behavior_data, risk_assessment, config, cohort, tenant_id, session_id)
+
+def build_assessment_response(tenant_id, user_id, session_id, risk_assessment, config, auth_session_id=None):
+    """Client response for a risk assessment; decisions follow the session's smoothed risk level"""
+    decision = planned = risk_assessment
+    session_risk = None
+    if config['sessionRiskEnabled']:
+        session_risk = session_risk_tracker.update(tenant_id, user_id, auth_session_id or '', risk_assessment, config)
+        decision = dict(risk_assessment, risk_level=session_risk['level'])
+        # A high-risk snapshot keeps the fast polling rate so its session confirms or clears it quickly
+        if risk_assessment['risk_level'] not in ('high', 'critical'):
+            planned = decision
+    
+    # Enhanced response with recommendations
+    response = {
+        'sessionId': session_id,
+        'riskAssessment': risk_assessment,
+        'recommendations': generate_recommendations(decision),
+        'requiresReAuth': RISK_LEVEL_SCORES[decision['risk_level']] >= config['reAuthThreshold'],
+        'blockedActions': get_blocked_actions(decision['risk_level']),
+        'nextInterval': interval_planner.next_interval(tenant_user_key(tenant_id, user_id), planned, config)
+    }
+    if session_risk:
+        response['sessionRisk'] = session_risk
+    return response
+
+def monitoring_disabled_response(config):
+    """Client response while monitoring is switched off for the user; nothing is scored or stored"""
+    return {
+        'sessionId': None,
+        'riskAssessment': None,
+        'monitoringEnabled': False,
+        'recommendations': [],
+        'requiresReAuth': False,
+        'blockedActions': [],
+        'nextInterval': config['maxMonitoringInterval']
+    }
+
+def record_behavior_assessment(user_id, behavior_data, risk_assessment, config, cohort='default', tenant_id=None,
+                               auth_session_id=None):
+    """Persist a scored behavior snapshot, raise alerts and build the client response"""
+    session_id = persist_behavior_assessment(user_id, behavior_data, risk_assessment, config, cohort, tenant_id)
+    return build_assessment_response(tenant_id, user_id, session_id, risk_assessment, config, auth_session_id)
+
+class StageLatencyTracker:
+    """Moving averages of analyze pipeline stage durations, used to predict what fits a deadline
+
+    The first sample of each stage is a cold start (imports, page cache) and is
+    dropped. A stage skipped because its estimate did not fit is still probed
+    every probe_interval seconds, so one slow sample cannot switch it off for good.
+    """
+
+    def __init__(self, alpha=0.1, probe_interval=5.0):
+        self.alpha = alpha
+        self.probe_interval = probe_interval
+        self.lock = Lock()
+        # stage -> seconds
+        self.averages = {}
+        self.warmed = set()
+        # stage -> monotonic time of the last observation or probe
+        self.last_run = {}
+
+    def observe(self, stage, seconds):
+        with self.lock:
+            self.last_run[stage] = time.monotonic()
+            if stage not in self.warmed:
+                self.warmed.add(stage)
+                return
+            average = self.averages.get(stage)
+            self.averages[stage] = seconds if average is None else average + self.alpha * (seconds - average)
+
+    def expected(self, stage):
+        return self.averages.get(stage, 0.0)
+
+    def probe(self, stage):
+        """Let one request run a stage that no longer fits, at most once per probe_interval"""
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_run.get(stage, 0.0) < self.probe_interval:
+                return False
+            self.last_run[stage] = now
+            return True
+
+    def stats(self):
+        with self.lock:
+            return {stage: round(seconds * 1000, 3) for stage, seconds in self.averages.items()}
+
+stage_latency = StageLatencyTracker()
+
+class RequestDeadline:
+    """Latency budget for one request, with per-stage timings for the Server-Timing header"""
+
+    def __init__(self, budget_ms=None):
+        self.started = time.monotonic()
+        self.last_mark = self.started
+        self.budget = budget_ms / 1000.0 if budget_ms else None
+        self.stages = []
+
+    def set_budget(self, budget_ms):
+        self.budget = budget_ms / 1000.0
+
+    def remaining(self):
+        if self.budget is None:
+            return float('inf')
+        return self.budget - (time.monotonic() - self.started)
+
+    def fits(self, *stages):
+        """Whether the stages are expected to finish within the remaining budget"""
+        return sum(stage_latency.expected(stage) for stage in stages) < self.remaining()
+
+    def mark(self, stage, track=True):
+        """Close the current stage; tracked stages feed the moving averages"""
+        now = time.monotonic()
+        self.stages.append((stage, now - self.last_mark))
+        if track:
+            stage_latency.observe(stage, now - self.last_mark)
+        self.last_mark = now
+
+    def server_timing(self):
+        timings = [f'{stage};dur={seconds * 1000:.2f}' for stage, seconds in self.stages]
+        timings.append(f'total;dur={(time.monotonic() - self.started) * 1000:.2f}')
+        return ', '.join(timings)
+
+class DeferredWriter:
+    """Background queue for persistence work pushed out of deadline-bound requests"""
+
+    def __init__(self, max_queue=10000):
+        self.queue = queue.Queue(maxsize=max_queue)
+        self.deferred = 0
+        self.rejected = 0
+
+    def submit(self, func, *args):
+        """Queue a call, returning False when the queue is full"""
+        try:
+            self.queue.put_nowait((func, args))
+            self.deferred += 1
+            return True
+        except queue.Full:
+            self.rejected += 1
+            return False
+
+    def run(self):
+        """Background loop running deferred writes in submission order"""
+        while True:
+            func, args = self.queue.get()
+            try:
+                func(*args)
+            except Exception as e:
+                logger.error(f"Deferred write error: {e}")
+
+    def stats(self):
+        return {'queued': self.queue.qsize(), 'deferred': self.deferred, 'rejected': self.rejected}
+
+deferred_writes = DeferredWriter()
+
+def forget_users(tenant_id, user_ids):
+    """Drop erased users' in-memory state: cached responses, snapshots, reservoirs, fingerprints"""
+    owners = {(tenant_id, user_id) for user_id in user_ids}
+    user_keys = [tenant_user_key(tenant_id, user_id) for user_id in user_ids]
+    session_sampler.forget(owners)
+    assessment_cache.forget(owners)
+    similarity_index.forget(owners)
+    behavior_snapshots.forget(user_keys)
+    interval_planner.forget(user_keys)
+    session_risk_tracker.forget(owners)
+
+class UserDataJobs:
+    """Background purge (right to erasure) and export jobs over batches of user IDs
+
+    Jobs run one at a time. Users are handled erasureBatchUsers at a time and
+    their rows deleted table by table in transactions of at most
+    erasureChunkRows rows, sleeping erasurePauseMs between chunks (longer while
+    analyze load is high), so a large erasure never holds the write lock long
+    enough to stall live scoring. Job state lives in memory; purges are
+    idempotent, so a job lost to a restart is simply resubmitted.
+    """
+
+    ACTIONS = ('purge', 'export')
+
+    def __init__(self, max_jobs=1000, max_users=100000):
+        self.max_jobs = max_jobs
+        self.max_users = max_users
+        self.queue = queue.Queue()
+        self.lock = Lock()
+        # job_id -> job status, oldest first
+        self.jobs = OrderedDict()
+
+    def submit(self, action, user_ids, tenant_id=None):
+        """Queue a job and return its status; raises ValueError on bad input"""
+        if action not in self.ACTIONS:
+            raise ValueError(f"action must be one of {list(self.ACTIONS)}")
+        if not isinstance(user_ids, list) or not user_ids or \
+                not all(isinstance(user_id, str) and user_id for user_id in user_ids):
+            raise ValueError('userIds must be a non-empty list of user IDs')
+        user_ids = list(dict.fromkeys(user_ids))
+        if len(user_ids) > self.max_users:
+            raise ValueError(f'At most {self.max_users} users per job')
+        
+        job = {
+            'jobId': str(uuid.uuid4()),
+            'action': action,
+            'tenantId': tenant_id,
+            'status': 'queued',
+            'users': len(user_ids),
+            'usersProcessed': 0,
+            'rows': {table: 0 for table in USER_DATA_TABLES},
+            'modelFiles': 0,
+            'error': None,
+            'submittedAt': datetime.now().isoformat(),
+            'startedAt': None,
+            'finishedAt': None
+        }
+        with self.lock:
+            self.jobs[job['jobId']] = job
+            # Forget the oldest finished jobs; queued and running ones are kept
+            for job_id in [job_id for job_id, old in self.jobs.items() if old['status'] in ('done', 'failed')]:
+                if len(self.jobs) <= self.max_jobs:
+                    break
+                del self.jobs[job_id]
+        self.queue.put((job, user_ids))
+        return self.get(job['jobId'])
+
+    def get(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return dict(job, rows=dict(job['rows'])) if job else None
+
+    def recent(self, limit=50):
+        with self.lock:
+            job_ids = list(self.jobs)[-limit:]
+        return [self.get(job_id) for job_id in reversed(job_ids)]
+
+    def remove(self, job_id):
+        """Forget a finished job and delete its export file"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            if job is None or job['status'] not in ('done', 'failed'):
+                return False
+            del self.jobs[job_id]
+        if job['action'] == 'export' and os.path.exists(self.export_path(job)):
+            os.remove(self.export_path(job))
+        return True
+
+    def export_path(self, job):
+        return os.path.join(tenants.tenant_dir(job['tenantId']), 'exports', f"{job['jobId']}.jsonl")
+
+    def batches(self, job, user_ids):
+        """Yield (config, user batch); config is re-read per batch so throttling changes apply mid-job"""
+        start = 0
+        while start < len(user_ids):
+            config = config_store.get(job['tenantId'])
+            size = int(config['erasureBatchUsers'])
+            yield config, user_ids[start:start + size]
+            job['usersProcessed'] += len(user_ids[start:start + size])
+            start += size
+
+    def pause(self, config):
+        load = analyze_load.active / config['targetConcurrency']
+        time.sleep(config['erasurePauseMs'] / 1000.0 * (1 + load))
+
+    def purge(self, job, user_ids):
+        storage = tenants.storage(job['tenantId'])
+        engine = tenants.engine(job['tenantId'])
+        for config, batch in self.batches(job, user_ids):
+            # Unflushed counters would otherwise write rows back after the delete
+            forget_users(job['tenantId'], batch)
+            chunk_rows = int(config['erasureChunkRows'])
+            for table in USER_DATA_TABLES:
+                while True:
+                    deleted = storage.delete_user_rows(table, batch, chunk_rows)
+                    job['rows'][table] += deleted
+                    if deleted:
+                        self.pause(config)
+                    if deleted < chunk_rows:
+                        break
+            job['modelFiles'] += engine.delete_models(batch)
+
+    def export(self, job, user_ids):
+        storage = tenants.storage(job['tenantId'])
+        # Low-risk session counts are buffered in memory; the export must include them
+        session_sampler.flush()
+        path = self.export_path(job)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        def write(f):
+            for config, batch in self.batches(job, user_ids):
+                for table, columns in USER_DATA_TABLES.items():
+                    for row in storage.user_rows(table, batch):
+                        record = {'table': table, 'user_id': row[0]}
+                        for column, value in zip(columns, row[1:]):
+                            if column in ('behavior_data', 'model_data') and value:
+                                value = json.loads(value)
+                            record[column] = value
+                        f.write(json.dumps(record).encode() + b'\n')
+                        job['rows'][table] += 1
+                self.pause(config)
+        
+        # Readers never see a partial export
+        publish_file(path, write)
+
+    def run(self):
+        """Background loop running jobs in submission order"""
+        while True:
+            job, user_ids = self.queue.get()
+            job['status'] = 'running'
+            job['startedAt'] = datetime.now().isoformat()
+            try:
+                if job['action'] == 'purge':
+                    self.purge(job, user_ids)
+                else:
+                    self.export(job, user_ids)
+                job['status'] = 'done'
+                logger.info(f"User data {job['action']} job {job['jobId']} finished: {job['rows']}")
+            except Exception as e:
+                logger.error(f"User data {job['action']} job {job['jobId']} failed: {e}")
+                job['error'] = str(e)
+                job['status'] = 'failed'
+            finally:
+                job['finishedAt'] = datetime.now().isoformat()
+
+user_data_jobs = UserDataJobs()
+
+class TraceSpan:
+    __slots__ = ('trace', 'name', 'started')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        now = time.monotonic()
+        self.trace['spans'].append((self.name, self.started - self.trace['started'], now - self.started))
+
+class NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+NULL_SPAN = NullSpan()
+
+class RequestTracer:
+    """Per-request span recording; requests slower than slowRequestMs are kept in a ring buffer
+
+    Spans are recorded for every request because slowness is only known at the
+    end, but they are cheap tuples and are dropped unless the request was slow.
+    Work outside a traced request thread (deferred writes, background loops)
+    records nothing.
+    """
+
+    def __init__(self, capacity=200):
+        self.local = local()
+        self.lock = Lock()
+        self.slow = deque(maxlen=capacity)
+        self.captured = 0
+
+    def begin(self, method, path):
+        self.local.trace = {'method': method, 'path': path, 'started': time.monotonic(), 'spans': []}
+
+    def span(self, name):
+        trace = getattr(self.local, 'trace', None)
+        return TraceSpan(trace, name) if trace is not None else NULL_SPAN
+
+    def finish(self, status, threshold_ms, server_timing=None):
+        """End the current request's trace, keeping it if it exceeded threshold_ms"""
+        trace = getattr(self.local, 'trace', None)
+        self.local.trace = None
+        if trace is None:
+            return
+        duration_ms = (time.monotonic() - trace['started']) * 1000
+        if duration_ms < threshold_ms:
+            return
+        
+        record = {
+            'method': trace['method'],
+            'path': trace['path'],
+            'status': status,
+            'durationMs': round(duration_ms, 2),
+            'at': datetime.now().isoformat(),
+            'serverTiming': server_timing,
+            'spans': [
+                {'name': name, 'offsetMs': round(offset * 1000, 3), 'durationMs': round(duration * 1000, 3)}
+                for name, offset, duration in trace['spans']
+            ]
+        }
+        with self.lock:
+            self.slow.append(record)
+            self.captured += 1
+
+    def recent(self, limit=50, path=None):
+        """Newest captured slow requests first"""
+        with self.lock:
+            records = list(self.slow)
+        records = [record for record in reversed(records) if path is None or record['path'] == path]
+        return records[:limit]
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler over all threads, producing folded stacks for flame graphs
+
+    A background thread snapshots every thread's stack each interval via
+    sys._current_frames(); request threads pay nothing beyond the GIL hand-off.
+    Stacks are aggregated as 'thread;outer;...;inner count' lines, the input
+    format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, max_seconds=300):
+        self.max_seconds = max_seconds
+        self.lock = Lock()
+        self.thread = None
+        self.stop_event = Event()
+        self.counts = defaultdict(int)
+        self.samples = 0
+        self.started_at = None
+        self.seconds = 0
+        self.interval = 0.0
+
+    def running(self):
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, seconds, interval):
+        """Start a profile, returning False if one is already running"""
+        with self.lock:
+            if self.running():
+                return False
+            self.counts = defaultdict(int)
+            self.samples = 0
+            self.started_at = datetime.now().isoformat()
+            self.seconds = min(seconds, self.max_seconds)
+            self.interval = interval
+            self.stop_event = Event()
+            self.thread = Thread(target=self.run, args=(self.stop_event,), daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self, stop_event):
+        own_id = get_ident()
+        ends = time.monotonic() + self.seconds
+        while not stop_event.wait(self.interval) and time.monotonic() < ends:
+            names = {thread.ident: thread.name for thread in enumerate_threads()}
+            frames = sys._current_frames()
+            with self.lock:
+                for thread_id, frame in frames.items():
+                    if thread_id == own_id:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    self.counts[';'.join(reversed(stack))] += 1
+                self.samples += 1
+
+    def folded(self):
+        with self.lock:
+            return ''.join(f'{stack} {count}\n' for stack, count in sorted(self.counts.items()))
+
+    def status(self):
+        with self.lock:
+            return {
+                'running': self.running(),
+                'startedAt': self.started_at,
+                'seconds': self.seconds,
+                'intervalMs': self.interval * 1000,
+                'samples': self.samples,
+                'uniqueStacks': len(self.counts)
+            }
+
+request_tracer = RequestTracer(int(os.getenv('BBCA_SLOW_TRACE_CAPACITY', '200')))
+profiler = SamplingProfiler()
+
+class ConnectionRegistry:
+    """Tracks live socket connections per user and evicts idle ones
+
+    Only connections that never joined a user room are evicted: a joined
+    client is listening for alerts and may legitimately send nothing for
+    hours, while dead transports are already dropped by Socket.IO's
+    ping timeout.
+    """
+
+    def __init__(self, idle_timeout=1800, sweep_interval=60):
+        self.idle_timeout = idle_timeout
+        self.sweep_interval = sweep_interval
+        self.lock = Lock()
+        # sid -> [user_id, last_seen], ordered from least to most recently active
+        self.sids = OrderedDict()
+        # user_id -> set of sids
+        self.users = {}
+
+    def connect(self, sid):
+        with self.lock:
+            self.sids[sid] = [None, time.monotonic()]
+
+    def join(self, sid, user_id):
+        """Bind a connection to a user, returning the user it was bound to before"""
+        with self.lock:
+            entry = self.sids.pop(sid, None) or [None, 0]
+            previous_user = entry[0]
+            if previous_user and previous_user != user_id:
+                self._unbind(sid, previous_user)
+            self.sids[sid] = [user_id, time.monotonic()]
+            self.users.setdefault(user_id, set()).add(sid)
+            return previous_user
+
+    def touch(self, sid):
+        with self.lock:
+            entry = self.sids.get(sid)
+            if entry is not None:
+                entry[1] = time.monotonic()
+                self.sids.move_to_end(sid)
+
+    def disconnect(self, sid):
+        with self.lock:
+            entry = self.sids.pop(sid, None)
+            if entry and entry[0]:
+                self._unbind(sid, entry[0])
+
+    def _unbind(self, sid, user_id):
+        sids = self.users.get(user_id)
+        if sids is not None:
+            sids.discard(sid)
+            if not sids:
+                del self.users[user_id]
+
+    def has_user(self, user_id):
+        return user_id in self.users
+
+    def user_sids(self, user_id):
+        with self.lock:
+            return set(self.users.get(user_id, ()))
+
+    def counts(self):
+        with self.lock:
+            return {'connections': len(self.sids), 'users': len(self.users)}
+
+    def evict_idle(self):
+        """Disconnect unjoined connections that have been idle longer than idle_timeout"""
+        cutoff = time.monotonic() - self.idle_timeout
+        idle = []
+        with self.lock:
+            for sid, (user_id, last_seen) in self.sids.items():
+                if last_seen >= cutoff:
+                    break
+                if user_id is None:
+                    idle.append(sid)
+
+        for sid in idle:
+            try:
+                socketio.server.disconnect(sid, namespace='/')
+            except Exception as e:
+                logger.error(f"Idle connection eviction error: {e}")
+            self.disconnect(sid)
+
+        if idle:
+            logger.info(f"Evicted {len(idle)} idle socket connections")
+        return len(idle)
+
+    def watch(self):
+        """Background loop evicting idle connections"""
+        while True:
+            time.sleep(self.sweep_interval)
+            self.evict_idle()
+
+connection_registry = ConnectionRegistry()
+
+class BehaviorSampleBatcher:
+    """Micro-batches socket behavior samples across users before scoring"""
+
+    def __init__(self, max_batch=256, max_wait=0.02, max_queue=10000):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.queue = queue.Queue(maxsize=max_queue)
+
+    def submit(self, sample):
+        """Queue a sample for scoring, returning False when the queue is full"""
+        try:
+            self.queue.put_nowait(sample)
+            return True
+        except queue.Full:
+            return False
+
+    def next_batch(self):
+        """Block for one sample, then collect whatever else arrives within max_wait"""
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        """Background loop scoring batches and pushing results back to each socket"""
+        while True:
+            try:
+                batch = self.next_batch()
+                by_user = defaultdict(list)
+                for sample in batch:
+                    by_user[(sample['tenantId'], sample['userId'])].append(sample)
+                
+                for (tenant_id, user_id), samples in by_user.items():
+                    self.score_user(tenant_id, user_id, samples)
+                
+            except Exception as e:
+                logger.error(f"Behavior sample batch error: {e}")
+
+    def score_user(self, tenant_id, user_id, samples):
+        """Score one user's samples; failures are acked per sample instead of dropping the batch"""
+        try:
+            config = config_store.get(tenant_id, user_id)
+            if not config['enabled']:
+                for sample in samples:
+                    socketio.emit('risk_assessment', dict(monitoring_disabled_response(config),
+                                                          sampleId=sample['sampleId']), to=sample['sid'])
+                return
+            assessments = tenants.engine(tenant_id).predict_anomaly_batch(
+                user_id, [sample['behaviorData'] for sample in samples], config
+            )
+        except Exception as e:
+            logger.error(f"Behavior sample scoring error for {user_id}: {e}")
+            for sample in samples:
+                self.fail(sample)
+            return
+        
+        for sample, risk_assessment in zip(samples, assessments):
+            try:
+                response = record_behavior_assessment(
+                    user_id, sample['behaviorData'], risk_assessment, config, sample['cohort'], tenant_id,
+                    sample['authSessionId']
+                )
+                response['sampleId'] = sample['sampleId']
+                socketio.emit('risk_assessment', response, to=sample['sid'])
+            except Exception as e:
+                logger.error(f"Behavior sample record error for {user_id}: {e}")
+                self.fail(sample)
+
+    def fail(self, sample):
+        socketio.emit('risk_assessment', {'sampleId': sample['sampleId'], 'error': 'Analysis failed'},
+                      to=sample['sid'])
+
+behavior_batcher = BehaviorSampleBatcher()
+
+# Request tracing
+@app.before_request
+def begin_request_trace():
+    if request.path.startswith('/api/'):
+        request_tracer.begin(request.method, request.path)
+
+@app.after_request
+def finish_request_trace(response):
+    request_tracer.finish(response.status_code, config_store.get()['slowRequestMs'],
+                          response.headers.get('Server-Timing'))
+    return response
+
+# API Routes
+@app.route('/api/bbca/analyze', methods=['POST'])
+def analyze_behavior():
+    """Analyze user behavior and detect anomalies"""
+    deadline = RequestDeadline()
+    with analyze_load:
         try:
-            model_path = os.path.join(self.models_dir, f'{user_id}_model.pkl')
-            
-            if not os.path.exists(model_path):
-                logger.info(f"No model found for user {user_id}")
-                return {
-                    'anomaly_score': 0.0,
-                    'is_anomaly': False,
-                    'confidence': 0.0,
-                    'risk_level': 'low'
-                }
-            
-            # Load model
-            model_data = joblib.load(model_path)
-            scaler = model_data['scaler']
-            isolation_forest = model_data['isolation_forest']
-            feature_means = model_data['feature_means']
-            feature_stds = model_data['feature_stds']
-            
-            # Extract and normalize features
-            features = self.extract_features(behavior_data)
-            features_scaled = scaler.transform(features)
-            
-            # Predict anomaly
-            anomaly_score = isolation_forest.decision_function(features_scaled)[0]
-            is_anomaly = isolation_forest.predict(features_scaled)[0] == -1
+            # Per-IP limits run before parsing so malformed floods are cheap to reject
+            global_config = config_store.get()
+            retry_after = admission_control.check([
+                ('ip', request.remote_addr, global_config['ipRateLimit'], global_config['ipRateBurst'])
+            ])
+            if retry_after:
+                return rate_limited_response(retry_after)
             
-            # Calculate confidence based on distance from normal behavior
-            distance = np.linalg.norm(features_scaled[0] - feature_means)
-            confidence = max(0, 1 - (distance / np.sum(feature_stds)))
+            try:
+                data = get_request_payload()
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 415
             
-            # Determine risk level
-            if anomaly_score < -0.5:
-                risk_level = 'critical'
-            elif anomaly_score < -0.2:
-                risk_level = 'high'
-            elif anomaly_score < 0:
-                risk_level = 'medium'
-            else:
-                risk_level = 'low'
+            user_id = data.get('userId')
+            cohort = data.get('cohort') or 'default'
             
-            return {
-                'anomaly_score': float(anomaly_score),
-                'is_anomaly': bool(is_anomaly),
-                'confidence': float(confidence),
-                'risk_level': risk_level
-            }
+            if not user_id:
+                return jsonify({'error': 'Missing required data'}), 400
             
-        except Exception as e:
-            logger.error(f"Anomaly prediction error: {e}")
-            return {
-                'anomaly_score': 0.0,
-                'is_anomaly': False,
-                'confidence': 0.0,
-                'risk_level': 'low'
-            }
-
-class EmailNotificationService:
-    """Email notification service for security alerts"""
-    
-    def __init__(self):
-        self.smtp_server = "smtp.gmail.com"
-        self.smtp_port = 587
-        self.email = os.getenv('SMTP_EMAIL', 'security@canarabank.com')
-        self.password = os.getenv('SMTP_PASSWORD', 'secure_password')
-    
-    def send_security_alert(self, user_email, alert_type, details):
-        """Send security alert email"""
-        try:
-            msg = MimeMultipart()
-            msg['From'] = self.email
-            msg['To'] = user_email
-            msg['Subject'] = f"Canara Bank Security Alert - {alert_type}"
+            try:
+                tenant_id = get_request_tenant(data)
+            except (ValueError, PermissionError) as e:
+                return tenant_error_response(e)
+            engine = tenants.engine(tenant_id)
             
-            body = f"""
-            Dear Customer,
+            try:
+                auth_session_id = get_auth_session_id(data)
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
             
-            We detected unusual activity on your Canara Bank account:
+            behavior_data, error = resolve_behavior_payload(user_id, data, tenant_id)
+            if error == 'resync':
+                # Delta against a snapshot we no longer hold; client must send a full payload
+                return make_payload_response({'error': 'Unknown base snapshot', 'resync': True}, 409)
+            if error:
+                return make_payload_response({'error': error}, 400)
             
-            Alert Type: {alert_type}
-            Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-            Details: {details}
+            config = config_store.get(tenant_id, user_id)
+            budget_ms = request.headers.get('X-BBCA-Deadline-Ms', type=float) or data.get('deadlineMs')
+            if isinstance(budget_ms, bool) or not isinstance(budget_ms, (int, float)) or budget_ms <= 0:
+                budget_ms = config['analyzeDeadlineMs']
+            deadline.set_budget(budget_ms)
             
-            If this was not you, please contact our security team immediately.
+            retry_after = admission_control.check([
+                ('user', (tenant_id, user_id), config['userRateLimit'], config['userRateBurst'])
+            ])
+            if retry_after:
+                return rate_limited_response(retry_after)
+            deadline.mark('parse')
             
-            Best regards,
-            Canara Bank Security Team
-            """
+            if not config['enabled']:
+                return make_payload_response(monitoring_disabled_response(config))
             
-            msg.attach(MIMEText(body, 'plain'))
+            # Retries and idle-screen duplicates reuse the previous assessment and
+            # sessionId instead of re-scoring and inserting another session row
+            cache_keys = [('payload', tenant_id, user_id, engine.model_version(user_id),
+                           config['version'], behavior_payload_hash(behavior_data))]
+            cache_ttls = [config['resultCacheTtl']]
+            idempotency_key = request.headers.get('Idempotency-Key') or data.get('idempotencyKey')
+            if idempotency_key:
+                cache_keys.append(('idempotency', tenant_id, user_id, idempotency_key))
+                cache_ttls.append(config['idempotencyKeyTtl'])
             
-            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
-            server.starttls()
-            server.login(self.email, self.password)
-            text = msg.as_string()
-            server.sendmail(self.email, user_email, text)
-            server.quit()
+            cached = assessment_cache.acquire(cache_keys, deadline.remaining())
+            deadline.mark('cache', track=False)
+            if cached is not None:
+                return timed_response(make_payload_response(dict(cached, duplicate=True)), deadline)
             
-            logger.info(f"Security alert sent to {user_email}")
+            response = None
+            degradation = []
+            try:
+                user_key = tenant_user_key(tenant_id, user_id)
+                if admission_control.should_shed(request_priority(user_key, data), config):
+                    # Overloaded: answer from the cheap fallback now instead of queueing
+                    # behind the forest; nothing is persisted or cached for these
+                    risk_assessment = engine.fallback_assessment(user_id, behavior_data, config)
+                    deadline.mark('fallback', track=False)
+                    return timed_response(make_payload_response({
+                        'sessionId': None,
+                        'riskAssessment': risk_assessment,
+                        'recommendations': generate_recommendations(risk_assessment),
+                        'requiresReAuth': False,
+                        'blockedActions': get_blocked_actions(risk_assessment['risk_level']),
+                        'nextInterval': interval_planner.next_interval(user_key, risk_assessment, config),
+                        'degraded': True,
+                        'degradation': ['shed']
+                    }), deadline)
+                
+                # Only go to disk for the model if loading and scoring should fit the budget
+                if engine.cached_model(user_id) is None and (deadline.fits('load', 'score') or
+                                                             stage_latency.probe('load')):
+                    engine.load_model(user_id)
+                    deadline.mark('load')
+                
+                if engine.cached_model(user_id) is not None and deadline.fits('score'):
+                    # Predict anomaly using ML model
+                    risk_assessment = engine.predict_anomaly(user_id, behavior_data, config)
+                    deadline.mark('score')
+                else:
+                    risk_assessment = engine.fallback_assessment(user_id, behavior_data, config)
+                    deadline.mark('fallback', track=False)
+                    if risk_assessment['scored_by'] != 'neutral' or engine.has_model(user_id):
+                        degradation.append('fallback_score')
+                
+                session_id = str(uuid.uuid4())
+                if 'fallback_score' in degradation:
+                    # A provisional score must not reach training data or alerting as is:
+                    # the session is scored by the full model and stored in the background
+                    if deferred_writes.submit(rescore_behavior_assessment, user_id, behavior_data,
+                                              config, cohort, tenant_id, session_id):
+                        degradation.append('deferred_scoring')
+                    else:
+                        session_id = None
+                elif not deadline.fits('persist') and deferred_writes.submit(
+                        persist_behavior_assessment, user_id, behavior_data, risk_assessment,
+                        config, cohort, tenant_id, session_id):
+                    # Out of budget: the session row, events and alerts are written in the background
+                    degradation.append('deferred_persistence')
+                else:
+                    session_id = persist_behavior_assessment(user_id, behavior_data, risk_assessment,
+                                                             config, cohort, tenant_id, session_id)
+                    deadline.mark('persist')
+                
+                response = build_assessment_response(tenant_id, user_id, session_id, risk_assessment, config,
+                                                     auth_session_id)
+                if degradation:
+                    response.update({'degraded': True, 'degradation': degradation})
+            finally:
+                # Degraded scores are not reused for retries
+                cacheable = response and response['sessionId'] and 'fallback_score' not in degradation
+                assessment_cache.release(cache_keys, response if cacheable else None, cache_ttls)
+            return timed_response(make_payload_response(response), deadline)
             
         except Exception as e:
-            logger.error(f"Email sending error: {e}")
-
-# Initialize services
-bbca_engine = BBCAEngine()
-email_service = EmailNotificationService()
-
-# Database helper functions
-def save_behavior_session(user_id, behavior_data, risk_assessment):
-    """Save behavior session to database"""
-    try:
-        conn = sqlite3.connect('bbca_data.db')
-        cursor = conn.cursor()
-        
-        session_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO behavior_sessions 
-            (session_id, user_id, behavior_data, risk_score, anomaly_detected, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            session_id,
-            user_id,
-            json.dumps(behavior_data),
-            risk_assessment.get('anomaly_score', 0),
-            risk_assessment.get('is_anomaly', False),
-            datetime.now()
-        ))
-        
-        conn.commit()
-        conn.close()
-        return session_id
-        
-    except Exception as e:
-        logger.error(f"Database save error: {e}")
-        return None
-
-def get_user_behavior_sessions(user_id, limit=50):
-    """Get user's behavior sessions from database"""
-    try:
-        conn = sqlite3.connect('bbca_data.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT behavior_data FROM behavior_sessions 
-            WHERE user_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT ?
-        ''', (user_id, limit))
-        
-        sessions = []
-        for row in cursor.fetchall():
-            sessions.append(json.loads(row[0]))
-        
-        conn.close()
-        return sessions
-        
-    except Exception as e:
-        logger.error(f"Database fetch error: {e}")
-        return []
-
-def log_security_event(user_id, event_type, severity, description):
-    """Log security event to database"""
-    try:
-        conn = sqlite3.connect('bbca_data.db')
-        cursor = conn.cursor()
-        
-        event_id = str(uuid.uuid4())
-        cursor.execute('''
-            INSERT INTO security_events 
-            (event_id, user_id, event_type, severity, description, timestamp)
-            VALUES (?, ?, ?, ?, ?, ?)
-        ''', (
-            event_id,
-            user_id,
-            event_type,
-            severity,
-            description,
-            datetime.now()
-        ))
-        
-        conn.commit()
-        conn.close()
-        
-    except Exception as e:
-        logger.error(f"Security event logging error: {e}")
-
-# API Routes
-@app.route('/api/bbca/analyze', methods=['POST'])
-def analyze_behavior():
-    """Analyze user behavior and detect anomalies"""
-    try:
-        data = request.get_json()
-        user_id = data.get('userId')
-        behavior_data = data.get('behaviorData')
-        
-        if not user_id or not behavior_data:
-            return jsonify({'error': 'Missing required data'}), 400
-        
-        # Predict anomaly using ML model
-        risk_assessment = bbca_engine.predict_anomaly(user_id, behavior_data)
-        
-        # Save session to database
-        session_id = save_behavior_session(user_id, behavior_data, risk_assessment)
-        
-        # Log security event if anomaly detected
-        if risk_assessment['is_anomaly']:
-            log_security_event(
-                user_id,
-                'behavior_anomaly',
-                risk_assessment['risk_level'],
-                f"Anomaly score: {risk_assessment['anomaly_score']:.3f}"
-            )
-            
-            # Send real-time alert via WebSocket
-            socketio.emit('security_alert', {
-                'userId': user_id,
-                'alertType': 'behavior_anomaly',
-                'riskLevel': risk_assessment['risk_level'],
-                'timestamp': datetime.now().isoformat()
-            }, room=user_id)
-        
-        # Enhanced response with recommendations
-        response = {
-            'sessionId': session_id,
-            'riskAssessment': risk_assessment,
-            'recommendations': generate_recommendations(risk_assessment),
-            'requiresReAuth': risk_assessment['risk_level'] in ['high', 'critical'],
-            'blockedActions': get_blocked_actions(risk_assessment['risk_level'])
-        }
-        
-        return jsonify(response)
-        
-    except Exception as e:
-        logger.error(f"Behavior analysis error: {e}")
-        return jsonify({'error': 'Analysis failed'}), 500
+            logger.error(f"Behavior analysis error: {e}")
+            return jsonify({'error': 'Analysis failed'}), 500
 
 @app.route('/api/bbca/train', methods=['POST'])
 def train_user_model():
@@ -473,25 +4378,40 @@ def train_user_model():
         if not user_id:
             return jsonify({'error': 'Missing user ID'}), 400
         
-        # Get user's behavior sessions
-        sessions = get_user_behavior_sessions(user_id)
+        try:
+            tenant_id = get_request_tenant(data)
+        except (ValueError, PermissionError) as e:
+            return tenant_error_response(e)
         
-        if len(sessions) < 5:
-            return jsonify({
-                'message': 'Insufficient data for training',
-                'sessionsCount': len(sessions),
-                'requiredSessions': 5
-            })
+        # Per-IP limits come from the global config so user overrides cannot relax them
+        config = config_store.get(tenant_id, user_id)
+        global_config = config_store.get()
+        retry_after = admission_control.check([
+            ('train_ip', request.remote_addr, global_config['ipRateLimit'], global_config['ipRateBurst']),
+            ('train_user', (tenant_id, user_id), config['trainRateLimit'], config['trainRateBurst'])
+        ])
+        if retry_after:
+            return rate_limited_response(retry_after)
         
-        # Train model
-        model_path = bbca_engine.train_user_model(user_id, sessions)
+        # Training is CPU heavy; reject rather than queue past the global cap
+        if not admission_control.try_start_training(global_config):
+            response = jsonify({'error': 'Training capacity exhausted, retry later'})
+            response.headers['Retry-After'] = '5'
+            return response, 503
         
-        if model_path:
-            return jsonify({
-                'message': 'Model trained successfully',
-                'modelPath': model_path,
-                'sessionsUsed': len(sessions)
-            })
+        try:
+            # Train model, warm-starting from the previous version when possible
+            status, details = retrain_user(user_id, config, warm_start=data.get('warmStart', True),
+                                           tenant_id=tenant_id)
+        finally:
+            admission_control.finish_training()
+        
+        if status == 'insufficient_data':
+            return jsonify(dict(details, message='Insufficient data for training'))
+        elif status == 'up_to_date':
+            return jsonify(dict(details, message='Model is up to date'))
+        elif status == 'trained':
+            return jsonify(dict(details, message='Model trained successfully'))
         else:
             return jsonify({'error': 'Model training failed'}), 500
             
@@ -503,19 +4423,13 @@ def train_user_model():
 def get_security_events(user_id):
     """Get security events for user"""
     try:
-        conn = sqlite3.connect('bbca_data.db')
-        cursor = conn.cursor()
-        
-        cursor.execute('''
-            SELECT event_type, severity, description, timestamp 
-            FROM security_events 
-            WHERE user_id = ? 
-            ORDER BY timestamp DESC 
-            LIMIT 20
-        ''', (user_id,))
+        try:
+            tenant_id = get_request_tenant()
+        except (ValueError, PermissionError) as e:
+            return tenant_error_response(e)
         
         events = []
-        for row in cursor.fetchall():
+        for row in tenants.storage(tenant_id).user_security_events(user_id, 20):
             events.append({
                 'eventType': row[0],
                 'severity': row[1],
@@ -523,41 +4437,316 @@ def get_security_events(user_id):
                 'timestamp': row[3]
             })
         
-        conn.close()
         return jsonify({'events': events})
         
     except Exception as e:
         logger.error(f"Security events fetch error: {e}")
         return jsonify({'error': 'Failed to fetch events'}), 500
 
+def feed_request_args():
+    """Cursor and batch size shared by the feed endpoints; cursor=latest starts at the tail"""
+    cursor = request.args.get('cursor') or request.headers.get('Last-Event-ID') or '0'
+    limit = min(max(request.args.get('limit', 500, type=int), 1), 5000)
+    return cursor, limit
+
+@app.route('/api/bbca/security-feed', methods=['GET'])
+def get_security_feed():
+    """Long-poll the tenant's security event feed for the batch after a cursor"""
+    try:
+        try:
+            tenant_id = get_request_tenant()
+        except (ValueError, PermissionError) as e:
+            return tenant_error_response(e)
+        
+        cursor, limit = feed_request_args()
+        cursor = security_feed.head(tenant_id) if cursor == 'latest' else int(cursor)
+        wait = min(max(request.args.get('wait', 0, type=float), 0.0), 30.0)
+        
+        events = security_feed.poll(tenant_id, cursor, limit, wait)
+        return jsonify({
+            'events': events,
+            'cursor': events[-1]['seq'] if events else cursor,
+            'hasMore': len(events) == limit
+        })
+        
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor'}), 400
+    except Exception as e:
+        logger.error(f"Security feed fetch error: {e}")
+        return jsonify({'error': 'Failed to fetch security feed'}), 500
+
+@app.route('/api/bbca/security-feed/stream', methods=['GET'])
+def stream_security_feed():
+    """Tail the tenant's security event feed as Server-Sent Events; reconnects resume via Last-Event-ID"""
+    try:
+        tenant_id = get_request_tenant()
+        cursor, limit = feed_request_args()
+        cursor = security_feed.head(tenant_id) if cursor == 'latest' else int(cursor)
+    except PermissionError as e:
+        return tenant_error_response(e)
+    except ValueError:
+        return jsonify({'error': 'Invalid tenant or cursor'}), 400
+    
+    if not security_feed.open_stream():
+        response = jsonify({'error': 'Too many feed streams, use long-polling or retry later'})
+        response.headers['Retry-After'] = '30'
+        return response, 503
+    
+    response = Response(stream_with_context(security_feed.stream(tenant_id, cursor, limit)),
+                        mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    # Release the slot however the stream ends, including a client that never reads
+    response.call_on_close(security_feed.close_stream)
+    return response
+
+@app.route('/api/bbca/similar-users/<user_id>', methods=['GET'])
+def get_similar_users(user_id):
+    """Other users whose recent behavior was near-identical to this user's latest sample"""
+    try:
+        try:
+            tenant_id = get_request_tenant()
+        except (ValueError, PermissionError) as e:
+            return tenant_error_response(e)
+        
+        config = config_store.get(tenant_id, user_id)
+        minutes = request.args.get('minutes', type=int)
+        matches = similarity_index.similar_users(tenant_id, user_id, config, minutes * 60 if minutes else None)
+        
+        users = [
+            {
+                'userId': other_user,
+                'distance': distance,
+                'lastSeen': datetime.fromtimestamp(seen_at).isoformat()
+            }
+            for other_user, (distance, seen_at) in sorted(matches.items(), key=lambda item: item[1][0])
+        ]
+        return jsonify({'userId': user_id, 'radius': config['similarityRadius'], 'users': users})
+        
+    except Exception as e:
+        logger.error(f"Similar users fetch error: {e}")
+        return jsonify({'error': 'Failed to fetch similar users'}), 500
+
+@app.route('/api/bbca/stats', methods=['GET'])
+def get_risk_stats():
+    """Get time-bucketed anomaly rates per risk level and cohort"""
+    try:
+        try:
+            tenant_id = get_request_tenant()
+        except (ValueError, PermissionError) as e:
+            return tenant_error_response(e)
+        
+        hours = min(max(request.args.get('hours', 24, type=int), 1), 24 * 31)
+        cohort = request.args.get('cohort')
+        risk_level = request.args.get('riskLevel')
+        
+        buckets = risk_rollups.query(hours, cohort, risk_level, tenant_id)
+        
+        totals = {}
+        for bucket in buckets:
+            total = totals.setdefault(bucket['riskLevel'], {'sessions': 0, 'anomalies': 0, 'events': 0})
+            total['sessions'] += bucket['sessions']
+            total['anomalies'] += bucket['anomalies']
+            total['events'] += bucket['events']
+        for total in totals.values():
+            total['anomalyRate'] = total['anomalies'] / total['sessions'] if total['sessions'] else 0.0
+        
+        return jsonify({
+            'bucketSeconds': risk_rollups.bucket_seconds,
+            'hours': hours,
+            'buckets': buckets,
+            'totals': totals,
+            'connections': connection_registry.counts(),
+            'admission': admission_control.stats(),
+            'stageLatencyMs': stage_latency.stats(),
+            'deferredWrites': deferred_writes.stats(),
+            'similarityIndex': similarity_index.stats(),
+            'securityFeed': security_feed.stats(),
+            'persistence': session_sampler.stats(),
+            'modelArchive': tenants.engine(tenant_id).archive.stats(),
+            'sessionRisk': session_risk_tracker.stats()
+        })
+        
+    except Exception as e:
+        logger.error(f"Risk stats fetch error: {e}")
+        return jsonify({'error': 'Failed to fetch stats'}), 500
+
+@app.route('/api/bbca/health', methods=['GET'])
+def health_check():
+    """Readiness probe; reports 503 until startup model warm-up has finished"""
+    ready = startup_state['status'] == 'ready'
+    return jsonify({
+        'status': startup_state['status'],
+        'ready': ready,
+        'preloadedModels': startup_state['preloadedModels'],
+        'warmupSeconds': startup_state['warmupSeconds'],
+        'modelCache': tenants.model_cache.stats(),
+        'modelTiers': tenants.model_tiers.stats(),
+        'tenants': len(tenants.storages),
+        'inFlight': analyze_load.active
+    }), 200 if ready else 503
+
 @app.route('/api/bbca/config', methods=['GET', 'POST'])
 def bbca_config():
     """Get or update BBCA configuration"""
     if request.method == 'GET':
-        return jsonify({
-            'enabled': True,
-            'sensitivity': 'medium',
-            'monitoringInterval': 5000,
-            'anomalyThreshold': 0.7,
-            'reAuthThreshold': 0.8,
-            'privacyMode': True,
-            'gdprCompliant': True
-        })
+        try:
+            tenant_id = get_request_tenant()
+        except (ValueError, PermissionError) as e:
+            return tenant_error_response(e)
+        return jsonify(config_store.get(tenant_id, request.args.get('userId')))
     
     elif request.method == 'POST':
-        config = request.get_json()
-        # Save configuration (implement as needed)
-        return jsonify({'message': 'Configuration updated'})
+        try:
+            config = dict(request.get_json() or {})
+            # Admins may name any provisioned tenant; everyone else needs its API key
+            admin_error = admin_error_response()
+            tenant_id = get_request_tenant(config, admin=admin_error is None)
+            user_id = config.pop('userId', None)
+            config.pop('tenantId', None)
+            scope = config.pop('scope', None) or ('user' if user_id else 'tenant' if tenant_id else 'global')
+            overrides = config.pop('config', config)
+            
+            if scope not in ConfigStore.SCOPES:
+                return jsonify({'error': f"scope must be one of {list(ConfigStore.SCOPES)}"}), 400
+            if scope == 'user' and not user_id:
+                return jsonify({'error': 'Missing user ID'}), 400
+            if scope == 'tenant' and not tenant_id:
+                return jsonify({'error': 'Missing tenant ID'}), 400
+            # Global and per-user overrides (a client could relax its own thresholds)
+            # are admin only; a tenant's key may change that tenant's configuration
+            if scope in ('global', 'user') and admin_error:
+                return admin_error
+            if scope == 'tenant' and admin_error and not request.headers.get('X-API-Key'):
+                return jsonify({'error': 'Tenant API key required'}), 401
+            
+            version = config_store.update(scope, overrides, tenant_id, user_id)
+            return jsonify({
+                'message': 'Configuration updated',
+                'version': version,
+                'config': config_store.get(tenant_id, user_id)
+            })
+            
+        except PermissionError as e:
+            return tenant_error_response(e)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except Exception as e:
+            logger.error(f"Configuration update error: {e}")
+            return jsonify({'error': 'Configuration update failed'}), 500
+
+@app.route('/api/bbca/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """Start (POST), stop (DELETE) or inspect (GET) the sampling profiler"""
+    error = admin_error_response()
+    if error:
+        return error
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        seconds = data.get('seconds', 30)
+        interval_ms = data.get('intervalMs', 10)
+        for value in (seconds, interval_ms):
+            if isinstance(value, bool) or not isinstance(value, (int, float)) or value <= 0:
+                return jsonify({'error': 'seconds and intervalMs must be positive numbers'}), 400
+        if not profiler.start(seconds, max(interval_ms, 1) / 1000.0):
+            return jsonify({'error': 'A profile is already running', 'profile': profiler.status()}), 409
+        return jsonify(profiler.status()), 202
+    
+    if request.method == 'DELETE':
+        profiler.stop()
+    return jsonify(profiler.status())
+
+@app.route('/api/bbca/admin/profile/stacks', methods=['GET'])
+def admin_profile_stacks():
+    """Folded stacks of the current or last profile, ready for flamegraph.pl or speedscope"""
+    error = admin_error_response()
+    if error:
+        return error
+    
+    response = make_response(profiler.folded())
+    response.mimetype = 'text/plain'
+    response.headers['Content-Disposition'] = 'attachment; filename=bbca-profile.folded'
+    return response
+
+@app.route('/api/bbca/admin/slow-requests', methods=['GET'])
+def admin_slow_requests():
+    """Per-stage traces of recent requests slower than slowRequestMs, newest first"""
+    error = admin_error_response()
+    if error:
+        return error
+    
+    limit = min(max(request.args.get('limit', 50, type=int), 1), request_tracer.slow.maxlen)
+    return jsonify({
+        'thresholdMs': config_store.get()['slowRequestMs'],
+        'captured': request_tracer.captured,
+        'requests': request_tracer.recent(limit, request.args.get('path'))
+    })
+
+@app.route('/api/bbca/admin/data-jobs', methods=['GET', 'POST'])
+def admin_data_jobs():
+    """Queue a purge or export job for a batch of users (POST) or list recent jobs (GET)"""
+    error = admin_error_response()
+    if error:
+        return error
+    
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            tenant_id = get_request_tenant(data, admin=True)
+        except (ValueError, PermissionError) as e:
+            return tenant_error_response(e)
+        try:
+            job = user_data_jobs.submit(data.get('action'), data.get('userIds'), tenant_id)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        return jsonify(job), 202
+    
+    limit = min(max(request.args.get('limit', 50, type=int), 1), user_data_jobs.max_jobs)
+    return jsonify({'jobs': user_data_jobs.recent(limit)})
+
+@app.route('/api/bbca/admin/data-jobs/<job_id>', methods=['GET', 'DELETE'])
+def admin_data_job(job_id):
+    """Job progress (GET), or forget a finished job and its export file (DELETE)"""
+    error = admin_error_response()
+    if error:
+        return error
+    
+    job = user_data_jobs.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    if request.method == 'DELETE':
+        if not user_data_jobs.remove(job_id):
+            return jsonify({'error': 'Job is still running'}), 409
+        return jsonify({'message': 'Job removed'})
+    return jsonify(job)
+
+@app.route('/api/bbca/admin/data-jobs/<job_id>/export', methods=['GET'])
+def admin_data_job_export(job_id):
+    """Download a finished export as JSON Lines, one stored row per line"""
+    error = admin_error_response()
+    if error:
+        return error
+    
+    job = user_data_jobs.get(job_id)
+    if job is None or job['action'] != 'export':
+        return jsonify({'error': 'Unknown export job'}), 404
+    if job['status'] != 'done':
+        return jsonify({'error': f"Export is {job['status']}"}), 409
+    return send_file(os.path.abspath(user_data_jobs.export_path(job)), mimetype='application/x-ndjson',
+                     as_attachment=True, download_name=f'bbca-export-{job_id}.jsonl')
 
 # WebSocket events
 @socketio.on('connect')
 def handle_connect():
     """Handle client connection"""
+    connection_registry.connect(request.sid)
     logger.info(f"Client connected: {request.sid}")
 
 @socketio.on('disconnect')
 def handle_disconnect():
     """Handle client disconnection"""
+    connection_registry.disconnect(request.sid)
     logger.info(f"Client disconnected: {request.sid}")
 
 @socketio.on('join_user_room')
@@ -565,10 +4754,207 @@ def handle_join_room(data):
     """Join user-specific room for real-time alerts"""
     user_id = data.get('userId')
     if user_id:
-        socketio.join_room(user_id)
+        try:
+            tenant_id = get_request_tenant(data)
+        except (ValueError, PermissionError) as e:
+            emit('error', {'error': str(e)})
+            return
+        
+        # Rooms are tenant-qualified so equal user IDs in different tenants stay apart
+        user_key = tenant_user_key(tenant_id, user_id)
+        previous_user = connection_registry.join(request.sid, user_key)
+        if previous_user and previous_user != user_key:
+            leave_room(previous_user)
+        join_room(user_key)
         logger.info(f"User {user_id} joined room")
 
+@socketio.on('behavior_sample')
+def handle_behavior_sample(data):
+    """Score a behavior sample streamed over the socket connection"""
+    data = data or {}
+    if not isinstance(data, dict):
+        emit('risk_assessment', {'sampleId': None, 'error': 'Invalid behavior sample'})
+        return
+    user_id = data.get('userId')
+    sample_id = data.get('sampleId')
+    
+    if not user_id:
+        emit('risk_assessment', {'sampleId': sample_id, 'error': 'Missing required data'})
+        return
+    
+    try:
+        tenant_id = get_request_tenant(data)
+        auth_session_id = get_auth_session_id(data)
+    except (ValueError, PermissionError) as e:
+        emit('risk_assessment', {'sampleId': sample_id, 'error': str(e)})
+        return
+    
+    try:
+        behavior_data, error = resolve_behavior_payload(user_id, data, tenant_id)
+    except (ValueError, TypeError) as e:
+        logger.error(f"Behavior sample payload error: {e}")
+        emit('risk_assessment', {'sampleId': sample_id, 'error': 'Invalid behavior sample'})
+        return
+    if error == 'resync':
+        emit('risk_assessment', {'sampleId': sample_id, 'error': 'Unknown base snapshot', 'resync': True})
+        return
+    if error:
+        emit('risk_assessment', {'sampleId': sample_id, 'error': error})
+        return
+    
+    connection_registry.touch(request.sid)
+    accepted = behavior_batcher.submit({
+        'sid': request.sid,
+        'userId': user_id,
+        'tenantId': tenant_id,
+        'cohort': data.get('cohort') or 'default',
+        'sampleId': sample_id,
+        'authSessionId': auth_session_id,
+        'behaviorData': behavior_data
+    })
+    if not accepted:
+        emit('risk_assessment', {'sampleId': sample_id, 'error': 'Server busy', 'retryAfter': 1000})
+
 # Helper functions
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+def is_msgpack_request():
+    """Check whether the request body is MessagePack encoded"""
+    return request.mimetype in MSGPACK_CONTENT_TYPES
+
+def get_request_payload():
+    """Decode a JSON or MessagePack request body"""
+    if is_msgpack_request():
+        if msgpack is None:
+            raise ValueError('MessagePack encoding is not available on this server')
+        return msgpack.unpackb(request.get_data(), raw=False)
+    return request.get_json()
+
+def make_payload_response(payload, status=200):
+    """Encode a response the same way the request was encoded"""
+    if is_msgpack_request() and msgpack is not None:
+        return app.response_class(msgpack.packb(payload, use_bin_type=True),
+                                  status=status, mimetype='application/msgpack')
+    return jsonify(payload), status
+
+def resolve_behavior_payload(user_id, data, tenant_id=None):
+    """Resolve full, summary or delta behavior payloads into behavior data
+
+    Returns a tuple of (behavior_data, error message). Compact payloads resolve
+    to {'featureSummary': {...}} which extract_features consumes directly.
+    """
+    if data.get('behaviorData'):
+        if not isinstance(data['behaviorData'], dict):
+            return None, 'behaviorData must be an object'
+        return data['behaviorData'], None
+
+    summary = data.get('behaviorSummary')
+    if summary is not None:
+        if isinstance(summary, list):
+            if len(summary) != len(FEATURE_NAMES):
+                return None, f'behaviorSummary must have {len(FEATURE_NAMES)} values'
+            summary = dict(zip(FEATURE_NAMES, summary))
+        summary, error = parse_feature_values(summary, 'behaviorSummary')
+        if error:
+            return None, error
+        return {'featureSummary': {name: summary.get(name, 0.0) for name in FEATURE_NAMES}}, None
+
+    delta = data.get('behaviorDelta')
+    if delta is not None:
+        delta, error = parse_feature_values(delta, 'behaviorDelta')
+        if error:
+            return None, error
+        snapshot = behavior_snapshots.get(tenant_user_key(tenant_id, user_id))
+        if snapshot is None or snapshot[0] != data.get('baseSessionId'):
+            return None, 'resync'
+        summary = dict(snapshot[1])
+        summary.update(delta)
+        return {'featureSummary': summary}, None
+
+    return None, 'Missing required data'
+
+def parse_feature_values(values, field):
+    """Validate a feature name -> number mapping, returning (floats, error message)"""
+    if not isinstance(values, dict):
+        return None, f'{field} must map feature names to numbers'
+    unknown = set(values) - set(FEATURE_NAMES)
+    if unknown:
+        return None, f'Unknown summary features: {sorted(unknown)}'
+    parsed = {}
+    for name, value in values.items():
+        if not is_finite_number(value):
+            return None, f'{field}.{name} must be a finite number'
+        parsed[name] = float(value)
+    return parsed, None
+
+def behavior_payload_hash(behavior_data):
+    """Canonical hash of a behavior payload, independent of key order"""
+    canonical = json.dumps(behavior_data, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+def get_request_tenant(data=None, admin=False):
+    """Resolve the tenant of the current request from its API key, header or body
+
+    Once API keys are configured, naming a tenant without its key is refused
+    (admin requests excepted). Raises PermissionError for unknown API keys,
+    missing keys and unprovisioned tenants, ValueError for malformed tenant IDs.
+    """
+    api_key = request.headers.get('X-API-Key')
+    if api_key:
+        # A key pins its tenant; header and body tenant IDs are ignored
+        return tenants.tenant_for_key(api_key)
+    
+    tenant_id = request.headers.get('X-BBCA-Tenant')
+    if not tenant_id and data:
+        tenant_id = data.get('tenantId')
+    tenant_id = tenants.validate(tenant_id or None)
+    if tenant_id is None:
+        return None
+    if tenants.api_keys and not admin:
+        raise PermissionError('API key required')
+    if not tenants.is_provisioned(tenant_id):
+        raise PermissionError('Unknown tenant')
+    return tenant_id
+
+def get_auth_session_id(data):
+    """Client login session a sample belongs to, from header or body; None scores per user"""
+    auth_session_id = request.headers.get('X-BBCA-Session-Id') or data.get('authSessionId')
+    if auth_session_id is not None and (not isinstance(auth_session_id, str) or len(auth_session_id) > 128):
+        raise ValueError('Invalid authSessionId')
+    return auth_session_id
+
+def tenant_error_response(error):
+    """Unknown API keys are 401, malformed tenant IDs 400"""
+    return jsonify({'error': str(error)}), 401 if isinstance(error, PermissionError) else 400
+
+def request_priority(user_key, data):
+    """Shedding priority: users recently scored high risk are never shed, clients may opt into low"""
+    history = interval_planner.history.get(user_key) or ()
+    if any(level in ('high', 'critical') for level, _ in history):
+        return 'high'
+    priority = request.headers.get('X-BBCA-Priority') or data.get('priority')
+    return 'low' if priority == 'low' else 'normal'
+
+def timed_response(result, deadline):
+    """Attach per-stage timings of a deadline-bound request as a Server-Timing header"""
+    response = make_response(result)
+    response.headers['Server-Timing'] = deadline.server_timing()
+    return response
+
+def admin_error_response():
+    """None if the request carries the admin token, otherwise the error response"""
+    admin_token = os.getenv('BBCA_ADMIN_TOKEN')
+    if not admin_token:
+        return jsonify({'error': 'Admin endpoints are disabled'}), 404
+    if not hmac.compare_digest(request.headers.get('X-BBCA-Admin-Token', ''), admin_token):
+        return jsonify({'error': 'Admin token required'}), 403
+    return None
+
+def rate_limited_response(retry_after):
+    response = jsonify({'error': 'Rate limit exceeded', 'retryAfter': round(retry_after, 3)})
+    response.headers['Retry-After'] = str(max(1, int(retry_after + 0.999)))
+    return response, 429
+
 def generate_recommendations(risk_assessment):
     """Generate security recommendations based on risk assessment"""
     recommendations = []
@@ -614,16 +5000,121 @@ def continuous_monitoring():
             # Implement continuous monitoring logic
             # Check for suspicious patterns, update models, etc.
             time.sleep(60)  # Run every minute
+            risk_rollups.flush()
+            session_sampler.flush()
         except Exception as e:
             logger.error(f"Continuous monitoring error: {e}")
 
+def archive_idle_models():
+    """Move models of users idle longer than modelArchiveIdleSeconds into the cold archive"""
+    archived = 0
+    for tenant_id in tenants.known():
+        try:
+            idle_before = time.time() - config_store.get(tenant_id)['modelArchiveIdleSeconds']
+            cutoff = str(datetime.fromtimestamp(idle_before))
+            
+            # Users come most recent first, so stop at the first idle one
+            active_users = set()
+            recent = tenants.storage(tenant_id).users_by_recency()
+            try:
+                for last_seen, user_id in recent:
+                    if str(last_seen) < cutoff:
+                        break
+                    active_users.add(user_id)
+            finally:
+                recent.close()
+            
+            archived += tenants.engine(tenant_id).archive_models(active_users, idle_before)
+        except Exception as e:
+            logger.error(f"Model archiving error for tenant {tenant_id}: {e}")
+    if archived:
+        logger.info(f"Archived {archived} idle models")
+    return archived
+
+def archive_models_periodically(interval=3600):
+    """Background task moving idle users' models to the cold tier"""
+    while True:
+        time.sleep(interval)
+        archive_idle_models()
+
+def warm_up_models():
+    """Preload the most recently active users' models (across tenants) before reporting ready"""
+    started = time.monotonic()
+    startup_state['status'] = 'warming'
+    try:
+        budget = int(os.getenv('BBCA_PRELOAD_MB', '256')) * 1024 * 1024
+        budget = min(budget, tenants.model_cache.max_bytes)
+        workers = max(int(os.getenv('BBCA_PRELOAD_WORKERS', '4')), 1)
+        
+        def recent_users(tenant_id):
+            for last_seen, user_id in tenants.storage(tenant_id).users_by_recency():
+                yield last_seen, tenant_id, user_id
+        
+        # Pick models in recency order until the byte budget is spent
+        selected = []
+        planned = 0
+        streams = [recent_users(tenant_id) for tenant_id in tenants.known()]
+        for _, tenant_id, user_id in heapq.merge(*streams, key=lambda row: str(row[0]), reverse=True):
+            try:
+                size = os.path.getsize(tenants.engine(tenant_id).model_path(user_id))
+            except OSError:
+                continue
+            if planned + size > budget:
+                break
+            selected.append((tenant_id, user_id))
+            planned += size
+        for stream in streams:
+            stream.close()
+        
+        # Load least recent first so the most active users end up freshest in the LRU
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            loaded = list(pool.map(lambda item: tenants.engine(item[0]).load_model(item[1]), reversed(selected)))
+        
+        startup_state['preloadedModels'] = sum(1 for model_data in loaded if model_data is not None)
+        logger.info(f"Preloaded {startup_state['preloadedModels']} models ({planned // 1024} KiB)")
+    except Exception as e:
+        logger.error(f"Model warm-up error: {e}")
+    finally:
+        startup_state['warmupSeconds'] = round(time.monotonic() - started, 3)
+        startup_state['status'] = 'ready'
+
 # Initialize database and start background tasks
 if __name__ == '__main__':
-    init_db()
+    tenants.storage()
+    config_store.reload()
+    
+    # Preload active users' models; /api/bbca/health reports ready once done
+    warmup_thread = Thread(target=warm_up_models, daemon=True)
+    warmup_thread.start()
     
     # Start background monitoring thread
     monitoring_thread = Thread(target=continuous_monitoring, daemon=True)
     monitoring_thread.start()
     
+    # Start configuration hot reload thread
+    config_thread = Thread(target=config_store.watch, daemon=True)
+    config_thread.start()
+    
+    # Start socket behavior sample scoring thread
+    batcher_thread = Thread(target=behavior_batcher.run, daemon=True)
+    batcher_thread.start()
+    
+    # Start writer for persistence deferred by analyze deadlines
+    deferred_thread = Thread(target=deferred_writes.run, daemon=True)
+    deferred_thread.start()
+    
+    # Start user data purge/export job runner
+    data_jobs_thread = Thread(target=user_data_jobs.run, daemon=True)
+    data_jobs_thread.start()
+    
+    # Start idle model archiving thread
+    archive_thread = Thread(target=archive_models_periodically,
+                            args=(int(os.getenv('BBCA_MODEL_ARCHIVE_INTERVAL', '3600')),), daemon=True)
+    archive_thread.start()
+    
+    # Start idle socket connection eviction thread
+    eviction_thread = Thread(target=connection_registry.watch, daemon=True)
+    eviction_thread.start()
+    
     logger.info("BBCA Flask Backend started")
     socketio.run(app, host='0.0.0.0', port=5050, debug=False)
\ No newline at end of file
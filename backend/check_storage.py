@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+"""
+BBCA Storage Check - exercise a StorageBackend end to end
+Runs every StorageBackend method against a scratch tenant and reports the
+checks that fail, so a backend change can be verified without a full
+deployment. For PostgreSQL the check starts a throwaway local cluster with
+initdb/pg_ctl (found on PATH or under --pg-bin) unless --dsn names a server;
+the cluster and its data directory are removed afterwards. Requires
+psycopg2-binary for the postgres backend.
+
+Run from the backend directory:
+    python check_storage.py postgres
+    python check_storage.py postgres --dsn postgresql://bbca@localhost/bbca_check
+    python check_storage.py sqlite
+"""
+
+import argparse
+import contextlib
+import json
+import logging
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import uuid
+from datetime import datetime
+
+logger = logging.getLogger('bbca.check_storage')
+
+CHECK_TENANT = 'storage_check'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@contextlib.contextmanager
+def local_postgres(pg_bin=None):
+    """Start a throwaway PostgreSQL cluster and yield its DSN"""
+    def tool(name):
+        path = os.path.join(pg_bin, name) if pg_bin else shutil.which(name)
+        if not path or not os.path.exists(path):
+            raise RuntimeError(f'{name} not found; install PostgreSQL or pass --pg-bin or --dsn')
+        return path
+
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        raise RuntimeError('initdb refuses to run as root; run as another user or pass --dsn')
+    data_dir = tempfile.mkdtemp(prefix='bbca_pg_')
+    port = free_port()
+    try:
+        subprocess.run([tool('initdb'), '-D', data_dir, '-U', 'bbca', '--auth=trust'],
+                       check=True, stdout=subprocess.DEVNULL)
+        subprocess.run([tool('pg_ctl'), '-D', data_dir, '-w', '-l', os.path.join(data_dir, 'server.log'),
+                        '-o', f"-p {port} -k {data_dir} -c listen_addresses=127.0.0.1", 'start'],
+                       check=True, stdout=subprocess.DEVNULL)
+        try:
+            yield f'postgresql://bbca@127.0.0.1:{port}/postgres'
+        finally:
+            subprocess.run([tool('pg_ctl'), '-D', data_dir, '-w', '-m', 'fast', 'stop'],
+                           stdout=subprocess.DEVNULL)
+    finally:
+        shutil.rmtree(data_dir, ignore_errors=True)
+
+def ts(hour, minute=0):
+    return datetime(2026, 1, 1, hour, minute)
+
+def run_checks(app, storage):
+    """Exercise the StorageBackend interface, returning the names of failed checks"""
+    failed = []
+
+    def check(name, condition):
+        logger.info(f"{'ok  ' if condition else 'FAIL'} {name}")
+        if not condition:
+            failed.append(name)
+
+    # Sessions
+    for hour, (user_id, sampled) in enumerate([('u1', False), ('u1', True), ('u1', False), ('u2', False)]):
+        storage.insert_session(f's{hour}', user_id, json.dumps({'n': hour}), 0.1 * hour, hour == 2,
+                               ts(hour), sampled=sampled)
+    check('recent_sessions newest first', storage.recent_sessions('u1', 2) == [json.dumps({'n': 2}), json.dumps({'n': 1})])
+    window = storage.session_window('u1', 10, since='2026-01-01 00:30:00')
+    check('session_window after since', [row[1] for row in window] == ['2026-01-01 02:00:00', '2026-01-01 01:00:00'])
+    check('iter_sessions in time order', [row[0] for row in storage.iter_sessions(page_size=2)] == ['s0', 's1', 's2', 's3'])
+    check('iter_sessions bounds', [row[0] for row in storage.iter_sessions('2026-01-01 01:00:00', '2026-01-01 02:30:00')]
+          == ['s1', 's2'])
+    users = storage.users_by_recency()
+    try:
+        check('users_by_recency', [row[1] for row in users] == ['u2', 'u1'])
+    finally:
+        getattr(users, 'close', lambda: None)()
+    storage.insert_session('s4', 'u1', json.dumps({'n': 4}), 0.0, False, ts(4), sampled=True,
+                           replace_since='2026-01-01 00:30:00')
+    check('insert_session replaces a sampled session', [row[0] for row in storage.iter_sessions()].count('s1') == 0)
+
+    # Model metadata
+    check('pending_users without models', storage.pending_users('2026-01-01 00:00:00', '', 10) == ['u1', 'u2'])
+    storage.save_model_metadata('u1', json.dumps({'version': 1}), 0.5, ts(5))
+    storage.save_model_metadata('u1', json.dumps({'version': 2}), 0.6, ts(6))
+    check('model metadata upsert', json.loads(storage.get_model_metadata('u1')) == {'version': 2})
+    check('get_model_metadata missing', storage.get_model_metadata('nobody') is None)
+    check('pending_users skips trained', storage.pending_users('2026-01-01 05:30:00', '', 10) == ['u2'])
+
+    # Security events
+    seqs = [storage.insert_security_event(uuid.uuid4().hex, user_id, 'test', 'low', f'event {i}', ts(7, i))
+            for i, user_id in enumerate(['u1', 'u2', 'u3'])]
+    check('event sequence increases', seqs == sorted(seqs) and len(set(seqs)) == 3)
+    check('security_events_head', storage.security_events_head() == seqs[-1])
+    check('security_events_after cursor', [row[0] for row in storage.security_events_after(seqs[0], 10)] == seqs[1:])
+    check('user_security_events', [row[2] for row in storage.user_security_events('u1', 5)] == ['event 0'])
+    # Purging the newest event must not let its sequence number be handed out again
+    storage.delete_user_rows('security_events', ['u3'], 10)
+    seq = storage.insert_security_event(uuid.uuid4().hex, 'u1', 'test', 'low', 'after purge', ts(8))
+    check('event sequence not reused after purge', seq > seqs[-1])
+
+    # Aggregates
+    bucket = '2026-01-01 09:00:00'
+    storage.merge_risk_rollups([(bucket, 'default', 'low', 2, 0, 1, 0.5)])
+    storage.merge_risk_rollups([(bucket, 'default', 'low', 3, 1, 0, 0.25)])
+    rollups = storage.risk_rollups_since('2026-01-01 08:00:00')
+    check('risk rollups merge', [tuple(row[3:]) for row in rollups] == [(5, 1, 1, 0.75)])
+    storage.merge_session_counters([('u1', bucket, 4, 1, 0.5)])
+    storage.merge_session_counters([('u1', bucket, 2, 1, 0.5)])
+    counters = list(storage.user_rows('user_session_counters', ['u1']))
+    check('session counters merge', [tuple(row[2:]) for row in counters] == [(6, 2, 1.0)])
+
+    # Session risk
+    check('session risk missing', storage.get_session_risk('u1', 'k1') is None)
+    storage.save_session_risk('u1', 'k1', 'low', 0.2, 1.0, ts(10))
+    storage.save_session_risk('u1', 'k1', 'medium', 0.9, 2.0, ts(11))
+    check('session risk upsert', tuple(storage.get_session_risk('u1', 'k1')[:3]) == ('medium', 0.9, 2.0))
+
+    # Data erasure and export
+    exported = {table: len(list(storage.user_rows(table, ['u1']))) for table in app.USER_DATA_TABLES}
+    check('user_rows covers every table', all(exported.values()))
+    for table in app.USER_DATA_TABLES:
+        while storage.delete_user_rows(table, ['u1'], 2):
+            pass
+    check('delete_user_rows erases the user', not any(list(storage.user_rows(table, ['u1']))
+                                                      for table in app.USER_DATA_TABLES))
+    check('delete_user_rows keeps other users', len(list(storage.user_rows('behavior_sessions', ['u2']))) == 1)
+
+    # Configuration
+    base = storage.config_version()
+    version = storage.save_config('global', json.dumps({'riskThreshold': 0.7}), base + 5, ts(12))
+    check('save_config honours min_version', version == base + 5)
+    check('save_config bumps version', storage.save_config('tenant', '{}', 0, ts(12)) == base + 6)
+    check('config_version', storage.config_version() == base + 6)
+    check('load_config', json.loads(storage.load_config()['global']) == {'riskThreshold': 0.7})
+    return failed
+
+def drop_schema(dsn, schema):
+    """Remove the scratch tenant's schema from a reused server"""
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    try:
+        conn.cursor().execute(f'DROP SCHEMA IF EXISTS "{schema}" CASCADE')
+        conn.commit()
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Exercise a BBCA storage backend')
+    parser.add_argument('backend', choices=['postgres', 'sqlite', 'memory'])
+    parser.add_argument('--dsn', help='existing PostgreSQL server to use instead of a throwaway cluster')
+    parser.add_argument('--pg-bin', help='directory holding initdb and pg_ctl')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    import app
+    logging.getLogger(app.__name__).setLevel(logging.WARNING)
+
+    with contextlib.ExitStack() as stack:
+        if args.backend == 'memory':
+            storage = app.MemoryStorage()
+        elif args.backend == 'sqlite':
+            scratch = stack.enter_context(tempfile.TemporaryDirectory(prefix='bbca_check_'))
+            storage = app.TenantRegistry(scratch).create_storage(CHECK_TENANT)
+        else:
+            dsn = args.dsn or stack.enter_context(local_postgres(args.pg_bin))
+            storage = app.PostgresStorage(dsn, f'{CHECK_TENANT}_{uuid.uuid4().hex[:8]}', pool_size=4)
+            stack.callback(drop_schema, dsn, storage.schema)
+        failed = run_checks(app, storage)
+
+    logger.info(f"{args.backend}: {'all checks passed' if not failed else f'{len(failed)} checks failed'}")
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""
+BBCA Replay - re-score stored behavior sessions against a candidate engine/config
+Streams behavior_sessions in time order, rebuilds each user's model as it would
+have existed at that point (a full refit every --retrain-every sessions once the
+user has enough history) and re-scores every session with the model trained on
+strictly earlier sessions. Users are partitioned across worker processes, so
+per-user ordering is preserved while partitions run in parallel.
+
+Run from the backend directory:
+    python replay.py --config candidate.json --workers 8 --output replay.csv
+    python replay.py --tenant acme --start 2024-01-01
+"""
+
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import queue
+import sys
+import time
+import zlib
+from collections import OrderedDict, deque
+
+logger = logging.getLogger('bbca.replay')
+
+NO_MODEL_ASSESSMENT = {
+    'anomaly_score': 0.0,
+    'is_anomaly': False,
+    'confidence': 0.0,
+    'risk_level': 'low',
+    'scored_by': 'no_model'
+}
+
+class UserReplayState:
+    """Per-user history and the sessions waiting to be scored by the current model"""
+
+    __slots__ = ('history', 'pending', 'since_train', 'version')
+
+    def __init__(self, history_size):
+        self.history = deque(maxlen=history_size)
+        self.pending = []
+        self.since_train = 0
+        self.version = 0
+
+class ReplayWorker:
+    """Replays one partition of users; runs inside a worker process"""
+
+    def __init__(self, engine, config, retrain_every, window, max_models):
+        self.engine = engine
+        self.config = config
+        self.retrain_every = retrain_every
+        self.window = window
+        self.max_models = max_models
+        self.states = {}
+        # user_id -> model_data, least recently used first; evicted models are
+        # rebuilt from the history window they were trained on
+        self.models = OrderedDict()
+
+    def model_for(self, user_id, state):
+        model_data = self.models.pop(user_id, None)
+        if model_data is None and state.version:
+            history = list(state.history)
+            window = history[:len(history) - state.since_train][-self.window:]
+            model_data, _ = self.engine.build_model(window, self.config, version=state.version)
+        if model_data is not None:
+            self.models[user_id] = model_data
+            if len(self.models) > self.max_models:
+                self.models.popitem(last=False)
+        return model_data
+
+    def flush(self, user_id, state):
+        """Score pending sessions with the model that existed before them"""
+        if not state.pending:
+            return []
+
+        model_data = self.model_for(user_id, state)
+        behavior_batch = [row['behavior'] for row in state.pending]
+        if model_data is None:
+            assessments = [NO_MODEL_ASSESSMENT] * len(behavior_batch)
+        else:
+            assessments = self.engine.score_model(model_data, behavior_batch, self.config)
+
+        results = []
+        for row, assessment in zip(state.pending, assessments):
+            results.append((
+                row['session_id'], user_id, row['timestamp'],
+                row['risk_score'], bool(row['anomaly_detected']),
+                assessment['anomaly_score'], assessment['is_anomaly'],
+                assessment['risk_level'], assessment['scored_by']
+            ))
+        state.pending = []
+        return results
+
+    def process(self, rows):
+        results = []
+        for row in rows:
+            user_id = row['user_id']
+            state = self.states.get(user_id)
+            if state is None:
+                state = self.states[user_id] = UserReplayState(self.window + self.retrain_every)
+
+            # Keep only the extracted features; raw payloads are not needed again
+            if 'featureSummary' not in row['behavior']:
+                row['behavior'] = {'featureSummary': self.engine.summarize_behavior(row['behavior'])}
+            state.pending.append(row)
+            state.history.append(row['behavior'])
+            state.since_train += 1
+
+            if len(state.history) >= 5 and state.since_train >= self.retrain_every:
+                results.extend(self.flush(user_id, state))
+                state.version += 1
+                state.since_train = 0
+                window = list(state.history)[-self.window:]
+                model_data, _ = self.engine.build_model(window, self.config, version=state.version)
+                self.models.pop(user_id, None)
+                self.models[user_id] = model_data
+                if len(self.models) > self.max_models:
+                    self.models.popitem(last=False)
+        return results
+
+    def finish(self):
+        results = []
+        for user_id, state in self.states.items():
+            results.extend(self.flush(user_id, state))
+        return results
+
+def run_worker(inbox, outbox, config_overrides, retrain_every, window, max_models, tenant_id=None):
+    """Worker process entry point"""
+    import app
+    logging.getLogger(app.__name__).setLevel(logging.WARNING)
+
+    # The config store inherited from the parent may predate the latest overrides
+    app.config_store.reload()
+    config = app.config_store.get(tenant_id)
+    config = dict(config, **config_overrides)
+    worker = ReplayWorker(app.tenants.engine(tenant_id), config, retrain_every, window, max_models)
+
+    while True:
+        rows = inbox.get()
+        if rows is None:
+            break
+        outbox.put(worker.process(rows))
+    outbox.put(worker.finish())
+    outbox.put(None)
+
+def stream_sessions(storage, start=None, end=None, page_size=5000):
+    """Stream stored sessions in time order"""
+    for row in storage.iter_sessions(start, end, page_size):
+        yield {
+            'session_id': row[0],
+            'user_id': row[1],
+            'behavior': json.loads(row[2]),
+            'risk_score': row[3] or 0.0,
+            'anomaly_detected': row[4],
+            'timestamp': row[5]
+        }
+
+class ReplaySummary:
+    """Aggregates stored vs replayed comparisons"""
+
+    def __init__(self, writer=None):
+        self.writer = writer
+        self.sessions = 0
+        self.stored_anomalies = 0
+        self.replay_anomalies = 0
+        self.newly_flagged = 0
+        self.no_longer_flagged = 0
+        self.score_delta_sum = 0.0
+        self.risk_levels = {}
+        self.scored_by = {}
+
+    def add(self, results):
+        for result in results:
+            _, _, _, stored_score, stored_anomaly, replay_score, replay_anomaly, risk_level, scored_by = result
+            self.sessions += 1
+            self.stored_anomalies += stored_anomaly
+            self.replay_anomalies += replay_anomaly
+            self.newly_flagged += replay_anomaly and not stored_anomaly
+            self.no_longer_flagged += stored_anomaly and not replay_anomaly
+            self.score_delta_sum += abs(replay_score - stored_score)
+            self.risk_levels[risk_level] = self.risk_levels.get(risk_level, 0) + 1
+            self.scored_by[scored_by] = self.scored_by.get(scored_by, 0) + 1
+            if self.writer:
+                self.writer.writerow(result)
+
+    def as_dict(self, elapsed):
+        sessions = self.sessions or 1
+        return {
+            'sessions': self.sessions,
+            'storedAnomalyRate': self.stored_anomalies / sessions,
+            'replayAnomalyRate': self.replay_anomalies / sessions,
+            'newlyFlagged': self.newly_flagged,
+            'noLongerFlagged': self.no_longer_flagged,
+            'meanAbsScoreDelta': self.score_delta_sum / sessions,
+            'riskLevels': self.risk_levels,
+            'scoredBy': self.scored_by,
+            'elapsedSeconds': round(elapsed, 2),
+            'sessionsPerSecond': round(self.sessions / elapsed, 1) if elapsed else 0.0
+        }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay stored BBCA sessions against a candidate config')
+    parser.add_argument('--config', help='JSON file of config overrides (e.g. riskThresholds, nEstimators)')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='number of replay processes (default: CPU count)')
+    parser.add_argument('--retrain-every', type=int, default=10,
+                        help='refit a user\'s model after this many new sessions (default: 10)')
+    parser.add_argument('--window', type=int, default=50, help='training window in sessions (default: 50)')
+    parser.add_argument('--max-models', type=int, default=2000,
+                        help='models kept in memory per worker; others are rebuilt on demand')
+    parser.add_argument('--chunk-size', type=int, default=500, help='rows handed to a worker at a time')
+    parser.add_argument('--start', help='only replay sessions at or after this timestamp')
+    parser.add_argument('--end', help='only replay sessions before this timestamp')
+    parser.add_argument('--output', help='write per-session comparisons to this CSV file')
+    parser.add_argument('--tenant', help='replay this tenant\'s sessions instead of the default tenant')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from app import tenants
+    storage = tenants.storage(args.tenant)
+
+    overrides = {}
+    if args.config:
+        with open(args.config) as f:
+            overrides = json.load(f)
+        from app import ConfigStore
+        ConfigStore().validate(overrides)
+
+    output = open(args.output, 'w', newline='') if args.output else None
+    writer = None
+    if output:
+        writer = csv.writer(output)
+        writer.writerow(['session_id', 'user_id', 'timestamp', 'stored_score', 'stored_anomaly',
+                         'replay_score', 'replay_anomaly', 'replay_risk_level', 'scored_by'])
+    summary = ReplaySummary(writer)
+
+    outbox = multiprocessing.Queue()
+    inboxes = [multiprocessing.Queue(maxsize=8) for _ in range(args.workers)]
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(
+            inbox, outbox, overrides, args.retrain_every, args.window, args.max_models, args.tenant
+        ))
+        for inbox in inboxes
+    ]
+    for worker in workers:
+        worker.start()
+
+    def drain(block=False):
+        finished = 0
+        while True:
+            try:
+                results = outbox.get(block=block, timeout=1 if block else None)
+            except queue.Empty:
+                return finished
+            if results is None:
+                finished += 1
+                if block:
+                    return finished
+            else:
+                summary.add(results)
+
+    started = time.monotonic()
+    chunks = [[] for _ in range(args.workers)]
+    for row in stream_sessions(storage, args.start, args.end):
+        partition = zlib.crc32(row['user_id'].encode()) % args.workers
+        chunks[partition].append(row)
+        if len(chunks[partition]) >= args.chunk_size:
+            # Blocks when that worker is behind, bounding memory
+            inboxes[partition].put(chunks[partition])
+            chunks[partition] = []
+            drain()
+
+    for partition, inbox in enumerate(inboxes):
+        if chunks[partition]:
+            inbox.put(chunks[partition])
+        inbox.put(None)
+
+    finished = 0
+    while finished < args.workers:
+        finished += drain(block=True)
+    for worker in workers:
+        worker.join()
+
+    if output:
+        output.close()
+
+    print(json.dumps(summary.as_dict(time.monotonic() - started), indent=2))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+BBCA Bulk Training - rebuild every user's behavior model offline
+Streams user IDs from behavior_sessions and trains them across a process pool
+using the same retrain_user flow as /api/bbca/train. Progress is checkpointed
+through behavior_models.last_updated: each run records its start time in
+--state-file, and the next run of the same tenant resumes from it (skipping
+users already trained) until a run finishes. --since overrides the saved
+value and --restart ignores it.
+
+Run from the backend directory:
+    python train_all.py --workers 8 --full
+    python train_all.py --tenant acme
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from datetime import datetime
+
+logger = logging.getLogger('bbca.train_all')
+
+# Set per worker process by init_worker
+worker_app = None
+worker_full = False
+worker_tenant = None
+
+def iter_pending_users(storage, since, page_size=1000, limit=None):
+    """Stream users with sessions whose model was not trained since `since`
+
+    Pages by user_id so no read transaction is held open while workers write.
+    """
+    last_user = ''
+    yielded = 0
+    while True:
+        user_ids = storage.pending_users(since, last_user, page_size)
+        if not user_ids:
+            return
+
+        for user_id in user_ids:
+            yield user_id
+            yielded += 1
+            if limit and yielded >= limit:
+                return
+        last_user = user_ids[-1]
+
+def load_state(path):
+    """tenant -> start time of its unfinished run"""
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def save_state(path, state):
+    from app import publish_file
+    publish_file(path, lambda f: f.write(json.dumps(state, indent=2).encode()))
+
+def init_worker(full, verbose, tenant_id=None):
+    """Import the backend once per worker process"""
+    global worker_app, worker_full, worker_tenant
+    import app
+    if not verbose:
+        logging.getLogger(app.__name__).setLevel(logging.WARNING)
+    app.config_store.reload()
+    worker_app = app
+    worker_full = full
+    worker_tenant = tenant_id
+
+def train_one(user_id):
+    """Train a single user's model, returning (user_id, status)"""
+    try:
+        config = worker_app.config_store.get(worker_tenant, user_id)
+        status, _ = worker_app.retrain_user(user_id, config, warm_start=not worker_full, tenant_id=worker_tenant)
+        return user_id, status
+    except Exception as e:
+        logger.error(f"Training failed for user {user_id}: {e}")
+        return user_id, 'failed'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Retrain BBCA behavior models for all users')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='number of training processes (default: CPU count)')
+    parser.add_argument('--full', action='store_true',
+                        help='refit from scratch instead of warm-starting existing models')
+    parser.add_argument('--since',
+                        help='skip users whose model was updated at or after this timestamp '
+                             '(default: the start of the interrupted run in --state-file, if any)')
+    parser.add_argument('--restart', action='store_true', help='ignore an interrupted run and start over')
+    parser.add_argument('--state-file', default='train_all_state.json',
+                        help='where unfinished runs are recorded for resuming (default: %(default)s)')
+    parser.add_argument('--limit', type=int, help='stop after this many users')
+    parser.add_argument('--chunksize', type=int, default=16, help='users handed to a worker at a time')
+    parser.add_argument('--report-every', type=float, default=10.0, help='seconds between progress reports')
+    parser.add_argument('--verbose', action='store_true', help='keep per-user backend logging')
+    parser.add_argument('--tenant', help='train this tenant\'s users instead of the default tenant')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+
+    from app import tenants
+    try:
+        tenant_id = tenants.validate(args.tenant)
+    except ValueError as e:
+        logger.error(str(e))
+        return 2
+    # Never create an empty tenant for a mistyped name
+    if not tenants.is_provisioned(tenant_id):
+        logger.error(f"Unknown tenant: {tenant_id}")
+        return 2
+    storage = tenants.storage(tenant_id)
+
+    state_key = tenant_id or ''
+    state = load_state(args.state_file)
+    if args.since:
+        since = args.since
+    elif state_key in state and not args.restart:
+        since = state[state_key]
+        logger.info(f"Resuming the interrupted run started at {since}")
+    else:
+        since = str(datetime.now())
+    state[state_key] = since
+    save_state(args.state_file, state)
+    logger.info(f"Training run checkpoint: --since '{since}'")
+
+    counts = {'trained': 0, 'up_to_date': 0, 'insufficient_data': 0, 'failed': 0}
+    started = time.monotonic()
+    last_report = started
+
+    with multiprocessing.Pool(args.workers, initializer=init_worker,
+                              initargs=(args.full, args.verbose, tenant_id)) as pool:
+        users = iter_pending_users(storage, since, limit=args.limit)
+        for _, status in pool.imap_unordered(train_one, users, chunksize=args.chunksize):
+            counts[status] = counts.get(status, 0) + 1
+
+            now = time.monotonic()
+            if now - last_report >= args.report_every:
+                processed = sum(counts.values())
+                logger.info(f"{processed} users processed, {processed / (now - started):.1f} users/s, {counts}")
+                last_report = now
+
+    elapsed = time.monotonic() - started
+    processed = sum(counts.values())
+    logger.info(
+        f"Done: {processed} users in {elapsed:.1f}s "
+        f"({processed / elapsed if elapsed else 0:.1f} users/s), {counts}"
+    )
+
+    # A --limit run that hit its limit may have users left; keep its checkpoint
+    if not args.limit or processed < args.limit:
+        state = load_state(args.state_file)
+        state.pop(state_key, None)
+        save_state(args.state_file, state)
+    return 1 if counts['failed'] else 0
+
+if __name__ == '__main__':
+    sys.exit(main())